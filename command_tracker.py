@@ -0,0 +1,183 @@
+# =========================================================
+# Comandos con id y confirmación (start / stop)
+# - Cada comando lleva cmd_id y sent_ts (epoch s); el firmware lo devuelve en
+#   T_EVENTS o T_STATE como "ack" / "cmd_id" / "last_cmd"
+# - Firmware sin ids: un evento del mismo tipo (p. ej. "stop") confirma el
+#   comando pendiente más viejo de ese tipo del dron
+# - Latencia envío -> confirmación por tipo (últimas WINDOW) con p50/p95/p99
+# - Los STOP sin confirmar se reenvían (mismo id) hasta su plazo; los demás
+#   comandos solo esperan ACK_TIMEOUT_S y quedan como no confirmados
+# =========================================================
+
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from event_log import EVENT_ALIASES
+
+ACK_KEYS = ("ack", "cmd_id", "last_cmd")
+
+# action -> (reenviar cada s, plazo total s); las demás no se reenvían
+RETRY_POLICY = {"stop": (1.0, 10.0)}
+ACK_TIMEOUT_S = 30.0
+WINDOW = 500
+
+
+class PendingCommand:
+    __slots__ = ("id", "device", "action", "topic", "payload", "qos", "sent_at", "last_sent",
+                 "attempts", "acked_at", "latency_s", "failed")
+
+    def __init__(self, cmd_id, device, topic, payload, qos, now):
+        self.id = cmd_id
+        self.device = device
+        self.action = payload.get("action", "?")
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.sent_at = now
+        self.last_sent = now
+        self.attempts = 1
+        self.acked_at = None
+        self.latency_s = None
+        self.failed = None          # motivo si se venció el plazo sin confirmación
+
+    @property
+    def done(self):
+        return self.acked_at is not None or self.failed is not None
+
+    def summary(self):
+        return {"id": self.id, "device": self.device, "action": self.action, "attempts": self.attempts,
+                "latency_s": self.latency_s, "failed": self.failed, "done": self.done}
+
+
+class CommandTracker:
+    """Envía comandos por el hub y mide cuánto tarda el dron en confirmarlos."""
+
+    TICK_S = 0.2
+
+    def __init__(self, hub, retry_policy=None, window=WINDOW):
+        self.hub = hub
+        self.retry_policy = RETRY_POLICY if retry_policy is None else retry_policy
+        self.window = window
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._prefix = f"{os.getpid() % 10000:04d}{int(time.time()) % 100000:05d}"
+        self._commands = {}             # id -> PendingCommand (pendientes y recientes)
+        self._recent = deque()          # ids en orden de envío, para olvidar los viejos
+        self._latency = {}              # action -> deque de latencias (s)
+        self._counts = {}               # action -> {"sent", "acked", "retries", "failed"}
+        self._watcher = None
+        hub.add_listener("events", lambda m: self._on_message(m, by_type=True))
+        hub.add_listener("state", lambda m: self._on_message(m, by_type=False))
+
+    # ---------- Envío ----------
+    def send(self, device, topic, payload, qos=1):
+        """Publica `payload` con cmd_id y sent_ts; devuelve el id. Lanza RuntimeError sin conexión."""
+        now = time.time()
+        cmd_id = f"{self._prefix}-{next(self._ids)}"
+        payload = dict(payload, cmd_id=cmd_id, sent_ts=round(now, 3))
+        self.hub.publish(topic, payload, qos=qos)
+        cmd = PendingCommand(cmd_id, device, topic, payload, qos, now)
+        with self._lock:
+            self._commands[cmd_id] = cmd
+            self._recent.append(cmd_id)
+            # Se olvidan los más viejos ya resueltos (los pendientes vencen solos)
+            while len(self._recent) > self.window and self._commands[self._recent[0]].done:
+                del self._commands[self._recent.popleft()]
+            self._count(cmd.action, "sent")
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="cmd-retry", daemon=True)
+                self._watcher.start()
+        return cmd_id
+
+    def _count(self, action, what, n=1):
+        counts = self._counts.setdefault(action, {"sent": 0, "acked": 0, "retries": 0, "failed": 0})
+        counts[what] += n
+
+    # ---------- Confirmaciones ----------
+    def _on_message(self, m, by_type):
+        data = m.data
+        if not isinstance(data, dict):
+            return
+        with self._lock:
+            cmd = None
+            for key in ACK_KEYS:
+                value = data.get(key)
+                if isinstance(value, str) and value in self._commands:
+                    cmd = self._commands[value]
+                    break
+            if cmd is None and by_type and not any(k in data for k in ACK_KEYS):
+                # Firmware sin ids: el evento del mismo tipo confirma el pendiente más viejo
+                raw = data.get("type", data.get("event", data.get("ev")))
+                action = EVENT_ALIASES.get(str(raw).strip().lower(), str(raw).strip().lower())
+                pending = [c for c in self._commands.values()
+                           if c.device == m.device and c.action == action and not c.done]
+                cmd = min(pending, key=lambda c: c.sent_at) if pending else None
+            if cmd is None or cmd.done:
+                return
+            cmd.acked_at = m.t
+            cmd.latency_s = max(0.0, m.t - cmd.sent_at)
+            self._latency.setdefault(cmd.action, deque(maxlen=self.window)).append(cmd.latency_s)
+            self._count(cmd.action, "acked")
+        self.hub.log(f"ACK {cmd.action} {cmd.id} de {cmd.device} en {cmd.latency_s * 1000:.0f} ms")
+
+    # ---------- Reintentos ----------
+    def _watch(self):
+        while True:
+            time.sleep(self.TICK_S)
+            now = time.time()
+            resend, expired = [], []
+            with self._lock:
+                for cmd in self._commands.values():
+                    if cmd.done:
+                        continue
+                    every_s, deadline_s = self.retry_policy.get(cmd.action, (None, ACK_TIMEOUT_S))
+                    if now - cmd.sent_at >= deadline_s:
+                        cmd.failed = f"sin confirmación tras {deadline_s:.0f} s ({cmd.attempts} envíos)"
+                        self._count(cmd.action, "failed")
+                        expired.append(cmd)
+                    elif every_s is not None and now - cmd.last_sent >= every_s:
+                        resend.append(cmd)
+            for cmd in expired:
+                self.hub.log(f"{cmd.action.upper()} {cmd.id} a {cmd.device}: {cmd.failed}")
+            for cmd in resend:
+                if not self.hub.connected:
+                    continue
+                try:
+                    # Mismo cmd_id: el firmware aplica el comando una sola vez
+                    self.hub.publish(cmd.topic, dict(cmd.payload, retry=cmd.attempts), qos=cmd.qos, log=False)
+                except RuntimeError:
+                    continue
+                with self._lock:
+                    cmd.last_sent = time.time()
+                    cmd.attempts += 1
+                    self._count(cmd.action, "retries")
+
+    # ---------- Consultas ----------
+    def result(self, cmd_id):
+        with self._lock:
+            cmd = self._commands.get(cmd_id)
+            return cmd.summary() if cmd is not None else None
+
+    def latencies(self, action):
+        """Últimas latencias (s) de `action`, de la más vieja a la más reciente."""
+        with self._lock:
+            return np.array(self._latency.get(action, ()), dtype=np.float64)
+
+    def stats(self):
+        """{action: enviados, confirmados, reintentos, fallidos, pendientes y p50/p95/p99/max en ms}."""
+        with self._lock:
+            out = {}
+            for action, counts in self._counts.items():
+                row = dict(counts)
+                row["pending"] = sum(1 for c in self._commands.values() if c.action == action and not c.done)
+                lat = np.array(self._latency.get(action, ()), dtype=np.float64) * 1000
+                for name, q in (("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99)):
+                    row[name] = float(np.percentile(lat, q)) if len(lat) else None
+                row["max_ms"] = float(lat.max()) if len(lat) else None
+                out[action] = row
+            return out
@@ -0,0 +1,192 @@
+# =========================================================
+# Configuración compartida por el dashboard (prueba.py) y la
+# ingesta sin interfaz (ingest.py)
+# - Broker, tópicos, archivos del historial y política de validación
+# - Flota: tópicos con comodín y un historial/checkpoint por dron
+# - Fábricas del almacén, los eventos, las misiones, los resúmenes, el hub MQTT
+#   y el gestor de descargas
+# =========================================================
+
+import os
+import re
+
+from event_log import FleetEvents
+from history_store import DayPartitionStore, FleetHistory, SqliteStore
+from log_transfer import FleetDownloads
+from missions import FleetMissions
+from rollups import FleetRollups
+from mqtt_hub import MqttHub
+from validation import make_policy
+
+
+# ---------- Configuración (st.secrets o variable de entorno) ----------
+def get_setting(name, default):
+    try:
+        import streamlit as st
+        value = st.secrets.get(name, None)
+        if value:
+            return str(value).strip()
+    except Exception:
+        pass
+    value_env = os.environ.get(name, "").strip()
+    if value_env:
+        return value_env
+    return default
+
+# ---------- Archivo de datos persistente ----------
+DATA_FILE = "drone_data.csv"        # CSV plano heredado; solo se importa una vez
+HISTORY_DIR = "drone_history"        # <dron>/ particiones por día, o <dron>.db (sqlite)
+INGEST_STATUS = "ingest_status.json"    # último estado de python -m ingest
+DATA_COLUMNS = ["ts","lat","lon","alt","drop_id","speed_mps","sats","fix_ok"]
+LOCAL_TZ = "America/Mexico_City"
+
+HISTORY_BACKEND = get_setting("HISTORY_BACKEND", "files").lower()
+
+# Quién escribe el historial: "dashboard" (la página descarga el log) o
+# "daemon" (python -m ingest; la página solo lo muestra)
+INGEST_MODE = get_setting("INGEST", "dashboard").lower()
+
+# Recorrido en vivo (T_STATE): puntos por dron en memoria, puntos dibujados
+# y refresco del mapa en s (0.1 = 10 Hz)
+LIVE_CAPACITY = int(get_setting("LIVE_CAPACITY", "3600"))
+LIVE_POINTS = int(get_setting("LIVE_POINTS", "300"))
+LIVE_REFRESH_S = min(1.0, max(0.1, float(get_setting("LIVE_REFRESH_S", "1.0"))))
+
+# Mapa del historial: con más puntos que esto se dibujan celdas agregadas
+MAP_MAX_POINTS = int(get_setting("MAP_MAX_POINTS", "5000"))
+
+# Filas que no se guardan (lat/lon fuera de rango, ts sin hora válida, etc.)
+VALIDATION = make_policy(require_fix=get_setting("REQUIRE_FIX", "0") == "1")
+
+# =========================================================
+# MQTT CONFIG (HiveMQ Cloud, WebSockets TLS)
+# =========================================================
+BROKER_HOST    = "3f78afad5f2e407c85dd2eb93951af78.s1.eu.hivemq.cloud"
+BROKER_PORT_WS = 8884
+BROKER_WS_PATH = "/mqtt"
+BROKER_USER    = "AdrianFB"
+BROKER_PASS    = "Ab451278"
+
+# Dron por defecto (comandos y datos heredados) y flota conocida de antemano;
+# los demás drones se agregan solos al publicar en drone/<id>/...
+DEV_ID = get_setting("DEV_ID", "drone-001")
+FLEET = [d.strip() for d in get_setting("FLEET", DEV_ID).split(",") if d.strip()]
+
+T_STATE    = "drone/+/state"
+T_INFO     = "drone/+/info"
+T_LOGPART  = "drone/+/log/part"
+T_EVENTS   = "drone/+/events"
+
+# El id del dron termina en nombres de archivo: nada de "/", ".." ni espacios
+_DEVICE_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+
+def valid_device(device):
+    return bool(device) and _DEVICE_RE.match(device) is not None
+
+
+def cmd_topic(device):
+    return f"drone/{device}/cmd"
+
+
+def checkpoint_path(device):
+    return f"log_checkpoint-{device}.json"
+
+
+# =========================================================
+# Fábricas
+# =========================================================
+def history_dir(device):
+    return os.path.join(HISTORY_DIR, device)
+
+
+def history_db(device):
+    return os.path.join(HISTORY_DIR, f"{device}.db")
+
+
+def open_store(device, backend=HISTORY_BACKEND):
+    if not valid_device(device):
+        raise ValueError(f"Id de dron inválido: {device!r}")
+    if backend == "sqlite":
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        return SqliteStore(history_db(device), DATA_COLUMNS, LOCAL_TZ)
+    return DayPartitionStore(history_dir(device), DATA_COLUMNS, LOCAL_TZ)
+
+
+def events_path(device):
+    # Al lado del historial del dron, sirve para ambos backends
+    return os.path.join(HISTORY_DIR, f"{device}.events.jsonl")
+
+
+def missions_path(device):
+    return os.path.join(HISTORY_DIR, f"{device}.missions.json")
+
+
+def rollups_path(device):
+    return os.path.join(HISTORY_DIR, f"{device}.rollups.json")
+
+
+def stored_devices(backend=HISTORY_BACKEND):
+    """Drones con historial en disco (sin abrir nada)."""
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    names = os.listdir(HISTORY_DIR)
+    if backend == "sqlite":
+        devices = [n[:-len(".db")] for n in names if n.endswith(".db")]
+    else:
+        devices = [n for n in names if os.path.isdir(os.path.join(HISTORY_DIR, n))]
+    return sorted(d for d in devices if valid_device(d))
+
+
+def open_history(backend=HISTORY_BACKEND):
+    return FleetHistory(lambda device: open_store(device, backend),
+                        devices=[DEV_ID] + FLEET + stored_devices(backend))
+
+
+def open_events():
+    return FleetEvents(events_path)
+
+
+def open_missions(history, writable=True):
+    return FleetMissions(history, missions_path, writable=writable)
+
+
+def open_rollups(history, writable=True):
+    return FleetRollups(history, rollups_path, writable=writable)
+
+
+def migrate_legacy(history, backend=HISTORY_BACKEND):
+    """
+    Importaciones únicas (idempotentes). Devuelve los mensajes para el diagnóstico.
+    - Al pasar a SQLite: particiones de archivo de cada dron -> su base
+    - Almacén vacío: CSV heredado -> dron por defecto
+    """
+    notes = []
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    if backend == "sqlite":
+        for device in stored_devices("files"):
+            store = history.store(device)
+            if store.days():
+                continue
+            files_store = DayPartitionStore(history_dir(device), DATA_COLUMNS, LOCAL_TZ)
+            n = sum(store.append(files_store.load_day(d)) for d in files_store.days())
+            if n:
+                notes.append(f"Importados {n} puntos desde {history_dir(device)}/ a {history_db(device)}")
+
+    store = history.store(DEV_ID)
+    if not store.days() and os.path.exists(DATA_FILE):
+        n = store.import_csv(DATA_FILE, policy=VALIDATION)
+        notes.append(f"Importados {n} puntos desde {DATA_FILE} al historial de {DEV_ID}")
+    return notes
+
+
+def make_hub(client_prefix="st-hub", echo=None):
+    return MqttHub(BROKER_HOST, BROKER_PORT_WS, BROKER_WS_PATH, BROKER_USER, BROKER_PASS,
+                   topics={"state": (T_STATE, 1), "info": (T_INFO, 1),
+                           "logpart": (T_LOGPART, 1), "events": (T_EVENTS, 0)},
+                   raw_kinds=("logpart",), client_prefix=client_prefix, echo=echo)
+
+
+def make_downloads(hub, history):
+    return FleetDownloads(hub, history, DATA_COLUMNS, cmd_topic, checkpoint_path,
+                          policy=VALIDATION)
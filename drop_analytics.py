@@ -0,0 +1,184 @@
+# =========================================================
+# Análisis de los drops: ¿cayeron las pelotas a la distancia pedida?
+# - Pares de drops consecutivos por dron (haversine entre uno y el siguiente)
+# - Desvío respecto a la separación pedida, huecos y racimos
+# - Velocidad, altitud y calidad GPS (sats, fix_ok)
+# Todo en columnas numpy; el resultado queda en caché por día y selección
+# =========================================================
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from missions import mission_breaks
+from spatial_index import haversine_m
+
+GAP_S = 60.0                # dentro de una misión, más de esto entre drops es un hueco
+GAP_FACTOR = 1.5            # ... o una separación mayor a 1.5 × la pedida
+CLUSTER_FACTOR = 0.5        # separación menor a la mitad de la pedida: racimo
+TOLERANCES = (0.1, 0.2)     # fracción de drops dentro de ±10 % y ±20 % de lo pedido
+
+
+def _stats(values, percentiles=(50, 95)):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {"n": 0, "mean": None, "std": None, "min": None, "max": None,
+                **{f"p{p}": None for p in percentiles}}
+    pct = np.percentile(values, percentiles)
+    return {"n": int(len(values)), "mean": float(values.mean()), "std": float(values.std()),
+            "min": float(values.min()), "max": float(values.max()),
+            **{f"p{p}": float(v) for p, v in zip(percentiles, pct)}}
+
+
+def drop_rows(df):
+    """
+    Una fila por drop, ordenadas por (device, ts), con la columna `segment`:
+    corta donde cambia el dron o empieza otra misión (missions.mission_breaks).
+    """
+    device = df["device"].to_numpy() if "device" in df.columns else np.zeros(len(df), dtype=object)
+    order = np.lexsort((df["drop_id"].to_numpy(np.float64), df["ts"].to_numpy(np.float64),
+                        pd.factorize(device)[0]))
+    rows = df.iloc[order].reset_index(drop=True)
+    device = device[order]
+    drop_id = rows["drop_id"].to_numpy(np.float64)
+    ts = rows["ts"].to_numpy(np.float64)
+    same_device = np.r_[False, device[1:] == device[:-1]]
+    # Telemetría repetida del mismo drop: se queda la primera fila
+    keep = ~(same_device & np.r_[False, drop_id[1:] == drop_id[:-1]])
+    rows = rows[keep].reset_index(drop=True)
+    device, drop_id, ts = device[keep], drop_id[keep], ts[keep]
+    same_device = np.r_[False, device[1:] == device[:-1]]
+    new_segment = ~same_device | mission_breaks(ts, drop_id)
+    rows["segment"] = np.cumsum(new_segment) - 1
+    return rows
+
+
+def drop_pairs(rows):
+    """Pares de drops consecutivos de la misma misión (rows de drop_rows)."""
+    seg = rows["segment"].to_numpy()
+    nxt = np.flatnonzero(seg[1:] == seg[:-1]) + 1     # cada par es (nxt - 1, nxt)
+    prv = nxt - 1
+    lat, lon = rows["lat"].to_numpy(np.float64), rows["lon"].to_numpy(np.float64)
+    ts, drop_id = rows["ts"].to_numpy(np.float64), rows["drop_id"].to_numpy(np.float64)
+    pairs = pd.DataFrame({
+        "segment": seg[nxt],
+        "drop_from": drop_id[prv], "drop_to": drop_id[nxt],
+        "ts": ts[nxt], "dt_s": ts[nxt] - ts[prv],
+        "spacing_m": haversine_m(lat[prv], lon[prv], lat[nxt], lon[nxt]),
+        "skipped": np.maximum(drop_id[nxt] - drop_id[prv] - 1, 0),
+        "speed_mps": rows["speed_mps"].to_numpy(np.float64)[nxt],
+        "sats": rows["sats"].to_numpy(np.float64)[nxt],
+        "fix_ok": rows["fix_ok"].to_numpy(np.float64)[nxt],
+    })
+    if "device" in rows.columns:
+        pairs.insert(0, "device", rows["device"].to_numpy()[nxt])
+    return pairs
+
+
+def spacing_quality(pairs, target_m):
+    """Desvío de la separación medida respecto a `target_m`, huecos y racimos."""
+    spacing = pairs["spacing_m"].to_numpy(np.float64)
+    dev = spacing - target_m
+    valid = ~np.isnan(dev)
+    out = {"target_m": target_m, "deviation": _stats(dev),
+           "abs_deviation_mean": float(np.abs(dev[valid]).mean()) if valid.any() else None,
+           "rmse": float(np.sqrt(np.mean(dev[valid] ** 2))) if valid.any() else None}
+    for tol in TOLERANCES:
+        out[f"within_{int(tol * 100)}pct"] = float(np.mean(np.abs(dev[valid]) <= tol * target_m)) if valid.any() else None
+
+    with np.errstate(invalid="ignore"):
+        gap = ((pairs["dt_s"].to_numpy() > GAP_S) | (pairs["skipped"].to_numpy() > 0)
+               | (spacing > GAP_FACTOR * target_m))
+        close = spacing < CLUSTER_FACTOR * target_m
+    # Racimo: tramo de pares seguidos demasiado juntos dentro de la misma misión
+    seg = pairs["segment"].to_numpy()
+    starts = close & ~np.r_[False, close[:-1] & (seg[1:] == seg[:-1])]
+    cluster_id = np.cumsum(starts) - 1
+    sizes = np.bincount(cluster_id[close], minlength=int(starts.sum())) + 1   # drops = pares + 1
+    out["gaps"] = pairs[gap]
+    out["clusters"] = int(starts.sum())
+    out["cluster_drops"] = int(sizes.sum()) if len(sizes) else 0
+    out["pairs_flagged"] = int(gap.sum() + close.sum())
+    return out
+
+
+def gps_breakdown(rows, pairs, target_m):
+    """Por número de satélites: drops, % fix_ok y desvío medio de la separación."""
+    by_sats = rows.groupby(rows["sats"].fillna(-1), sort=True).agg(
+        drops=("ts", "size"), fix_ok=("fix_ok", "mean"))
+    dev = (pairs["spacing_m"] - target_m).abs()
+    by_sats["abs_deviation_m"] = dev.groupby(pairs["sats"].fillna(-1)).mean()
+    by_sats.index = by_sats.index.map(lambda s: "?" if s < 0 else int(s))
+    by_sats.index.name = "sats"
+    by_fix = dev.groupby(pairs["fix_ok"].fillna(-1)).agg(["size", "mean"])
+    by_fix.index = by_fix.index.map({1.0: "fix_ok=1", 0.0: "fix_ok=0", -1.0: "sin dato"}.get)
+    by_fix.columns = ["pares", "abs_deviation_m"]
+    return by_sats.reset_index(), by_fix
+
+
+def mission_summary(rows, pairs, target_m):
+    """Una fila por misión (segment): drops, duración, separación y desvío medios."""
+    seg_rows = rows.groupby("segment", sort=True)
+    out = pd.DataFrame({
+        "start_ts": seg_rows["ts"].min(), "end_ts": seg_rows["ts"].max(),
+        "drops": seg_rows["ts"].size(),
+        "drop_first": seg_rows["drop_id"].min(), "drop_last": seg_rows["drop_id"].max(),
+        "speed_mean": seg_rows["speed_mps"].mean(),
+    })
+    if "device" in rows.columns:
+        out.insert(0, "device", seg_rows["device"].first())
+    seg_pairs = pairs.groupby("segment")
+    out["spacing_mean"] = seg_pairs["spacing_m"].mean()
+    out["abs_deviation_m"] = (pairs["spacing_m"] - target_m).abs().groupby(pairs["segment"]).mean()
+    out["duration_s"] = out["end_ts"] - out["start_ts"]
+    return out.reset_index()
+
+
+def analyze(df, target_m):
+    """Todas las métricas de los drops de `df` (filas de uno o varios drones)."""
+    if df is None or df.empty:
+        return None
+    rows = drop_rows(df)
+    pairs = drop_pairs(rows)
+    by_sats, by_fix = gps_breakdown(rows, pairs, target_m)
+    return {
+        "drops": len(rows),
+        "missions": int(rows["segment"].max()) + 1,
+        "spacing": _stats(pairs["spacing_m"].to_numpy(np.float64), (10, 50, 90)),
+        "quality": spacing_quality(pairs, target_m),
+        "speed": _stats(rows["speed_mps"].to_numpy(np.float64), (50, 95)),
+        "alt": _stats(rows["alt"].to_numpy(np.float64), (5, 50, 95)),
+        "gps_ok_rate": float(np.nanmean(rows["fix_ok"].to_numpy(np.float64))) if rows["fix_ok"].notna().any() else None,
+        "by_sats": by_sats,
+        "by_fix": by_fix,
+        "missions_table": mission_summary(rows, pairs, target_m),
+        "pairs": pairs,
+    }
+
+
+class DropAnalytics:
+    """
+    Resultados de analyze() compartidos por todas las sesiones (se crea una
+    vez con st.cache_resource), por (clave, separación pedida, versión de datos).
+    La clave la pone quien llama: (día, drones) o una misión.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, target_m, version, df):
+        key = (key, float(target_m), version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        result = analyze(df, float(target_m))
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
@@ -0,0 +1,256 @@
+# =========================================================
+# Eventos del dron (T_EVENTS): drops, fallas de motor, armado, paradas
+# - EventLog: un archivo JSON Lines append-only por dron junto al historial,
+#   con un índice en memoria por columnas ordenado por ts (consultas por
+#   rango en O(log n), ts de cada drop en un dict)
+# - El índice se pone al día leyendo solo la cola nueva del archivo, así el
+#   dashboard ve lo que escribe python -m ingest
+# - FleetEvents: un EventLog por dron y el listener del hub que los llena
+# =========================================================
+
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+EVENT_FIELDS = ("ts", "type", "drop_id", "lat", "lon", "data")
+_NUM_FIELDS = ("ts", "drop_id", "lat", "lon")
+
+# Nombres que usa el firmware -> tipo normalizado
+EVENT_ALIASES = {
+    "drop": "drop", "release": "drop", "drop_done": "drop",
+    "motor_fault": "motor_fault", "motor": "motor_fault", "fault": "motor_fault",
+    "arm": "arm", "armed": "arm",
+    "disarm": "disarm", "disarmed": "disarm",
+    "stop": "stop", "estop": "stop", "emergency_stop": "stop",
+}
+
+
+def _num(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(value) else value
+
+
+def decode_event(data, t):
+    """Registro EVENT_FIELDS de un mensaje de T_EVENTS (dict JSON o texto), o None."""
+    if isinstance(data, dict):
+        raw = data.get("type", data.get("event", data.get("ev")))
+        rest = {k: v for k, v in data.items() if k not in ("type", "event", "ev", "ts", "drop_id", "lat", "lon")}
+        ts, drop_id = _num(data.get("ts")), _num(data.get("drop_id"))
+        lat, lon = _num(data.get("lat")), _num(data.get("lon"))
+    elif isinstance(data, str) and data.strip():
+        raw, rest, ts, drop_id, lat, lon = data.strip(), {}, None, None, None, None
+    else:
+        return None
+    if raw is None:
+        return None
+    name = str(raw).strip().lower().replace(" ", "_")
+    if lat is not None and lon is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        lat = lon = None
+    return {"ts": ts if ts is not None else round(t, 3), "type": EVENT_ALIASES.get(name, name),
+            "drop_id": drop_id, "lat": lat, "lon": lon, "data": rest or None}
+
+
+class EventLog:
+    """
+    Eventos de un dron en <path> (una línea JSON por evento), indexados por ts.
+    En memoria van por columnas (arrays de numpy ordenados por ts, con lugar
+    de sobra al final): lo que llega en orden se escribe a continuación y lo
+    atrasado se inserta con searchsorted; lo ya indexado no se modifica.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offset = 0            # bytes del archivo ya indexados
+        self._reset()
+
+    def _reset(self):
+        self._n = 0                 # eventos indexados (el resto de cada array es espacio libre)
+        self._cols = {c: np.empty(0, dtype=np.float64 if c in _NUM_FIELDS else object)
+                      for c in EVENT_FIELDS}
+        self._drop_ts = {}          # drop_id -> ts de su primer evento
+
+    def _col(self, c):
+        return self._cols[c][:self._n]
+
+    # ---------- Índice ----------
+    def _refresh(self):
+        """Indexa las líneas completas que se agregaron al archivo (de este u otro proceso)."""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self._offset:
+            # El archivo se recortó o reemplazó: reindexar desde cero
+            self._offset = 0
+            self._reset()
+        if size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        end = chunk.rfind(b"\n") + 1    # una línea a medias se lee en la próxima
+        self._offset += end
+        new, pending = [], set()
+        for line in chunk[:end].splitlines():
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(ev, dict) or _num(ev.get("ts")) is None:
+                continue
+            if self._is_new(ev, pending):
+                new.append(ev)
+        self._add(new)
+
+    def _is_new(self, ev, pending):
+        """
+        Descarta repetidos (mismo ts, type y drop_id): se comparan solo los
+        eventos indexados con ese ts; `pending` son las claves del lote en curso.
+        """
+        ts, kind, drop_id = float(ev["ts"]), ev.get("type"), _num(ev.get("drop_id"))
+        key = (ts, kind, drop_id)
+        if key in pending:
+            return False
+        ts_col = self._col("ts")
+        i, j = np.searchsorted(ts_col, ts, side="left"), np.searchsorted(ts_col, ts, side="right")
+        types, drops = self._cols["type"], self._cols["drop_id"]
+        for k in range(i, j):
+            same_drop = np.isnan(drops[k]) if drop_id is None else drops[k] == drop_id
+            if types[k] == kind and same_drop:
+                return False
+        pending.add(key)
+        return True
+
+    def _add(self, new):
+        if not new:
+            return
+        new.sort(key=lambda ev: float(ev["ts"]))
+        cols = {c: np.array([_num(ev.get(c)) for ev in new], dtype=np.float64) for c in _NUM_FIELDS}
+        for c in EVENT_FIELDS:
+            if c not in _NUM_FIELDS:
+                cols[c] = np.empty(len(new), dtype=object)
+                cols[c][:] = [ev.get(c) for ev in new]
+        n, k = self._n, len(new)
+        if n and cols["ts"][0] < self._cols["ts"][n - 1]:
+            # Llegó algo atrasado: inserción ordenada en arrays nuevos
+            pos = np.searchsorted(self._col("ts"), cols["ts"], side="right")
+            self._cols = {c: np.insert(self._col(c), pos, cols[c]) for c in EVENT_FIELDS}
+        else:
+            if n + k > len(self._cols["ts"]):
+                cap = max(n + k, 2 * n, 64)
+                for c in EVENT_FIELDS:
+                    grown = np.empty(cap, dtype=self._cols[c].dtype)
+                    grown[:n] = self._cols[c][:n]
+                    self._cols[c] = grown
+            for c in EVENT_FIELDS:
+                self._cols[c][n:n + k] = cols[c]
+        self._n = n + k
+        for ts, drop_id in zip(cols["ts"], cols["drop_id"]):
+            if not np.isnan(drop_id) and ts < self._drop_ts.get(drop_id, np.inf):
+                self._drop_ts[float(drop_id)] = float(ts)
+
+    # ---------- Escritura ----------
+    def append(self, events):
+        """Guarda los eventos nuevos (los repetidos se omiten). Devuelve cuántos se guardaron."""
+        with self._lock:
+            self._refresh()
+            pending = set()
+            new = [ev for ev in events if self._is_new(ev, pending)]
+            if not new:
+                return 0
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            data = "".join(json.dumps(ev, separators=(",", ":")) + "\n" for ev in new).encode("utf-8")
+            with open(self.path, "ab") as f:
+                f.write(data)
+            self._offset += len(data)
+            self._add(new)
+            return len(new)
+
+    # ---------- Consultas ----------
+    def version(self):
+        with self._lock:
+            self._refresh()
+            return self._n
+
+    def between(self, ts_a, ts_b):
+        """Columnas EVENT_FIELDS de los eventos con ts_a <= ts < ts_b, del más viejo al más nuevo."""
+        with self._lock:
+            self._refresh()
+            i, j = np.searchsorted(self._col("ts"), [ts_a, ts_b], side="left")
+            return {c: self._cols[c][i:j] for c in EVENT_FIELDS}
+
+    def drop_ts(self, drop_id):
+        """ts del evento de ese drop (el primero), o None."""
+        with self._lock:
+            self._refresh()
+            return self._drop_ts.get(drop_id)
+
+    def near_drop(self, drop_id, window_s=30.0, ts=None):
+        """Eventos a ±window_s del drop (su evento o, si no hay, el ts dado)."""
+        center = self.drop_ts(drop_id)
+        center = ts if center is None else center
+        if center is None:
+            return {c: [] for c in EVENT_FIELDS}
+        return self.between(center - window_s, center + window_s + 1e-6)
+
+
+def events_frame(events, device=None):
+    """DataFrame EVENT_FIELDS (más device si se da) de una lista de eventos o de sus columnas."""
+    df = pd.DataFrame(events, columns=EVENT_FIELDS)
+    for c in ("ts", "drop_id", "lat", "lon"):
+        df[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+    if device is not None:
+        df["device"] = device
+    return df
+
+
+class FleetEvents:
+    """Un EventLog por dron (abierto al primer uso); attach() lo llena desde el hub."""
+
+    def __init__(self, path_fn):
+        self._path_fn = path_fn         # device -> ruta del archivo de eventos
+        self._lock = threading.Lock()
+        self._logs = {}
+        self.rejected = 0
+
+    def log(self, device):
+        with self._lock:
+            log = self._logs.get(device)
+            if log is None:
+                log = self._logs[device] = EventLog(self._path_fn(device))
+            return log
+
+    def attach(self, hub, accept_device=None):
+        """Registra el listener de "events": cada mensaje se guarda al llegar."""
+        def on_event(m):
+            if accept_device is not None and not accept_device(m.device):
+                return
+            ev = decode_event(m.data, m.t)
+            if ev is None:
+                self.rejected += 1
+                return
+            self.log(m.device).append([ev])
+        hub.add_listener("events", on_event)
+        return on_event
+
+    def version(self, devices):
+        return tuple(self.log(d).version() for d in devices)
+
+    def between(self, devices, ts_a, ts_b):
+        """Eventos de los drones elegidos en [ts_a, ts_b), ordenados por ts."""
+        frames = [events_frame(self.log(d).between(ts_a, ts_b), d) for d in devices]
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return events_frame([], None).assign(device=pd.Series(dtype=object))
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        return df.sort_values("ts", kind="stable", ignore_index=True)
+
+    def near_drop(self, device, drop_id, window_s=30.0, ts=None):
+        return events_frame(self.log(device).near_drop(drop_id, window_s, ts), device)
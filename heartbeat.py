@@ -0,0 +1,89 @@
+# =========================================================
+# Latido de los drones (T_INFO) y salud del enlace
+# - Ventana deslizante de llegadas por dron (listener del hub)
+# - Frecuencia, periodo (mediana), jitter y pérdida estimada por huecos
+# - Estado evaluado en cada consulta contra el reloj, no solo al llegar:
+#   unknown (menos de 2 latidos) -> online -> degraded -> stale
+# =========================================================
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+WINDOW = 60                 # latidos que se guardan por dron
+DEFAULT_PERIOD_S = 5.0      # hasta tener dos latidos
+DEGRADED_MISSES = 2.0       # sin latido por más de 2 periodos: degradado
+STALE_MISSES = 4.0          # ... por más de 4 periodos: perdido
+STALE_MAX_S = 11.0          # y nunca más de 11 s (el criterio anterior de "en línea")
+LOSS_DEGRADED = 0.10        # pérdida en la ventana que ya degrada el enlace
+JITTER_DEGRADED = 0.5       # jitter (desvío de los intervalos) relativo al periodo
+
+LINK_STATES = ("unknown", "online", "degraded", "stale")
+
+
+def link_health(arrivals, now, connected=True):
+    """Métricas y estado de una secuencia de llegadas (epoch s, en orden)."""
+    t = np.asarray(arrivals, dtype=np.float64)
+    out = {"state": "unknown", "beats": int(len(t)), "age_s": None, "rate_hz": None,
+           "period_s": None, "jitter_ms": None, "loss": None}
+    if not len(t):
+        return out
+    age = max(0.0, float(now - t[-1]))
+    out["age_s"] = age
+    period = DEFAULT_PERIOD_S
+    if len(t) >= 2:
+        iv = np.diff(t)
+        period = max(float(np.median(iv)), 1e-3)
+        # Latidos que faltan: cada intervalo de ~k periodos esconde k-1 perdidos
+        missed = np.maximum(np.rint(iv / period) - 1, 0).sum()
+        out.update(rate_hz=float(len(iv) / max(t[-1] - t[0], 1e-3)), period_s=period,
+                   jitter_ms=float(iv.std()) * 1000, loss=float(missed / (missed + len(iv))))
+    stale_s = min(STALE_MISSES * period, STALE_MAX_S)
+    if not connected or age > stale_s:
+        out["state"] = "stale"
+    elif len(t) < 2:
+        out["state"] = "unknown"
+    elif (age > DEGRADED_MISSES * period or out["loss"] >= LOSS_DEGRADED
+          or out["jitter_ms"] / 1000 > JITTER_DEGRADED * period):
+        out["state"] = "degraded"
+    else:
+        out["state"] = "online"
+    return out
+
+
+class HeartbeatMonitor:
+    """Llegadas de T_INFO por dron; health()/states() evalúan el estado en el momento."""
+
+    def __init__(self, hub, kind="info", window=WINDOW, accept_device=None):
+        self.hub = hub
+        self.window = window
+        self.accept_device = accept_device
+        self._lock = threading.Lock()
+        self._arrivals = {}         # device -> deque de t de llegada
+        hub.add_listener(kind, self._on_beat)
+
+    def _on_beat(self, m):
+        if self.accept_device is not None and not self.accept_device(m.device):
+            return
+        with self._lock:
+            beats = self._arrivals.get(m.device)
+            if beats is None:
+                beats = self._arrivals[m.device] = deque(maxlen=self.window)
+            beats.append(m.t)
+
+    def devices(self):
+        with self._lock:
+            return sorted(self._arrivals)
+
+    def health(self, device, now=None):
+        with self._lock:
+            arrivals = list(self._arrivals.get(device, ()))
+        return link_health(arrivals, time.time() if now is None else now, self.hub.connected)
+
+    def states(self, devices=None):
+        """{device: estado} de `devices` (o de todos los que han latido)."""
+        now = time.time()
+        devices = self.devices() if devices is None else devices
+        return {d: self.health(d, now)["state"] for d in devices}
@@ -0,0 +1,560 @@
+# =========================================================
+# Historial persistente de telemetría
+# - DayPartitionStore: un archivo binario por día local (append-only)
+# - SqliteStore: base SQLite en WAL con índices por ts / día / drop_id
+# Ambos exponen la misma interfaz para la UI
+# - DayFrameCache: DataFrames por día compartidos entre reruns y sesiones
+# - FleetHistory: un almacén + caché por dron; solo se lee lo que se muestra
+# - TableIndex: orden y filtros de la tabla por día, para servir solo una página
+# =========================================================
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from log_stream import LogStreamParser
+from validation import validate_rows
+
+
+def local_days(ts, tz):
+    """Día local de cada ts (array de epoch en segundos)."""
+    dt = pd.to_datetime(pd.Series(ts), unit="s", utc=True).dt.tz_convert(tz)
+    return dt.dt.date.to_numpy()
+
+
+def _as_columns(df, columns):
+    """Columnas float64 de `df` (las faltantes quedan en NaN), sin filas sin ts."""
+    data = {c: pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=np.float64)
+            if c in df.columns else np.full(len(df), np.nan)
+            for c in columns}
+    valid = ~np.isnan(data["ts"])
+    return {c: v[valid] for c, v in data.items()}
+
+
+def _read_csv(path, columns, policy):
+    """CSV plano -> filas tipadas y validadas (mismo parser que el log en vivo)."""
+    parser = LogStreamParser(columns)
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for chunk in iter(lambda: f.read(1 << 20), ""):
+            parser.feed(chunk)
+    df, _rejected = validate_rows(parser.finish(), policy)
+    return df
+
+
+def _metrics(df):
+    return {
+        "points": len(df),
+        "gps_ok": int(np.nansum(df["fix_ok"].to_numpy())) if len(df) else 0,
+        "speed_mean": float(df["speed_mps"].mean()) if len(df) and df["speed_mps"].notna().any() else None,
+        "speed_n": int(df["speed_mps"].notna().sum()),
+    }
+
+
+def combine_metrics(parts):
+    """Suma las métricas de varios días/dispositivos (velocidad media ponderada)."""
+    parts = list(parts)
+    speed_n = sum(m["speed_n"] for m in parts)
+    speed_sum = sum(m["speed_mean"] * m["speed_n"] for m in parts if m["speed_n"])
+    return {
+        "points": sum(m["points"] for m in parts),
+        "gps_ok": sum(m["gps_ok"] for m in parts),
+        "speed_mean": speed_sum / speed_n if speed_n else None,
+        "speed_n": speed_n,
+    }
+
+
+class DayPartitionStore:
+    """
+    Guarda las filas del log en <root>/<YYYY-MM-DD>.bin, una partición por
+    día local. Cada fila es un registro de len(columns) float64, así que un
+    día se carga con np.fromfile sin parsear texto.
+    Para deduplicar mantiene en memoria las claves (ts, drop_id) ordenadas
+    de los últimos días tocados; un append solo busca sus filas en ellas.
+    """
+
+    SUFFIX = ".bin"
+    KEY_INDEX_DAYS = 31
+
+    def __init__(self, root, columns, tz):
+        self.root = root
+        self.columns = list(columns)
+        self.tz = tz
+        self.dtype = np.dtype([(c, "<f8") for c in self.columns])
+        self._lock = threading.Lock()
+        self._key_index = OrderedDict()   # day -> (filas indexadas, claves ordenadas)
+        os.makedirs(self.root, exist_ok=True)
+
+    # ---------- Particiones ----------
+    def _path(self, day):
+        return os.path.join(self.root, f"{day.isoformat()}{self.SUFFIX}")
+
+    def days(self):
+        """Días con datos, ordenados."""
+        out = []
+        for name in os.listdir(self.root):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                out.append(date.fromisoformat(name[:-len(self.SUFFIX)]))
+            except ValueError:
+                continue
+        return sorted(out)
+
+    def _n_rows(self, path):
+        try:
+            return os.path.getsize(path) // self.dtype.itemsize
+        except OSError:
+            return 0
+
+    def count(self):
+        """Total de filas guardadas (sin leer los archivos)."""
+        return sum(self._n_rows(self._path(d)) for d in self.days())
+
+    def version(self):
+        """Versión global del historial: cambia con cada append."""
+        return self.count()
+
+    def _read(self, day, start=0, stop=None):
+        path = self._path(day)
+        n = self._n_rows(path)
+        if stop is not None:
+            n = min(n, stop)
+        if n <= start:
+            return np.empty(0, dtype=self.dtype)
+        # count descarta un registro incompleto si una escritura quedó a medias
+        return np.fromfile(path, dtype=self.dtype, count=n - start,
+                           offset=start * self.dtype.itemsize)
+
+    def _frame(self, rec):
+        return pd.DataFrame({c: rec[c] for c in self.columns}, columns=self.columns)
+
+    def day_version(self, day):
+        """Versión de la partición: crece con cada append (= filas guardadas)."""
+        return self._n_rows(self._path(day))
+
+    def load_day_since(self, day, since, until=None):
+        """
+        Filas agregadas al día entre las versiones `since` y `until` (ver
+        day_version; sin `until`, hasta la actual). Con el tope, lo que otro
+        hilo o proceso agregue después de leer `until` queda para la próxima
+        lectura y no se cuenta dos veces.
+        """
+        return self._frame(self._read(day, start=since, stop=until))
+
+    # ---------- Lectura ----------
+    def load_day(self, day, newest_first=False):
+        """DataFrame con las filas del día local `day` (sin columna dt)."""
+        rec = self._read(day)
+        if newest_first and len(rec):
+            rec = rec[np.argsort(-rec["ts"], kind="stable")]
+        return self._frame(rec)
+
+    def watermark(self):
+        """(ts máximo, drop_id de ese ts) de todo el historial, o (None, None)."""
+        for day in reversed(self.days()):
+            rec = self._read(day)
+            ts = rec["ts"]
+            if len(ts) and not np.isnan(ts).all():
+                i = int(np.nanargmax(ts))
+                return (float(ts[i]), float(rec["drop_id"][i]))
+        return (None, None)
+
+    # ---------- Escritura ----------
+    @staticmethod
+    def _keys(ts, drop_id):
+        # (ts, drop_id) como un solo número complejo para comparar en bloque
+        return ts + 1j * np.nan_to_num(drop_id, nan=-1.0)
+
+    def _sorted_keys(self, day):
+        """
+        Claves ordenadas del día. Solo se lee del archivo lo que no está
+        indexado todavía (p. ej. lo que escribió otro proceso).
+        """
+        n_done, keys = self._key_index.pop(day, (0, None))
+        n = self._n_rows(self._path(day))
+        if keys is None or n < n_done:
+            n_done, keys = 0, np.empty(0, dtype=np.complex128)
+        if n > n_done:
+            tail = self._read(day, start=n_done)
+            keys = np.sort(np.concatenate([keys, self._keys(tail["ts"], tail["drop_id"])]))
+            n_done += len(tail)
+        self._key_index[day] = (n_done, keys)
+        while len(self._key_index) > self.KEY_INDEX_DAYS:
+            self._key_index.popitem(last=False)
+        return keys
+
+    def append(self, df):
+        """
+        Agrega las filas de `df` a sus particiones, omitiendo las que ya
+        existen por (ts, drop_id). Devuelve cuántas filas nuevas se guardaron.
+        """
+        if df is None or df.empty:
+            return 0
+        data = _as_columns(df, self.columns)
+        if not len(data["ts"]):
+            return 0
+        rec = np.empty(len(data["ts"]), dtype=self.dtype)
+        for c in self.columns:
+            rec[c] = data[c]
+
+        # Duplicados dentro del mismo lote; de paso queda ordenado por clave
+        keys, first = np.unique(self._keys(rec["ts"], rec["drop_id"]), return_index=True)
+        rec = rec[first]
+
+        n_new = 0
+        days = local_days(rec["ts"], self.tz)
+        with self._lock:
+            for day in sorted(set(days)):
+                in_day = days == day
+                part, new_keys = rec[in_day], keys[in_day]
+                old_keys = self._sorted_keys(day)
+                # Descarga incremental típica: todo es más nuevo que lo guardado
+                if len(old_keys) and not new_keys[0] > old_keys[-1]:
+                    pos = np.searchsorted(old_keys, new_keys)
+                    seen = old_keys[np.minimum(pos, len(old_keys) - 1)] == new_keys
+                    part, new_keys = part[~seen], new_keys[~seen]
+                if len(part) == 0:
+                    continue
+                path = self._path(day)
+                with open(path, "ab") as f:
+                    # Si una escritura anterior quedó a medias, recortamos el registro roto
+                    aligned = self._n_rows(path) * self.dtype.itemsize
+                    if f.tell() != aligned:
+                        f.truncate(aligned)
+                        f.seek(aligned)
+                    # El lote queda escrito ordenado por (ts, drop_id)
+                    f.write(part.tobytes())
+                n_done, _ = self._key_index[day]
+                self._key_index[day] = (n_done + len(part),
+                                        np.insert(old_keys, np.searchsorted(old_keys, new_keys), new_keys))
+                n_new += len(part)
+        return n_new
+
+    def import_csv(self, path, policy=None):
+        """Migra un CSV plano (formato drone_data.csv) al almacén."""
+        return self.append(_read_csv(path, self.columns, policy))
+
+
+class SqliteStore:
+    """
+    Misma interfaz que DayPartitionStore sobre una base SQLite.
+    WAL permite un escritor (descarga/ingesta) y muchos lectores (dashboards)
+    a la vez; el filtro por día y las lecturas incrementales son consultas indexadas.
+    """
+
+    def __init__(self, path, columns, tz):
+        self.path = path
+        self.columns = list(columns)
+        self.tz = tz
+        self._local = threading.local()
+        cols = ", ".join(f"{c} REAL" if c != "ts" else "ts REAL NOT NULL" for c in self.columns)
+        with self._conn() as con:
+            con.execute(f"CREATE TABLE IF NOT EXISTS telemetry ({cols}, day TEXT NOT NULL)")
+            con.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_telemetry_key "
+                        "ON telemetry(ts, ifnull(drop_id, -1))")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_telemetry_ts ON telemetry(ts)")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_telemetry_day ON telemetry(day, ts)")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_telemetry_drop ON telemetry(drop_id)")
+
+    def _conn(self):
+        # sqlite3 no comparte conexiones entre hilos: una por hilo (sesión de Streamlit)
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10.0)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def _select(self, sql, params=()):
+        rows = self._conn().execute(sql, params).fetchall()
+        # None (NULL) -> NaN al convertir a float
+        arr = np.array(rows, dtype=np.float64).reshape(len(rows), len(self.columns))
+        return pd.DataFrame(arr, columns=self.columns)
+
+    # ---------- Lectura ----------
+    def days(self):
+        rows = self._conn().execute("SELECT DISTINCT day FROM telemetry ORDER BY day").fetchall()
+        return [date.fromisoformat(r[0]) for r in rows]
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM telemetry").fetchone()[0]
+
+    def version(self):
+        # O(1): no hace falta contar filas para saber si hubo inserts
+        return self._conn().execute("SELECT MAX(rowid) FROM telemetry").fetchone()[0] or 0
+
+    def load_day(self, day, newest_first=False):
+        order = "DESC" if newest_first else "ASC"
+        return self._select(f"SELECT {', '.join(self.columns)} FROM telemetry "
+                            f"WHERE day = ? ORDER BY ts {order}", (day.isoformat(),))
+
+    def day_version(self, day):
+        # Solo se inserta (nunca se borra), así que el rowid máximo crece con cada append
+        v = self._conn().execute("SELECT MAX(rowid) FROM telemetry WHERE day = ?",
+                                 (day.isoformat(),)).fetchone()[0]
+        return v or 0
+
+    def load_day_since(self, day, since, until=None):
+        if until is None:
+            until = self.day_version(day)
+        return self._select(f"SELECT {', '.join(self.columns)} FROM telemetry "
+                            f"WHERE day = ? AND rowid > ? AND rowid <= ? ORDER BY rowid",
+                            (day.isoformat(), since, until))
+
+    def watermark(self):
+        row = self._conn().execute(
+            "SELECT ts, drop_id FROM telemetry ORDER BY ts DESC LIMIT 1").fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    # ---------- Escritura ----------
+    def append(self, df):
+        if df is None or df.empty:
+            return 0
+        data = _as_columns(df, self.columns)
+        if not len(data["ts"]):
+            return 0
+        days = [d.isoformat() for d in local_days(data["ts"], self.tz)]
+        # NaN -> NULL para que ifnull(drop_id, -1) deduplique igual que en disco
+        cols = [np.where(np.isnan(data[c]), None, data[c]).tolist() for c in self.columns]
+        rows = zip(*cols, days)
+        placeholders = ", ".join("?" * (len(self.columns) + 1))
+        con = self._conn()
+        with con:
+            before = con.total_changes
+            con.executemany(f"INSERT OR IGNORE INTO telemetry ({', '.join(self.columns)}, day) "
+                            f"VALUES ({placeholders})", rows)
+            return con.total_changes - before
+
+    def import_csv(self, path, policy=None):
+        return self.append(_read_csv(path, self.columns, policy))
+
+
+class DayFrameCache:
+    """
+    DataFrames por día ya tipados, con `dt` local y columna `day`, compartidos
+    por todas las sesiones (se crea una vez con st.cache_resource).
+    Cuando el almacén crece solo se leen y convierten las filas nuevas.
+    Con `device`, las filas llevan además la columna device.
+    """
+
+    def __init__(self, store, max_days=31, device=None):
+        self.store = store
+        self.max_days = max_days
+        self.device = device
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # day -> dict(version, df, newest, metrics)
+
+    def _typed(self, df, day):
+        df = df.copy()
+        df["dt"] = pd.to_datetime(df["ts"], unit="s", errors="coerce", utc=True).dt.tz_convert(self.store.tz)
+        df["day"] = day
+        if self.device is not None:
+            df["device"] = self.device
+        return df
+
+    def _entry(self, day):
+        version = self.store.day_version(day)
+        with self._lock:
+            entry = self._entries.get(day)
+            # >=: otro hilo ya la puso al día con una versión más nueva
+            if entry is not None and entry["version"] >= version:
+                self._entries.move_to_end(day)
+                return entry
+            if entry is not None and entry["version"] < version:
+                # Incremental: solo la cola nueva
+                tail = self._typed(self.store.load_day_since(day, entry["version"], version), day)
+                df = pd.concat([entry["df"], tail], ignore_index=True)
+            else:
+                df = self._typed(self.store.load_day_since(day, 0, version), day)
+            newest = df.sort_values("ts", ascending=False, kind="stable").reset_index(drop=True)
+            entry = {"version": version, "df": df, "newest": newest,
+                     "metrics": _metrics(df)}
+            self._entries[day] = entry
+            self._entries.move_to_end(day)
+            while len(self._entries) > self.max_days:
+                self._entries.popitem(last=False)
+            return entry
+
+    def day_frame(self, day, newest_first=False):
+        """Filas del día (no modificar: el DataFrame es compartido)."""
+        entry = self._entry(day)
+        return entry["newest"] if newest_first else entry["df"]
+
+    def day_snapshot(self, day, newest_first=False):
+        """(filas del día, su versión) de la misma entrada; day_frame y version por separado pueden no coincidir."""
+        entry = self._entry(day)
+        return (entry["newest"] if newest_first else entry["df"]), entry["version"]
+
+    def day_metrics(self, day):
+        return self._entry(day)["metrics"]
+
+    def version(self, day):
+        return self._entry(day)["version"]
+
+    def watermark(self):
+        """Igual que store.watermark(), pero usando los días ya en caché."""
+        for day in reversed(self.store.days()):
+            df = self.day_frame(day)
+            if df["ts"].notna().any():
+                i = df["ts"].idxmax()
+                return (float(df.at[i, "ts"]), float(df.at[i, "drop_id"]))
+        return (None, None)
+
+
+class TableIndex:
+    """
+    Tabla de un día (uno o varios drones) servida por páginas.
+    Las permutaciones ordenadas por columna y las vistas filtradas recientes
+    se calculan una vez y se comparten entre sesiones hasta que el día cambie.
+    """
+
+    MAX_VIEWS = 16
+
+    def __init__(self, df, version):
+        self.df = df                # no modificar: compartido
+        self.version = version
+        self._lock = threading.Lock()
+        self._orders = {}           # (columna, descendente) -> posiciones ordenadas
+        self._views = OrderedDict() # (orden, filtros) -> posiciones filtradas y ordenadas
+
+    def _order(self, column, descending):
+        key = (column, descending)
+        order = self._orders.get(key)
+        if order is None:
+            # Estable y con los NaN al final en ambos sentidos
+            values = pd.Series(self.df[column].to_numpy())
+            order = values.sort_values(ascending=not descending, kind="stable",
+                                       na_position="last").index.to_numpy()
+            self._orders[key] = order
+        return order
+
+    def _mask(self, filters):
+        mask = np.ones(len(self.df), dtype=bool)
+        for column, (lo, hi) in filters:
+            values = self.df[column].to_numpy(dtype=np.float64)
+            with np.errstate(invalid="ignore"):
+                if lo is not None:
+                    mask &= values >= lo
+                if hi is not None:
+                    mask &= values <= hi
+        return mask
+
+    def view(self, sort_by="ts", descending=True, filters=None):
+        """Posiciones de las filas que pasan `filters` ({columna: (min, max)}), ya ordenadas."""
+        filters = tuple(sorted((filters or {}).items()))
+        key = (sort_by, descending, filters)
+        with self._lock:
+            rows = self._views.get(key)
+            if rows is None:
+                rows = self._order(sort_by, descending)
+                if filters:
+                    rows = rows[self._mask(filters)[rows]]
+                self._views[key] = rows
+                while len(self._views) > self.MAX_VIEWS:
+                    self._views.popitem(last=False)
+            else:
+                self._views.move_to_end(key)
+            return rows
+
+    def page(self, page, page_size, sort_by="ts", descending=True, filters=None):
+        """(DataFrame de la página `page` (desde 0), total de filas filtradas)."""
+        rows = self.view(sort_by, descending, filters)
+        start = max(0, page) * page_size
+        return self.df.iloc[rows[start:start + page_size]], len(rows)
+
+
+class FleetHistory:
+    """
+    Historial de la flota: un almacén por dispositivo (su propia partición
+    de primer nivel) con su DayFrameCache, abiertos al primer uso.
+    Las consultas reciben la lista de dispositivos a mostrar y solo tocan esos.
+    """
+
+    def __init__(self, open_store, devices=()):
+        self._open_store = open_store      # device -> almacén
+        self._lock = threading.Lock()
+        self._stores = {}
+        self._frames = {}
+        self._known = set(devices)
+        self._tables = OrderedDict()       # (day, devices) -> TableIndex
+
+    def add_device(self, device):
+        with self._lock:
+            self._known.add(device)
+
+    def devices(self):
+        with self._lock:
+            return sorted(self._known | set(self._stores))
+
+    def store(self, device):
+        with self._lock:
+            store = self._stores.get(device)
+            if store is None:
+                store = self._stores[device] = self._open_store(device)
+                self._frames[device] = DayFrameCache(store, device=device)
+                self._known.add(device)
+            return store
+
+    def frames(self, device):
+        self.store(device)
+        return self._frames[device]
+
+    # ---------- Consultas sobre una selección ----------
+    def version(self, devices):
+        return tuple(self.store(d).version() for d in devices)
+
+    def days(self, devices):
+        return sorted(set().union(*(self.store(d).days() for d in devices))) if devices else []
+
+    def count(self, devices):
+        return sum(self.store(d).count() for d in devices)
+
+    def day_frame(self, day, devices, newest_first=False):
+        """Filas del día de los dispositivos elegidos (con columna device)."""
+        frames = [self.frames(d).day_frame(day, newest_first) for d in devices]
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return self.frames(devices[0]).day_frame(day, newest_first) if devices else pd.DataFrame()
+        if len(frames) == 1:
+            return frames[0]   # compartido: no modificar
+        df = pd.concat(frames, ignore_index=True)
+        if newest_first:
+            df = df.iloc[np.argsort(-df["ts"].to_numpy(), kind="stable")].reset_index(drop=True)
+        return df
+
+    def day_metrics(self, day, devices):
+        return combine_metrics(self.frames(d).day_metrics(day) for d in devices)
+
+    def day_version(self, day, devices):
+        """Versión del día para la selección: cambia si algún dron agregó filas ese día."""
+        return tuple(self.frames(d).version(day) for d in devices)
+
+    def table(self, day, devices, max_tables=8):
+        """TableIndex del día para esa selección; se rehace solo si algún dron agregó filas."""
+        devices = tuple(devices)
+        version = self.day_version(day, devices)
+        key = (day, devices)
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None and table.version == version:
+                self._tables.move_to_end(key)
+                return table
+        frames = [self.frames(d).day_frame(day) for d in devices]
+        frames = [f for f in frames if not f.empty]
+        if len(frames) == 1:
+            df = frames[0]
+        else:
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        table = TableIndex(df, version)
+        with self._lock:
+            self._tables[key] = table
+            self._tables.move_to_end(key)
+            while len(self._tables) > max_tables:
+                self._tables.popitem(last=False)
+        return table
@@ -0,0 +1,217 @@
+# =========================================================
+# Ingesta sin interfaz: python -m ingest
+# - Mantiene la conexión MQTT (MqttHub) aunque nadie tenga la página abierta
+# - Pide el log incremental (since_ts = último registro guardado) de cada
+#   dron cada --interval s y en cuanto vuelve a estar en línea; los drones
+#   descargan en paralelo, cada uno a su partición
+# - Si una descarga quedó a medias, la reanuda desde el checkpoint
+# - Guarda los eventos de T_EVENTS de cada dron en cuanto llegan
+# - Tras cada descarga con datos nuevos pone al día el índice de misiones
+#   y los resúmenes por día / semana
+# - Con INGEST=daemon el dashboard solo lee el historial y este estado
+# =========================================================
+
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+from config import (HISTORY_BACKEND, INGEST_STATUS, get_setting, make_downloads, make_hub,
+                    migrate_legacy, open_events, open_history, open_missions, open_rollups,
+                    valid_device)
+from heartbeat import HeartbeatMonitor
+
+log = logging.getLogger("ingest")
+
+
+def load_status(path=INGEST_STATUS):
+    """Último estado escrito por la ingesta, o None (lo usa el dashboard)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class IngestDaemon:
+    """Bucle de sincronización de la flota; cada descarga la hace su DownloadManager."""
+
+    STATUS_EVERY_S = 5.0
+    CONNECT_TIMEOUT_S = 16.0    # con once=True: sin broker durante este tiempo, se sale con error
+
+    def __init__(self, hub, history, downloads, interval_s=300.0, status_path=INGEST_STATUS,
+                 devices=None, missions=None, rollups=None, backend=HISTORY_BACKEND):
+        self.hub = hub
+        self.history = history
+        self.backend = backend      # el de open_history; migrate_legacy lo necesita
+        self.downloads = downloads
+        self.missions = missions    # FleetMissions o None
+        self.rollups = rollups      # FleetRollups o None
+        self.interval_s = interval_s
+        self.status_path = status_path
+        self.only = list(devices) if devices else None   # None: toda la flota
+        self._stop = threading.Event()
+        self.heartbeat = HeartbeatMonitor(hub, accept_device=valid_device)   # mismo criterio que el dashboard
+        self.online = {}            # device -> bool
+        self._next_sync = {}        # device -> t de la próxima sincronización
+        self._reported = {}         # device -> id de la última descarga ya reportada
+        self._status_at = 0.0
+        self.last_sync = {}         # device -> resultado de su última descarga terminada
+
+    def stop(self):
+        self._stop.set()
+
+    def devices(self):
+        return self.only if self.only is not None else self.history.devices()
+
+    # ---------- Dispositivos ----------
+    def _poll_info(self):
+        for device in self.heartbeat.devices():
+            self.history.add_device(device)
+        for device, state in self.heartbeat.states(self.devices()).items():
+            online = state in ("online", "degraded")
+            if online and not self.online.get(device, False):
+                log.info("%s en línea; sincronizando", device)
+                self._next_sync[device] = 0.0
+            elif self.online.get(device, False) and state == "stale":
+                log.warning("%s sin latido", device)
+            self.online[device] = online
+
+    # ---------- Descargas ----------
+    def _sync(self, device):
+        self._next_sync[device] = time.time() + self.interval_s
+        mgr = self.downloads.manager(device)
+        if mgr.busy or not self.hub.connected:
+            return None
+        ckpt = mgr.resumable
+        if ckpt:
+            job, err = mgr.start(resume=True)
+            what = f"reanudando desde el byte {ckpt.get('offset', 0)}"
+        else:
+            since_ts, _ = self.history.store(device).watermark()
+            job, err = mgr.start(since_ts=since_ts)
+            what = f"desde ts={since_ts:.0f}" if since_ts is not None else "log completo"
+        if err:
+            log.warning("%s: no se pudo iniciar la descarga: %s", device, err)
+            return None
+        log.info("%s: descarga %s (%s)", device, job.id, what)
+        return job
+
+    def _report(self):
+        for device, job in self.downloads.jobs().items():
+            if job.running or self._reported.get(device) == job.id:
+                continue
+            self._reported[device] = job.id
+            p = job.progress()
+            self.last_sync[device] = {"id": job.id, "at": job.finished_at, "status": p["status"],
+                                      "n_new": p["n_new"], "error": p["error"], "invalid": p["invalid"]}
+            if p["status"] == "done":
+                log.info("%s: descarga %s, %d registros nuevos (%d bytes, %.1fs)",
+                         device, job.id, p["n_new"], p["bytes"], p["elapsed_s"])
+                # El dashboard ya encuentra las misiones y los resúmenes calculados
+                if p["n_new"] and self.missions is not None:
+                    self.missions.refresh([device])
+                if p["n_new"] and self.rollups is not None:
+                    self.rollups.refresh([device])
+            else:
+                log.warning("%s: descarga %s falló: %s", device, job.id, p["error"])
+            self._write_status(force=True)
+
+    def _write_status(self, force=False):
+        now = time.time()
+        if not self.status_path or (not force and now - self._status_at < self.STATUS_EVERY_S):
+            return
+        self._status_at = now
+        jobs = self.downloads.jobs()
+        devices = {}
+        for device in self.devices():
+            job = jobs.get(device)
+            devices[device] = {"online": self.online.get(device, False),
+                               "link": self.heartbeat.health(device),
+                               "next_sync": self._next_sync.get(device),
+                               "running": job.progress() if job is not None and job.running else None,
+                               "last_sync": self.last_sync.get(device)}
+        status = {"pid": os.getpid(), "updated_at": now, "connected": self.hub.connected,
+                  "devices": devices}
+        tmp = self.status_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(status, f)
+        os.replace(tmp, self.status_path)
+
+    # ---------- Bucle ----------
+    def run(self, once=False, insecure_tls=False):
+        """Hasta stop() (o, con once=True, hasta una descarga por dron). Devuelve el código de salida."""
+        for note in migrate_legacy(self.history, self.backend):
+            log.info(note)
+        # Con INGEST=daemon el dashboard solo lee los índices: se arman aquí
+        if self.missions is not None:
+            self.missions.refresh(self.devices())
+        if self.rollups is not None:
+            self.rollups.refresh(self.devices())
+        self.hub.start(insecure_tls=insecure_tls)
+        started = {}
+        connected_at = time.time()  # última vuelta con conexión (o el arranque)
+        try:
+            while not self._stop.wait(1.0):
+                if not self.hub.connected:
+                    self._write_status()
+                    # Para cron: sin broker no hay que quedarse esperando para siempre
+                    if once and time.time() - connected_at > self.CONNECT_TIMEOUT_S:
+                        log.error("Sin conexión al broker durante %.0fs; se cancela --once",
+                                  self.CONNECT_TIMEOUT_S)
+                        return 1
+                    continue
+                connected_at = time.time()
+                self._poll_info()
+                # Primero los resultados anteriores, antes de que otra descarga los reemplace
+                self._report()
+                now = time.time()
+                for device in self.devices():
+                    if once and device in started:
+                        continue
+                    if now >= self._next_sync.get(device, 0.0):
+                        job = self._sync(device)
+                        if job is not None:
+                            started[device] = job
+                self._write_status()
+                if once and started and not any(job.running for job in started.values()):
+                    self._report()
+                    return 0 if all(job.status == "done" for job in started.values()) else 1
+        finally:
+            self.hub.stop()
+        return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m ingest",
+                                     description="Ingesta del log del dron al historial, sin Streamlit.")
+    parser.add_argument("--interval", type=float,
+                        default=float(get_setting("INGEST_INTERVAL_S", "300")),
+                        help="segundos entre sincronizaciones (default: 300)")
+    parser.add_argument("--backend", choices=("files", "sqlite"), default=HISTORY_BACKEND)
+    parser.add_argument("--device", action="append", dest="devices", metavar="ID",
+                        help="solo este dron (se puede repetir; default: toda la flota)")
+    parser.add_argument("--once", action="store_true",
+                        help="una sola descarga incremental y salir (para cron)")
+    parser.add_argument("--insecure-tls", action="store_true",
+                        help="no verificar el certificado del broker (debug)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    hub = make_hub(client_prefix="ingest", echo=logging.getLogger("ingest.mqtt").info)
+    history = open_history(args.backend)
+    open_events().attach(hub, accept_device=valid_device)
+    daemon = IngestDaemon(hub, history, make_downloads(hub, history), interval_s=args.interval,
+                          devices=args.devices, missions=open_missions(history),
+                          rollups=open_rollups(history), backend=args.backend)
+    # Ctrl+C / systemd stop: cerrar la conexión limpio
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: daemon.stop())
+    return daemon.run(once=args.once, insecure_tls=args.insecure_tls)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
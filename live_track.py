@@ -0,0 +1,142 @@
+# =========================================================
+# Recorrido en vivo a partir de T_STATE
+# - Ring buffer numpy de capacidad fija por dron (memoria acotada)
+# - Las ráfagas se juntan: a más de 1/COALESCE_S Hz se sobrescribe el último punto
+# - La UI solo copia los últimos N puntos en cada refresco
+# =========================================================
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+TRACK_FIELDS = ("t", "ts", "lat", "lon", "alt", "speed_mps", "sats", "fix_ok")
+
+
+def _num(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def decode_state(data, t):
+    """Fila TRACK_FIELDS de un mensaje de T_STATE (dict JSON), o None si no trae posición."""
+    if not isinstance(data, dict):
+        return None
+    lat, lon = _num(data.get("lat")), _num(data.get("lon"))
+    if np.isnan(lat) or np.isnan(lon) or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    ts = _num(data.get("ts"))
+    row = [t, ts if not np.isnan(ts) else t, lat, lon]
+    row.extend(_num(data.get(f)) for f in TRACK_FIELDS[4:])
+    return row
+
+
+class TrackBuffer:
+    """
+    Últimas `capacity` posiciones de un dron en un arreglo (capacity, campos).
+    Escribe el hilo de red del hub; las sesiones leen copias.
+    """
+
+    def __init__(self, capacity=3600, coalesce_s=0.1):
+        self.capacity = capacity
+        self.coalesce_s = coalesce_s
+        self._data = np.full((capacity, len(TRACK_FIELDS)), np.nan)
+        self._lock = threading.Lock()
+        self._written = 0           # filas escritas en total (la siguiente va en written % capacity)
+        self._slot_t = None         # t con que se abrió la última fila (las ráfagas no la mueven)
+        self.version = 0            # cambia con cada push (aunque se haya juntado)
+        self.coalesced = 0
+
+    def push(self, row):
+        with self._lock:
+            if self._written and row[0] - self._slot_t < self.coalesce_s:
+                # Ráfaga: el punto nuevo reemplaza al anterior
+                self._data[(self._written - 1) % self.capacity] = row
+                self.coalesced += 1
+                self.version += 1
+                return
+            self._data[self._written % self.capacity] = row
+            self._slot_t = row[0]
+            self._written += 1
+            self.version += 1
+
+    def __len__(self):
+        return min(self._written, self.capacity)
+
+    def latest(self, n=None):
+        """Copia de las últimas n filas (todas si n es None), de la más vieja a la más nueva."""
+        with self._lock:
+            size = min(self._written, self.capacity)
+            n = size if n is None else min(n, size)
+            if n == 0:
+                return np.empty((0, len(TRACK_FIELDS)))
+            end = self._written % self.capacity
+            idx = (np.arange(end - n, end)) % self.capacity
+            return self._data[idx].copy()
+
+    def last(self):
+        rows = self.latest(1)
+        return dict(zip(TRACK_FIELDS, rows[0])) if len(rows) else None
+
+
+class LiveTracks:
+    """Un TrackBuffer por dron, llenado por el listener de "state" del hub."""
+
+    def __init__(self, hub, capacity=3600, coalesce_s=0.1, accept_device=None):
+        self.hub = hub
+        self.capacity = capacity
+        self.coalesce_s = coalesce_s
+        self.accept_device = accept_device      # filtro opcional de ids
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self.rejected = 0
+        hub.add_listener("state", self._on_state)
+
+    def _on_state(self, m):
+        if self.accept_device is not None and not self.accept_device(m.device):
+            return
+        row = decode_state(m.data, m.t)
+        if row is None:
+            self.rejected += 1
+            return
+        self.buffer(m.device).push(row)
+
+    def buffer(self, device):
+        with self._lock:
+            buf = self._buffers.get(device)
+            if buf is None:
+                buf = self._buffers[device] = TrackBuffer(self.capacity, self.coalesce_s)
+            return buf
+
+    def devices(self):
+        with self._lock:
+            return sorted(d for d, buf in self._buffers.items() if len(buf))
+
+    def version(self, devices):
+        with self._lock:
+            return tuple(self._buffers[d].version if d in self._buffers else 0 for d in devices)
+
+    def track(self, devices, n=300):
+        """DataFrame con los últimos n puntos de cada dron (con columna device)."""
+        frames = []
+        for device in devices:
+            with self._lock:
+                buf = self._buffers.get(device)
+            if buf is None or not len(buf):
+                continue
+            df = pd.DataFrame(buf.latest(n), columns=TRACK_FIELDS)
+            df["device"] = device
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=TRACK_FIELDS + ("device",))
+        return pd.concat(frames, ignore_index=True)
+
+    def age_s(self, device):
+        """Segundos desde el último T_STATE con posición del dron (None si nunca llegó)."""
+        with self._lock:
+            buf = self._buffers.get(device)
+        last = buf.last() if buf is not None else None
+        return time.time() - last["t"] if last else None
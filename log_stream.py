@@ -0,0 +1,253 @@
+# =========================================================
+# Parser incremental del log que llega por T_LOGPART
+# - Arma filas tipadas conforme llegan los chunks (conversión en bloque por chunk)
+# - Conserva líneas partidas (o registros binarios partidos) entre chunks
+# - Decodifica las codificaciones compactas negociadas en stream_log
+# =========================================================
+
+import base64
+import struct
+import zlib
+from array import array
+
+import numpy as np
+import pandas as pd
+
+# Codificaciones que acepta el dashboard, en orden de preferencia (campo "accept"
+# de stream_log). El dispositivo indica la que usó en "enc"; sin "enc" es CSV.
+#   csv       texto CSV dentro del JSON (formato original)
+#   zlib      CSV comprimido con deflate por chunk, en base64
+#   bin       registros BIN_RECORD little-endian, en base64
+#   bin+zlib  registros BIN_RECORD comprimidos con deflate, en base64
+# Además se aceptan tramas binarias crudas (sin JSON) que empiezan con FRAME_MAGIC.
+LOG_ENCODINGS = ("bin+zlib", "bin", "zlib", "csv")
+
+BIN_RECORD = np.dtype([("ts", "<u4"), ("lat", "<f8"), ("lon", "<f8"), ("alt", "<f4"),
+                       ("drop_id", "<u4"), ("speed_mps", "<f4"), ("sats", "u1"), ("fix_ok", "u1")])
+
+FRAME_MAGIC = b"DL"
+FRAME_HEADER = struct.Struct("<2sBBII")   # magic, enc, flags (bit0 = eof), seq, offset
+FRAME_ENCODINGS = {0: "csv", 1: "zlib", 2: "bin", 3: "bin+zlib"}
+
+
+def decode_part(payload):
+    """
+    Normaliza una parte de T_LOGPART (dict JSON o trama binaria cruda) a un dict
+    con las claves de siempre (seq/offset/eof/total) y `data` ya decodificado:
+    str para CSV, bytes (registros BIN_RECORD) para bin. `wire` = bytes en la red.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        payload = bytes(payload)
+        if len(payload) < FRAME_HEADER.size or not payload.startswith(FRAME_MAGIC):
+            return {"data": "", "wire": len(payload)}
+        _magic, enc_code, flags, seq, offset = FRAME_HEADER.unpack_from(payload)
+        enc = FRAME_ENCODINGS.get(enc_code, "csv")
+        part = {"seq": seq, "offset": offset, "eof": bool(flags & 1), "enc": enc,
+                "wire": len(payload)}
+        body = payload[FRAME_HEADER.size:]
+        if "zlib" in enc and body:
+            body = zlib.decompress(body)
+        part["data"] = body if enc.startswith("bin") else body.decode("utf-8", errors="ignore")
+        return part
+
+    if not isinstance(payload, dict):
+        return {"data": "", "wire": 0}
+    part = dict(payload)
+    enc = part.get("enc", "csv")
+    data = part.get("data", "")
+    part["wire"] = len(data)
+    if enc != "csv" and data:
+        raw = base64.b64decode(data)
+        if "zlib" in enc:
+            raw = zlib.decompress(raw)
+        part["data"] = raw if enc.startswith("bin") else raw.decode("utf-8", errors="ignore")
+    return part
+
+
+class LogStreamParser:
+    """
+    Recibe fragmentos de texto CSV (en orden) y va llenando un buffer
+    float64 por columna. Solo guarda la línea incompleta del final,
+    nunca el texto completo del log.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.n_cols = len(self.columns)
+        self._bufs = [array("d") for _ in self.columns]
+        self._tail = ""
+        self._tail_bin = b""
+        self.chunks = 0
+        self.bytes = 0
+        self.rows = 0
+        self.rejected = 0
+
+    def feed(self, text):
+        """Procesa un chunk (str CSV o bytes BIN_RECORD); devuelve cuántas filas válidas agregó."""
+        if not text:
+            return 0
+        if isinstance(text, (bytes, bytearray)):
+            return self.feed_records(text)
+        self.chunks += 1
+        self.bytes += len(text)
+        text = self._tail + text
+        # Un \r\n puede quedar partido entre chunks; la línea vacía que deja se ignora
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        lines = text.split("\n")
+        self._tail = lines.pop()
+        before = self.rows
+        self._add_lines(lines)
+        return self.rows - before
+
+    def feed_records(self, raw):
+        """Registros binarios de ancho fijo: van directo a los buffers, sin texto."""
+        self.chunks += 1
+        self.bytes += len(raw)
+        raw = self._tail_bin + bytes(raw)
+        n = len(raw) // BIN_RECORD.itemsize
+        cut = n * BIN_RECORD.itemsize
+        self._tail_bin = raw[cut:]
+        if n == 0:
+            return 0
+        rec = np.frombuffer(raw, dtype=BIN_RECORD, count=n)
+        for col, buf in zip(self.columns, self._bufs):
+            if col in BIN_RECORD.names:
+                buf.frombytes(rec[col].astype(np.float64).tobytes())
+            else:
+                buf.frombytes(np.full(n, np.nan).tobytes())
+        self.rows += n
+        return n
+
+    def _add_lines(self, lines):
+        """Convierte todas las líneas completas de un chunk de una sola vez."""
+        lines = [ln for ln in lines if ln.strip()]
+        rows = [ln for ln in lines if ln.count(",") == self.n_cols - 1]
+        self.rejected += len(lines) - len(rows)
+        if not rows:
+            return
+        cells = pd.Series(",".join(rows).split(","), dtype=object).str.strip()
+        values = pd.to_numeric(cells, errors="coerce").to_numpy(dtype=np.float64)
+        # Vacío o "nan" es NaN legítimo; cualquier otro texto invalida la fila
+        bad = np.isnan(values) & (cells != "").to_numpy() & (cells.str.lower() != "nan").to_numpy()
+        values = values.reshape(len(rows), self.n_cols)
+        bad = bad.reshape(len(rows), self.n_cols)
+        header = (cells.to_numpy().reshape(len(rows), self.n_cols)[:, 0] == self.columns[0])
+        # Sin ts no sirve de nada
+        bad_row = (bad.any(axis=1) | np.isnan(values[:, 0])) & ~header
+        self.rejected += int(bad_row.sum())
+        values = values[~(bad_row | header)]
+        if not len(values):
+            return
+        for j, buf in enumerate(self._bufs):
+            buf.frombytes(np.ascontiguousarray(values[:, j]).tobytes())
+        self.rows += len(values)
+
+    @property
+    def pending_rows(self):
+        """Filas parseadas que aún no se entregaron con take_rows()."""
+        return len(self._bufs[0])
+
+    @property
+    def committed_bytes(self):
+        """Bytes recibidos hasta el final de la última línea completa."""
+        return self.bytes - len(self._tail) - len(self._tail_bin)
+
+    def take_rows(self):
+        """Entrega las filas completas parseadas hasta ahora y vacía los buffers."""
+        bufs, self._bufs = self._bufs, [array("d") for _ in self.columns]
+        data = {col: np.frombuffer(buf, dtype=np.float64) if len(buf) else np.empty(0)
+                for col, buf in zip(self.columns, bufs)}
+        return pd.DataFrame(data, columns=self.columns)
+
+    def finish(self):
+        """Procesa la última línea (si no terminó en salto) y arma el DataFrame."""
+        if self._tail:
+            self._add_lines([self._tail])
+            self._tail = ""
+        return self.take_rows()
+
+
+class ChunkReassembler:
+    """
+    Ordena las partes de T_LOGPART antes de pasarlas al parser.
+    - Con `seq` (índice de chunk) u `offset` (byte inicial) en cada parte:
+      descarta duplicados, guarda las adelantadas y detecta huecos.
+    - Sin ninguno de los dos (firmware antiguo) las deja pasar tal cual.
+    El EOF lleva el `seq` siguiente al último chunk o el `offset` final.
+    Al reanudar desde el byte `start`, los offsets siguen siendo absolutos
+    y los seq vuelven a empezar en 0.
+    """
+
+    def __init__(self, start=0):
+        self.start = start
+        self.mode = None            # "seq" | "offset" | "plain"
+        self.next = 0               # siguiente posición esperada
+        self.end = None             # posición final (al llegar el EOF)
+        self.eof_seen = False
+        self._pending = {}          # posición -> texto (llegó antes de tiempo)
+        self.duplicates = 0
+        self.reordered = 0
+
+    def _size(self, text):
+        if self.mode == "seq":
+            return 1
+        return len(text) if isinstance(text, (bytes, bytearray)) else len(text.encode("utf-8"))
+
+    def accept(self, data):
+        """Recibe el dict de una parte; devuelve los textos que ya están en orden."""
+        if self.mode is None:
+            self.mode = "seq" if "seq" in data else "offset" if "offset" in data else "plain"
+            if self.mode == "offset":
+                self.next = self.start
+        text = data.get("data", "")
+        if self.mode == "plain":
+            if data.get("eof", False):
+                self.eof_seen = True
+                return []
+            return [text] if text else []
+
+        pos = int(data.get(self.mode, -1))
+        if data.get("eof", False):
+            self.eof_seen = True
+            self.end = pos
+            return []
+        if pos < self.next or pos in self._pending:
+            self.duplicates += 1
+            return []
+        if pos > self.next:
+            self.reordered += 1
+            self._pending[pos] = text
+            return []
+        out = [text]
+        self.next += self._size(text)
+        while self.next in self._pending:
+            text = self._pending.pop(self.next)
+            out.append(text)
+            self.next += self._size(text)
+        return out
+
+    @property
+    def complete(self):
+        if self.mode == "plain":
+            return self.eof_seen
+        return self.eof_seen and self.end is not None and self.next >= self.end
+
+    def missing(self):
+        """Rangos [inicio, fin) que faltan entre lo recibido en orden y lo último conocido."""
+        if self.mode in (None, "plain"):
+            return []
+        known = sorted(self._pending)
+        limit = self.end if self.end is not None else (known[-1] if known else self.next)
+        gaps = []
+        cur = self.next
+        for pos in known:
+            if pos > cur:
+                gaps.append([cur, pos])
+            cur = max(cur, pos + self._size(self._pending[pos]))
+        if cur < limit:
+            gaps.append([cur, limit])
+        return gaps
+
+    @property
+    def buffered(self):
+        return len(self._pending)
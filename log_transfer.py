@@ -0,0 +1,511 @@
+# =========================================================
+# Descarga del log en segundo plano
+# - Los chunks llegan por el listener del hub (hilo de red)
+# - Se reordenan por seq/offset; los huecos se piden de nuevo (resend_log)
+# - Las filas se guardan por tandas con un checkpoint en disco; si se cae
+#   MQTT se reanuda con stream_log + offset en vez de empezar de cero
+# - Un hilo vigilante espera EOF y corta por inactividad (sin chunks) o por
+#   un plazo que crece con el tamaño del log y la velocidad medida
+# - Control de flujo opcional: ventana de chunks + log_ack acumulativo
+# - La UI solo consulta progress() en cada refresco
+# - Una descarga por dron; varios drones descargan a la vez (FleetDownloads)
+# =========================================================
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from log_stream import LOG_ENCODINGS, ChunkReassembler, LogStreamParser, decode_part
+from validation import merge_rejected, validate_rows
+
+
+def load_checkpoint(path):
+    """Checkpoint de una descarga interrumpida, o None."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class LogDownload:
+    """
+    Una transferencia de log (stream_log) del dron al historial.
+    Se crea, se arranca con start() y después solo se consulta.
+    """
+
+    RATE_WINDOW_S = 5.0
+    GAP_WAIT_S = 1.0        # cuánto esperar a un chunk atrasado antes de pedirlo de nuevo
+    MAX_RESENDS = 5         # pedidos de retransmisión antes de dar la descarga por fallida
+    FLUSH_ROWS = 500        # filas parseadas que se guardan (y se checkpointean) por tanda
+    RESUME_WAIT_S = 120.0   # cuánto esperar a que vuelva MQTT antes de rendirse
+    FIRST_CHUNK_S = 6.0     # el dispositivo tiene que abrir el archivo antes del primer chunk
+    IDLE_TIMEOUT_S = 4.0    # sin chunks durante este tiempo = enlace o dispositivo muerto
+    DEADLINE_MARGIN = 2.0   # plazo total = margen * total_bytes / velocidad medida
+    MAX_DURATION_S = 1800.0 # tope si el dispositivo no informa el total
+    WINDOW_CHUNKS = 16      # chunks que el dispositivo puede mandar sin ack
+
+    def __init__(self, hub, store, cmd_topic, columns, since_ts=None, timeout_s=16.0,
+                 offset=0, checkpoint_path=None, accept=LOG_ENCODINGS, policy=None, device=None):
+        self.hub = hub
+        self.device = device                # solo se aceptan sus partes de T_LOGPART
+        self.store = store
+        self.cmd_topic = cmd_topic
+        self.since_ts = since_ts
+        self.timeout_s = timeout_s          # plazo mínimo; se amplía según tamaño y velocidad
+        self.checkpoint_path = checkpoint_path
+        self.accept = list(accept)
+        self.policy = policy
+        self.invalid = {}                   # motivo -> filas descartadas por validación
+        self.id = f"{int(time.time() * 1000)}"
+
+        self._lock = threading.Lock()
+        self._parser = LogStreamParser(columns)
+        self.base_offset = offset           # byte del log donde empieza este parser
+        self._chunks = ChunkReassembler(start=offset)
+        self._eof = threading.Event()       # EOF recibido y sin huecos
+        self._gap_since = None              # desde cuándo hay un hueco pendiente
+        self.resend_requests = 0
+        self._samples = deque()          # (t, bytes acumulados) para la tasa reciente
+        self.total_bytes = None          # si el dispositivo lo informa
+        self.encoding = None             # la que eligió el dispositivo
+        self.wire_bytes = 0              # bytes en la red (antes de decodificar)
+        self.started_at = None
+        self.finished_at = None
+        self.last_chunk_at = None
+        self.status = "idle"             # idle | running | done | failed
+        self.error = ""
+        self.n_new = 0
+        self.paused_since = None         # MQTT caído durante la descarga
+        self.paused_total = 0.0
+        self.resumes = 0
+        self._resume_needed = False
+        self._acked = None               # última posición confirmada con log_ack
+        self._reacked_at = 0.0           # último log_ack repetido por inactividad
+        self._asked_at = None            # último stream_log (arranque o reanudación)
+
+    # ---------- Ciclo de vida ----------
+    def _stream_cmd(self, offset):
+        cmd = {"action": "stream_log"}
+        if self.since_ts is not None:
+            cmd["since_ts"] = self.since_ts
+        if offset:
+            # en bytes del stream sin comprimir de la codificación elegida
+            cmd["offset"] = offset
+        if self.accept != ["csv"]:
+            cmd["accept"] = self.accept
+        if self.WINDOW_CHUNKS:
+            # El firmware que no lo conoce lo ignora y manda todo de corrido
+            cmd["window"] = self.WINDOW_CHUNKS
+        return cmd
+
+    def start(self):
+        self.started_at = self._asked_at = time.time()
+        self.status = "running"
+        self.hub.add_listener("logpart", self._on_part)
+        self.hub.add_connection_listener(self._on_connection)
+        try:
+            self.hub.publish(self.cmd_topic, self._stream_cmd(self.base_offset), qos=1)
+        except Exception as e:
+            self._detach()
+            self._fail(f"No se pudo publicar stream_log: {e}")
+            return False
+        threading.Thread(target=self._run, name=f"log-download-{self.id}", daemon=True).start()
+        return True
+
+    def _detach(self):
+        self.hub.remove_listener("logpart", self._on_part)
+        self.hub.remove_connection_listener(self._on_connection)
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    @property
+    def position(self):
+        """Bytes del log recibidos en orden (absoluto, incluye lo de antes de reanudar)."""
+        return self.base_offset + self._parser.bytes
+
+    def _fail(self, error):
+        self.error = error
+        self.status = "failed"
+        self.finished_at = time.time()
+
+    # ---------- Hilo de red ----------
+    def _on_connection(self, connected):
+        with self._lock:
+            if self.status != "running":
+                return
+            if not connected and self.paused_since is None:
+                self.paused_since = time.time()
+            elif connected and self.paused_since is not None:
+                self.paused_total += time.time() - self.paused_since
+                self.paused_since = None
+                self._resume_needed = True
+
+    def _on_part(self, m):
+        if self.device is not None and m.device != self.device:
+            return  # log de otro dron (cada uno tiene su descarga)
+        now = time.time()
+        data = decode_part(m.data)
+        with self._lock:
+            if self.status != "running" or self._resume_needed:
+                return  # restos del stream anterior a la reconexión
+            self.last_chunk_at = now
+            self.wire_bytes += data["wire"]
+            if self.encoding is None and not data.get("eof", False):
+                self.encoding = data.get("enc", "csv")
+            if "total" in data:
+                self.total_bytes = data["total"]
+            # Solo llega al parser lo que ya está en orden (duplicados fuera)
+            for chunk_text in self._chunks.accept(data):
+                if chunk_text:
+                    self._parser.feed(chunk_text)
+            self._samples.append((now, self.position))
+            while self._samples and now - self._samples[0][0] > self.RATE_WINDOW_S:
+                self._samples.popleft()
+            if self._chunks.complete:
+                self._eof.set()
+            elif self._chunks.buffered or self._chunks.eof_seen:
+                if self._gap_since is None:
+                    self._gap_since = now
+            else:
+                self._gap_since = None
+            ack = self._ack_due()
+        if ack:
+            self._send_ack(ack)
+
+    # ---------- Control de flujo ----------
+    def _ack_due(self):
+        """log_ack cuando se consumió media ventana (posición siguiente esperada)."""
+        ch = self._chunks
+        if not self.WINDOW_CHUNKS or ch.mode not in ("seq", "offset") or ch.complete:
+            return None
+        if self._acked is None or self._acked[0] != ch.mode:
+            self._acked = (ch.mode, 0 if ch.mode == "seq" else ch.start)
+        # En offset no se sabe cuántos bytes trae un chunk: se usa el tamaño promedio
+        step = self.WINDOW_CHUNKS // 2
+        if ch.mode == "offset":
+            step *= max(1, self._parser.bytes // max(1, self._parser.chunks))
+        if ch.next - self._acked[1] < step:
+            return None
+        self._acked = (ch.mode, ch.next)
+        return {"action": "log_ack", ch.mode: ch.next}
+
+    def _reack_due(self, now):
+        """
+        log_ack va en QoS 0: si se pierde, un dispositivo que respeta la ventana
+        deja de mandar y no llega otra parte que dispare el siguiente ack.
+        Pasado medio IDLE_TIMEOUT_S sin chunks se repite con la posición actual.
+        """
+        ch = self._chunks
+        if (not self.WINDOW_CHUNKS or ch.mode not in ("seq", "offset") or ch.complete
+                or not self.last_chunk_at or self._gap_since is not None):
+            return None
+        if (self._idle_s(now) < self.IDLE_TIMEOUT_S / 2
+                or now - self._reacked_at < self.IDLE_TIMEOUT_S / 4):
+            return None
+        self._reacked_at = now
+        self._acked = (ch.mode, ch.next)
+        return {"action": "log_ack", ch.mode: ch.next}
+
+    def _send_ack(self, ack):
+        try:
+            self.hub.publish(self.cmd_topic, ack, qos=0, log=False)
+        except Exception:
+            pass  # el siguiente ack (o el resend) lo cubre
+
+    # ---------- Hilo vigilante ----------
+    def _request_missing(self):
+        """Pide solo los rangos faltantes (seq o bytes, según use el dispositivo)."""
+        with self._lock:
+            gaps = self._chunks.missing()
+            if not gaps or self._gap_since is None or time.time() - self._gap_since < self.GAP_WAIT_S:
+                return True
+            if self.resend_requests >= self.MAX_RESENDS:
+                return False
+            key = "seqs" if self._chunks.mode == "seq" else "ranges"
+            cmd = {"action": "resend_log", key: gaps}
+            self.resend_requests += 1
+            self._gap_since = time.time()
+        try:
+            self.hub.publish(self.cmd_topic, cmd, qos=1)
+        except Exception:
+            pass  # se reintenta en la siguiente vuelta
+        return True
+
+    def _resume(self):
+        """Tras reconectar: pedir el log desde el último byte recibido en orden."""
+        with self._lock:
+            offset = self.position
+            # Lo que estaba fuera de orden se pierde; el stream nuevo arranca en `offset`
+            self._chunks = ChunkReassembler(start=offset)
+            self._acked = None
+            self._gap_since = None
+            self._resume_needed = False
+            # El reloj de inactividad vuelve a empezar con el pedido nuevo
+            self.last_chunk_at = None
+            self._asked_at = time.time()
+            self.resumes += 1
+        try:
+            self.hub.publish(self.cmd_topic, self._stream_cmd(offset), qos=1)
+        except Exception:
+            with self._lock:
+                self._resume_needed = True
+
+    def _flush(self, force=False):
+        """Guarda las filas completas ya parseadas y anota el checkpoint."""
+        with self._lock:
+            if not force and self._parser.pending_rows < self.FLUSH_ROWS:
+                return
+            df = self._parser.take_rows()
+            committed = self.base_offset + self._parser.committed_bytes
+        self._store_rows(df)
+        self._write_checkpoint(committed)
+
+    def _store_rows(self, df):
+        # Firmware antiguo ignora since_ts y manda todo: recortamos aquí
+        if self.since_ts is not None and not df.empty:
+            df = df[df["ts"] >= self.since_ts]
+        df, rejected = validate_rows(df, self.policy)
+        with self._lock:
+            merge_rejected(self.invalid, rejected)
+        self.n_new += self.store.append(df)
+
+    def _write_checkpoint(self, offset):
+        if not self.checkpoint_path:
+            return
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"id": self.id, "since_ts": self.since_ts, "offset": offset,
+                       "rows": self._parser.rows, "updated_at": time.time()}, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _clear_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _run(self):
+        try:
+            reason = self._wait()
+            self._detach()
+            self._finish(reason)
+        except Exception as e:
+            self._detach()
+            self._fail(f"Error al procesar CSV: {e}")
+
+    def _rate(self):
+        """Bytes/s de los últimos RATE_WINDOW_S (o promedio si hay pocas muestras)."""
+        if len(self._samples) >= 2:
+            (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+            if t1 > t0:
+                return (b1 - b0) / (t1 - t0)
+        active = self._active_s(time.time())
+        return self._parser.bytes / active if active > 0 else 0.0
+
+    def _active_s(self, now):
+        """Segundos de descarga sin contar las pausas por desconexión."""
+        if not self.started_at:
+            return 0.0
+        paused = self.paused_total
+        if self.paused_since is not None:
+            paused += now - self.paused_since
+        return now - self.started_at - paused
+
+    def _idle_limit(self):
+        return self.IDLE_TIMEOUT_S if self.last_chunk_at else self.FIRST_CHUNK_S
+
+    def _idle_s(self, now):
+        """Segundos sin recibir chunks (desde el pedido si aún no llegó ninguno)."""
+        ref = self.last_chunk_at or self._asked_at
+        return max(0.0, now - ref) if ref else 0.0
+
+    def _deadline_s(self):
+        """
+        Plazo total (segundos activos). Con el total informado crece con el
+        tamaño y la velocidad medida; sin él, solo manda la inactividad.
+        """
+        if not self.total_bytes:
+            return max(self.timeout_s, self.MAX_DURATION_S)
+        # Aún sin velocidad medida, el vigilante de inactividad corta antes
+        rate = self._rate()
+        if rate <= 0:
+            return max(self.timeout_s, self.MAX_DURATION_S)
+        return max(self.timeout_s, self.DEADLINE_MARGIN * self.total_bytes / rate)
+
+    def _wait(self):
+        while not self._eof.wait(0.25):
+            now = time.time()
+            if self.paused_since is not None:
+                self._flush(force=True)
+                if now - self.paused_since > self.RESUME_WAIT_S:
+                    return "disconnected"
+                continue
+            if self._resume_needed and self.hub.connected:
+                self._resume()
+                continue
+            with self._lock:
+                # Con un hueco pendiente manda la lógica de resend_log
+                idle = self._idle_s(now) > self._idle_limit() and self._gap_since is None
+                late = self._active_s(now) > self._deadline_s()
+                reack = None if idle else self._reack_due(now)
+            if reack:
+                self._send_ack(reack)
+            if idle:
+                return "idle"
+            if late:
+                return "timeout"
+            if not self._request_missing():
+                return "gaps"
+            self._flush()
+        return "eof"
+
+    def _finish(self, reason):
+        if reason != "eof":
+            # Lo parseado hasta aquí se guarda; el checkpoint permite reanudar después
+            self._flush(force=True)
+            with self._lock:
+                gaps = self._chunks.missing()
+                if reason == "disconnected":
+                    self._fail(f"MQTT sin conexión más de {self.RESUME_WAIT_S:.0f}s; "
+                               f"se puede reanudar desde el byte {self.position}")
+                elif reason == "gaps":
+                    self._fail(f"Faltan chunks tras {self.resend_requests} retransmisiones: {gaps[:5]}")
+                elif self._chunks.eof_seen:
+                    self._fail(f"Timeout: llegó EOF pero faltan chunks {gaps[:5]}")
+                elif reason == "idle" and not self._parser.chunks:
+                    self._fail(f"El dispositivo no respondió en {self.FIRST_CHUNK_S:.0f}s")
+                elif reason == "idle":
+                    self._fail(f"Sin chunks durante {self.IDLE_TIMEOUT_S:.0f}s "
+                               f"(chunks={self._parser.chunks}, byte {self.position})")
+                else:
+                    self._fail(f"Timeout: no llegó EOF en {self._deadline_s():.0f}s (chunks={self._parser.chunks})")
+            return
+        # Las filas ya vienen parseadas y tipadas; solo falta cerrar la última línea
+        with self._lock:
+            df_new = self._parser.finish()
+        self._store_rows(df_new)
+        self._clear_checkpoint()
+        self.status = "done"
+        self.finished_at = time.time()
+
+    # ---------- Consulta desde la UI ----------
+    def progress(self):
+        """Foto del avance: chunks, bytes, filas, bytes/s y ETA (si se conoce el total)."""
+        with self._lock:
+            p = self._parser
+            now = self.finished_at or time.time()
+            elapsed = now - self.started_at if self.started_at else 0.0
+            rate = self._rate()
+            eta = None
+            if self.total_bytes and rate > 0:
+                eta = max(0.0, (self.total_bytes - self.position) / rate)
+            return {
+                "status": self.status, "error": self.error, "n_new": self.n_new,
+                "chunks": p.chunks, "bytes": self.position, "rows": p.rows,
+                "total_bytes": self.total_bytes, "rate_bps": rate, "eta_s": eta,
+                "elapsed_s": elapsed,
+                "duplicates": self._chunks.duplicates, "buffered": self._chunks.buffered,
+                "missing": self._chunks.missing(), "resends": self.resend_requests,
+                "paused": self.paused_since is not None, "resumes": self.resumes,
+                "encoding": self.encoding, "wire_bytes": self.wire_bytes,
+                "malformed": p.rejected, "invalid": dict(self.invalid),
+                "idle_s": self._idle_s(now) if self.status == "running" else 0.0,
+                "deadline_s": self._deadline_s(),
+            }
+
+
+class DownloadManager:
+    """Una descarga a la vez por dron y proceso; todas las sesiones ven la misma."""
+
+    def __init__(self, hub, store, cmd_topic, columns, checkpoint_path=None, accept=LOG_ENCODINGS,
+                 policy=None, device=None):
+        self.hub = hub
+        self.device = device
+        self.store = store
+        self.cmd_topic = cmd_topic
+        self.columns = columns
+        self.checkpoint_path = checkpoint_path
+        self.accept = accept
+        self.policy = policy
+        self._lock = threading.Lock()
+        self.current = None
+
+    @property
+    def busy(self):
+        job = self.current
+        return job is not None and job.running
+
+    @property
+    def resumable(self):
+        """Checkpoint en disco de una descarga que no terminó (o None)."""
+        if self.busy or not self.checkpoint_path:
+            return None
+        return load_checkpoint(self.checkpoint_path)
+
+    def start(self, since_ts=None, timeout_s=16.0, resume=False):
+        """
+        Arranca una descarga; devuelve (job, msg_error).
+        Con resume=True continúa la del checkpoint (mismo since_ts, desde su offset).
+        """
+        with self._lock:
+            if self.busy:
+                return (self.current, "Ya hay una descarga en curso")
+            if not self.hub.connected:
+                return (None, "MQTT no conectado")
+            offset = 0
+            if resume:
+                ckpt = load_checkpoint(self.checkpoint_path) if self.checkpoint_path else None
+                if ckpt is None:
+                    return (None, "No hay descarga para reanudar")
+                since_ts, offset = ckpt.get("since_ts"), int(ckpt.get("offset", 0))
+            elif self.checkpoint_path and os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            job = LogDownload(self.hub, self.store, self.cmd_topic, self.columns,
+                              since_ts=since_ts, timeout_s=timeout_s, offset=offset,
+                              checkpoint_path=self.checkpoint_path, accept=self.accept,
+                              policy=self.policy, device=self.device)
+            if not job.start():
+                return (None, job.error)
+            self.current = job
+        return (job, "")
+
+
+class FleetDownloads:
+    """Un DownloadManager por dron, creado al primer uso; descargan en paralelo."""
+
+    def __init__(self, hub, history, columns, cmd_topic, checkpoint_path, accept=LOG_ENCODINGS,
+                 policy=None):
+        self.hub = hub
+        self.history = history              # FleetHistory
+        self.columns = columns
+        self.cmd_topic = cmd_topic          # device -> tópico de comandos
+        self.checkpoint_path = checkpoint_path  # device -> ruta del checkpoint
+        self.accept = accept
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._managers = {}
+
+    def manager(self, device):
+        with self._lock:
+            mgr = self._managers.get(device)
+            if mgr is None:
+                mgr = self._managers[device] = DownloadManager(
+                    self.hub, self.history.store(device), self.cmd_topic(device), self.columns,
+                    checkpoint_path=self.checkpoint_path(device), accept=self.accept,
+                    policy=self.policy, device=device)
+            return mgr
+
+    def managers(self):
+        with self._lock:
+            return dict(self._managers)
+
+    def jobs(self):
+        """{device: última descarga} de los drones que ya descargaron algo."""
+        return {dev: mgr.current for dev, mgr in self.managers().items() if mgr.current is not None}
+
+    @property
+    def busy(self):
+        return any(mgr.busy for mgr in self.managers().values())
@@ -0,0 +1,151 @@
+# =========================================================
+# Mapa del historial con nivel de detalle
+# - Hasta max_points filas: un punto por fila, solo con las columnas del tooltip
+# - Más filas: celdas de una malla en metros agregadas en el servidor
+#   (conteo, GPS OK, velocidad media); la celda más chica que deja
+#   como mucho max_points celdas
+# - La capa ya armada (registros listos para JSON) queda en caché por
+#   (día, drones, radio, versión de los datos) y la comparten las sesiones
+# =========================================================
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+M_PER_DEG_LAT = 110_540.0
+M_PER_DEG_LON = 111_320.0      # en el ecuador; se escala por cos(lat)
+CELL_SIZES_M = (2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+POINT_TOOLTIP = ("{device} · Drop #{drop_id}\n{time}\nlat={lat}\nlon={lon}\nalt={alt} m\n"
+                 "speed={speed_mps} m/s\nsats={sats}\nfix_ok={fix_ok}")
+CELL_TOOLTIP = "{count} puntos (celda de {cell_m} m)\nGPS OK={gps_ok}\nspeed={speed_mps} m/s"
+
+
+def _records(df):
+    # NaN no es JSON válido: None -> null
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def _cell_keys(lat, lon, lat0, cell_m):
+    """Id entero de la celda de cada punto (proyección equirectangular local)."""
+    kx = M_PER_DEG_LON * np.cos(np.radians(lat0)) / cell_m
+    ix = np.floor(lon * kx).astype(np.int64)
+    iy = np.floor(lat * (M_PER_DEG_LAT / cell_m)).astype(np.int64)
+    return (ix - ix.min()) * (int(iy.max() - iy.min()) + 1) + (iy - iy.min())
+
+
+def choose_cell_size(lat, lon, max_cells):
+    """Celda más chica de CELL_SIZES_M con la que no hay más de max_cells celdas ocupadas."""
+    lat0 = float(np.mean(lat))
+    for cell_m in CELL_SIZES_M:
+        if len(np.unique(_cell_keys(lat, lon, lat0, cell_m))) <= max_cells:
+            return cell_m
+    return CELL_SIZES_M[-1]
+
+
+def grid_cells(df, cell_m):
+    """
+    Agregado por celda de `cell_m` metros: centroide, conteo, GPS OK y
+    velocidad media. `df` sin NaN en lat/lon.
+    """
+    lat, lon = df["lat"].to_numpy(np.float64), df["lon"].to_numpy(np.float64)
+    keys = _cell_keys(lat, lon, float(np.mean(lat)), cell_m)
+    _, inv = np.unique(keys, return_inverse=True)
+    count = np.bincount(inv)
+    speed = df["speed_mps"].to_numpy(np.float64)
+    has_speed = ~np.isnan(speed)
+    speed_n = np.bincount(inv, weights=has_speed)
+    speed_sum = np.bincount(inv, weights=np.where(has_speed, speed, 0.0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed_mean = np.where(speed_n > 0, speed_sum / speed_n, np.nan)
+    return pd.DataFrame({
+        "lon": np.bincount(inv, weights=lon) / count,
+        "lat": np.bincount(inv, weights=lat) / count,
+        "count": count,
+        "gps_ok": np.bincount(inv, weights=np.nan_to_num(df["fix_ok"].to_numpy(np.float64))).astype(np.int64),
+        "speed_mps": speed_mean,
+    })
+
+
+def density_colors(count):
+    """Amarillo (pocas) -> rojo (muchas), escala logarítmica, RGBA."""
+    c = np.log1p(np.asarray(count, dtype=np.float64))
+    t = (c - c.min()) / (c.max() - c.min()) if c.max() > c.min() else np.ones_like(c)
+    green = np.rint(220 * (1 - t)).astype(int)
+    return [[255, int(g), 0, 200] for g in green]
+
+
+def point_layer(df, radius, colors=None):
+    """Un punto por fila: solo lo que usan la posición, el color y el tooltip."""
+    out = pd.DataFrame({
+        "lon": df["lon"].round(7), "lat": df["lat"].round(7),
+        "device": df["device"] if "device" in df.columns else "",
+        "drop_id": df["drop_id"], "time": df["dt"].dt.strftime("%H:%M:%S"),
+        "alt": df["alt"].round(1), "speed_mps": df["speed_mps"].round(2),
+        "sats": df["sats"], "fix_ok": df["fix_ok"],
+    })
+    fill = [255, 0, 0]
+    if colors:
+        out["color"] = out["device"].map(lambda d: colors.get(d, fill))
+        fill = "color"
+    return {"type": "ScatterplotLayer", "data": _records(out), "get_position": "[lon, lat]",
+            "get_radius": radius, "get_fill_color": fill, "pickable": True}
+
+
+def cell_layer(df, radius, cell_m):
+    """Celdas agregadas: el radio cubre media celda y el color marca la densidad."""
+    cells = grid_cells(df, cell_m)
+    cells["speed_mps"] = cells["speed_mps"].round(2)
+    cells["lon"], cells["lat"] = cells["lon"].round(7), cells["lat"].round(7)
+    cells["cell_m"] = cell_m
+    cells["color"] = density_colors(cells["count"])
+    return {"type": "ScatterplotLayer", "data": _records(cells), "get_position": "[lon, lat]",
+            "get_radius": max(radius, cell_m / 2), "radius_min_pixels": 2,
+            "get_fill_color": "color", "pickable": True}
+
+
+class MapLayers:
+    """
+    Capas del mapa del historial, compartidas por todas las sesiones
+    (se crea una vez con st.cache_resource). Cada entrada guarda la capa
+    lista para pydeck, el centro de la vista y el tooltip que le toca.
+    """
+
+    def __init__(self, max_points=5000, max_entries=16):
+        self.max_points = max_points
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (day, drones, radio, versión) -> entrada
+
+    def build(self, df, radius, colors=None):
+        df = df.dropna(subset=["lat", "lon"])
+        if df.empty:
+            return None
+        entry = {"points": len(df), "center": (float(df["lat"].mean()), float(df["lon"].mean()))}
+        if len(df) <= self.max_points:
+            entry.update(mode="points", cell_m=None, shown=len(df), tooltip=POINT_TOOLTIP,
+                         layer=point_layer(df, radius, colors))
+        else:
+            lat, lon = df["lat"].to_numpy(np.float64), df["lon"].to_numpy(np.float64)
+            cell_m = choose_cell_size(lat, lon, self.max_points)
+            layer = cell_layer(df, radius, cell_m)
+            entry.update(mode="cells", cell_m=cell_m, shown=len(layer["data"]),
+                         tooltip=CELL_TOOLTIP, layer=layer)
+        return entry
+
+    def get(self, day, devices, radius, version, df, colors=None):
+        """Capa de (day, devices, radius) para `version`; se arma solo si no está en caché."""
+        key = (day, tuple(devices), radius, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self.build(df, radius, colors)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
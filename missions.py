@@ -0,0 +1,290 @@
+# =========================================================
+# Misiones detectadas en el historial de cada dron
+# - Una misión empieza con un hueco de más de MISSION_GAP_S en ts o cuando
+#   el drop_id vuelve atrás; puede cruzar la medianoche
+# - Índice persistente por dron (<dron>.missions.json): inicio/fin, tramos de
+#   filas por día, bbox, conteos y velocidad media
+# - Incremental: solo se recalcula desde el primer día que cambió (y la misión
+#   que venía del día anterior, por si continúa)
+# - Las filas de una misión son tramos contiguos del día ordenado del más
+#   reciente: se sacan con iloc, sin filtrar el día por ts
+# =========================================================
+
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from history_store import TableIndex
+
+MISSION_GAP_S = 600.0
+_FORMAT = 1
+
+
+def mission_breaks(ts, drop_id, gap_s=MISSION_GAP_S):
+    """True en cada fila que abre una misión (ts ascendente)."""
+    ts = np.asarray(ts, dtype=np.float64)
+    if not len(ts):
+        return np.zeros(0, dtype=bool)
+    # Un drop_id faltante no debe esconder un reinicio del contador
+    drop_id = pd.Series(np.asarray(drop_id, dtype=np.float64)).ffill().to_numpy()
+    with np.errstate(invalid="ignore"):
+        return np.r_[True, (np.diff(ts) > gap_s) | (drop_id[1:] < drop_id[:-1])]
+
+
+def _day_rows(frames, days):
+    """
+    Filas de `days` en orden ascendente de ts, con su día y su posición en el
+    día (más reciente primero), y la versión de cada día que se leyó.
+    """
+    cols = {c: [] for c in ("ts", "drop_id", "lat", "lon", "speed_mps", "fix_ok", "day", "pos")}
+    versions = {}
+    for i, day in enumerate(days):
+        df, versions[day.isoformat()] = frames.day_snapshot(day, newest_first=True)
+        n = len(df)
+        for c in ("ts", "drop_id", "lat", "lon", "speed_mps", "fix_ok"):
+            cols[c].append(df[c].to_numpy(np.float64)[::-1])
+        cols["day"].append(np.full(n, i))
+        cols["pos"].append(np.arange(n)[::-1])
+    return {c: np.concatenate(v) if v else np.empty(0) for c, v in cols.items()}, versions
+
+
+def segment(device, frames, days, since_ts=None, gap_s=MISSION_GAP_S):
+    """
+    Misiones de las filas de `days` (ordenados) con ts >= since_ts, y la
+    versión de cada día con la que se calcularon sus tramos.
+    """
+    rows, versions = _day_rows(frames, days)
+    if since_ts is not None:
+        keep = rows["ts"] >= since_ts
+        rows = {c: v[keep] for c, v in rows.items()}
+    ts = rows["ts"]
+    if not len(ts):
+        return [], versions
+    starts = np.flatnonzero(mission_breaks(ts, rows["drop_id"], gap_s))
+    ends = np.r_[starts[1:], len(ts)]
+    # Filas contiguas por misión: todo sale de reduceat sobre los cortes
+    n = ends - starts
+    speed = rows["speed_mps"]
+    speed_n = np.add.reduceat((~np.isnan(speed)).astype(np.int64), starts)
+    speed_sum = np.add.reduceat(np.nan_to_num(speed), starts)
+    agg = {
+        "lat_min": np.fmin.reduceat(rows["lat"], starts), "lat_max": np.fmax.reduceat(rows["lat"], starts),
+        "lon_min": np.fmin.reduceat(rows["lon"], starts), "lon_max": np.fmax.reduceat(rows["lon"], starts),
+        "drop_first": np.fmin.reduceat(rows["drop_id"], starts),
+        "drop_last": np.fmax.reduceat(rows["drop_id"], starts),
+        "gps_ok": np.add.reduceat(np.nan_to_num(rows["fix_ok"]), starts),
+    }
+    # Tramos: cambia la misión o cambia el día
+    mission = np.repeat(np.arange(len(starts)), n)
+    day_i = rows["day"].astype(int)
+    cut = np.flatnonzero(np.r_[True, (mission[1:] != mission[:-1]) | (day_i[1:] != day_i[:-1])])
+    cut_end = np.r_[cut[1:], len(ts)]
+    spans = [[] for _ in starts]
+    for a, b in zip(cut, cut_end):
+        # Ascendente en ts = descendente en la posición del día
+        spans[mission[a]].append([days[day_i[a]].isoformat(), int(rows["pos"][b - 1]), int(rows["pos"][a]) + 1])
+
+    out = []
+    for i, (a, b) in enumerate(zip(starts, ends)):
+        m = {"id": f"{device}@{ts[a]:.0f}", "device": device,
+             "start_ts": float(ts[a]), "end_ts": float(ts[b - 1]), "points": int(n[i]),
+             "gps_ok": int(agg["gps_ok"][i]),
+             "speed_mean": float(speed_sum[i] / speed_n[i]) if speed_n[i] else None,
+             "speed_n": int(speed_n[i]), "spans": spans[i]}
+        for k in ("lat_min", "lat_max", "lon_min", "lon_max", "drop_first", "drop_last"):
+            v = agg[k][i]
+            m[k] = None if np.isnan(v) else float(v)
+        out.append(m)
+    return out, versions
+
+
+class MissionIndex:
+    """
+    Misiones de un dron sobre su almacén y su DayFrameCache, guardadas en
+    `path`. El archivo se reescribe entero (os.replace) al cambiar.
+    Con writable=False (dashboard con INGEST=daemon) el índice lo mantiene
+    otro proceso: aquí solo se vuelve a leer cuando cambia el archivo.
+    """
+
+    def __init__(self, device, store, frames, path, gap_s=MISSION_GAP_S, writable=True):
+        self.device = device
+        self.store = store
+        self.frames = frames
+        self.path = path
+        self.gap_s = gap_s
+        self.writable = writable
+        self._lock = threading.Lock()
+        self._store_version = None
+        self._mtime = None          # mtime del archivo leído (modo solo lectura)
+        self._days = {}             # "YYYY-MM-DD" -> day_version indexada
+        self._missions = []         # ordenadas por start_ts
+        self._load()
+
+    def _load(self):
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("format") == _FORMAT and data.get("gap_s") == self.gap_s:
+            self._days = data.get("days", {})
+            self._missions = data.get("missions", [])
+
+    def _save(self):
+        # Temporal propio: el dashboard y la ingesta pueden guardar a la vez
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".",
+                                   prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"format": _FORMAT, "device": self.device, "gap_s": self.gap_s,
+                           "days": self._days, "missions": self._missions}, f)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def _reload(self):
+        """Solo lectura: relee el archivo si otro proceso lo reescribió."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            self._load()
+            return True
+
+    def refresh(self):
+        """Pone el índice al día con el almacén; devuelve True si cambió algo."""
+        if not self.writable:
+            return self._reload()
+        version = self.store.version()
+        with self._lock:
+            if version == self._store_version:
+                return False
+            current = {d.isoformat(): self.store.day_version(d) for d in self.store.days()}
+            changed = sorted(d for d, v in current.items() if self._days.get(d) != v)
+            if set(self._days) - set(current):
+                changed, self._missions = sorted(current), []   # se borraron días: desde cero
+            if changed:
+                first = changed[0]
+                keep = [m for m in self._missions if m["spans"][-1][0] < first]
+                since_ts, start = None, date.fromisoformat(first)
+                # La última misión que queda pudo seguir pasada la medianoche
+                if keep and date.fromisoformat(keep[-1]["spans"][-1][0]) >= start - timedelta(days=1):
+                    keep.pop()
+                # Se recalcula desde donde empezaba la primera misión descartada
+                redo = self._missions[len(keep):]
+                if redo and redo[0]["spans"][0][0] < first:
+                    since_ts, start = redo[0]["start_ts"], date.fromisoformat(redo[0]["spans"][0][0])
+                days = [date.fromisoformat(d) for d in sorted(current) if d >= start.isoformat()]
+                missions, versions = segment(self.device, self.frames, days, since_ts, self.gap_s)
+                self._missions = keep + missions
+                # La versión de las filas segmentadas, no una releída después: si
+                # llegaron filas entre medio, el próximo refresh recalcula ese día
+                current.update(versions)
+                self._days = current
+                self._save()
+            self._store_version = version
+            return bool(changed)
+
+    def missions(self):
+        self.refresh()
+        with self._lock:
+            return list(self._missions)
+
+    def get(self, mission_id):
+        for m in self.missions():
+            if m["id"] == mission_id:
+                return m
+        return None
+
+    def version(self, mission):
+        """Versión de los días de la misión: si cambia, sus tramos ya no sirven."""
+        with self._lock:
+            return tuple(self._days.get(day) for day, _, _ in mission["spans"])
+
+    def frame(self, mission):
+        """Filas de la misión, la más reciente primero (tramos del caché de cada día)."""
+        parts = []
+        for day, a, b in reversed(mission["spans"]):
+            df = self.frames.day_frame(date.fromisoformat(day), newest_first=True)
+            if self.frames.version(date.fromisoformat(day)) == self._days.get(day):
+                parts.append(df.iloc[a:b])
+            else:
+                # El índice de otro proceso todavía no vio las filas nuevas del día: por ts
+                ts = df["ts"]
+                parts.append(df[(ts >= mission["start_ts"]) & (ts <= mission["end_ts"])])
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+
+
+class FleetMissions:
+    """
+    Un MissionIndex por dron sobre FleetHistory (se crea una vez con
+    st.cache_resource) y las tablas por página de las misiones vistas.
+    """
+
+    def __init__(self, history, path_for, gap_s=MISSION_GAP_S, max_tables=8, writable=True):
+        self.history = history
+        self.path_for = path_for            # device -> ruta del índice
+        self.gap_s = gap_s
+        self.writable = writable            # False: el índice lo escribe python -m ingest
+        self.max_tables = max_tables
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._tables = OrderedDict()        # (id, versión) -> TableIndex
+
+    def index(self, device):
+        with self._lock:
+            index = self._indexes.get(device)
+            if index is None:
+                index = self._indexes[device] = MissionIndex(
+                    device, self.history.store(device), self.history.frames(device),
+                    self.path_for(device), self.gap_s, self.writable)
+            return index
+
+    def refresh(self, devices):
+        return [d for d in devices if self.index(d).refresh()]
+
+    def missions(self, devices):
+        """Misiones de los drones elegidos, la más reciente primero."""
+        out = [m for d in devices for m in self.index(d).missions()]
+        return sorted(out, key=lambda m: m["start_ts"], reverse=True)
+
+    def get(self, mission_id):
+        device = mission_id.rsplit("@", 1)[0]
+        return self.index(device).get(mission_id)
+
+    def version(self, mission):
+        return self.index(mission["device"]).version(mission)
+
+    def frame(self, mission):
+        return self.index(mission["device"]).frame(mission)
+
+    def metrics(self, mission):
+        """Mismas claves que DayFrameCache.day_metrics (_metrics), desde el índice (sin leer filas)."""
+        return {"points": mission["points"], "gps_ok": mission["gps_ok"],
+                "speed_mean": mission["speed_mean"], "speed_n": mission["speed_n"]}
+
+    def table(self, mission):
+        key = (mission["id"], self.version(mission))
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                return table
+        table = TableIndex(self.frame(mission), key[1])
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        return table
@@ -0,0 +1,223 @@
+# =========================================================
+# Hub MQTT compartido por todo el proceso
+# - Un solo cliente paho con loop_start() (hilo de red propio)
+# - Reconexión automática y re-suscripción en on_connect
+# - Listeners por tipo de mensaje: cada consumidor (latido, recorrido en vivo,
+#   eventos, log) guarda solo lo que necesita
+# - Tópicos con comodín (drone/+/state): el segmento del "+" es el dispositivo
+# =========================================================
+
+import json
+import os
+import ssl
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+HubMessage = namedtuple("HubMessage", "seq t topic data device")
+
+RC_MAP = {0: "OK", 1: "Proto incorrecto", 2: "ID inválido", 3: "Servidor no disponible",
+          4: "Usuario/Pass incorrecto", 5: "No autorizado"}
+
+
+def _rc_value(rc):
+    # paho v2 envía un ReasonCode con .value; soportamos ambos
+    return rc.value if hasattr(rc, "value") else rc
+
+
+class MqttHub:
+    """
+    Dueño de la única conexión al broker. Los callbacks corren en el hilo de
+    red de paho, así que aquí no se toca st.session_state: cada mensaje se
+    entrega a los listeners de su tipo.
+    """
+
+    def __init__(self, host, port, ws_path, username, password, topics,
+                 raw_kinds=(), client_prefix="st-hub", echo=None):
+        self.host = host
+        self.port = port
+        self.ws_path = ws_path
+        self.username = username
+        self.password = password
+        # kind -> (topic, qos), p. ej. {"state": ("drone/+/state", 1)}
+        self.topics = dict(topics)
+        self._kind_by_topic = {topic: kind for kind, (topic, _qos) in self.topics.items()
+                               if "+" not in topic and "#" not in topic}
+        self._wildcards = [(topic, kind) for kind, (topic, _qos) in self.topics.items()
+                           if topic not in self._kind_by_topic]
+        # Tipos que pueden traer tramas binarias: si no es JSON, `data` queda en bytes
+        self.raw_kinds = set(raw_kinds)
+        self.client_prefix = client_prefix
+        # echo(texto): copia del diagnóstico (p. ej. a logging en la ingesta sin UI)
+        self.echo = echo
+
+        self._lock = threading.Lock()
+        self._client = None
+        self._seq = 0
+        self._listeners = {kind: [] for kind in self.topics}
+        self._conn_listeners = []
+        self.connected = False
+        self.connected_since = None
+        self.diag = deque(maxlen=200)
+
+    # ---------- Diagnóstico ----------
+    def log(self, text):
+        self.diag.append(f"{datetime.now().strftime('%H:%M:%S')} {text}")
+        if self.echo is not None:
+            self.echo(text)
+
+    @property
+    def running(self):
+        return self._client is not None
+
+    # ---------- Conexión ----------
+    def start(self, insecure_tls=False):
+        """Crea el cliente y arranca su hilo de red (idempotente)."""
+        with self._lock:
+            if self._client is not None:
+                return
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                                 client_id=f"{self.client_prefix}-{os.getpid()}-{int(time.time())}",
+                                 transport="websockets")
+            client.on_connect = self._on_connect
+            client.on_disconnect = self._on_disconnect
+            client.on_connect_fail = self._on_connect_fail
+            client.on_message = self._on_message
+            client.username_pw_set(self.username, self.password)
+            client.ws_set_options(path=self.ws_path)
+            client.tls_set(cert_reqs=ssl.CERT_REQUIRED)
+            client.tls_insecure_set(bool(insecure_tls))
+            # paho reintenta solo dentro de loop_start(); espera creciente 1..30 s
+            client.reconnect_delay_set(min_delay=1, max_delay=30)
+            self._client = client
+        self.log("Creando cliente MQTT compartido...")
+        try:
+            client.connect_async(self.host, self.port, keepalive=60)
+            client.loop_start()
+        except Exception as e:
+            self.log(f"Error al conectar MQTT: {e}")
+            with self._lock:
+                self._client = None
+
+    def stop(self):
+        with self._lock:
+            client, self._client = self._client, None
+        if client is None:
+            return
+        try:
+            client.disconnect()
+            client.loop_stop()
+        except Exception:
+            pass
+        self.connected = False
+        self.connected_since = None
+        self.log("MQTT desconectado.")
+
+    def wait_connected(self, timeout_s):
+        t0 = time.time()
+        while not self.connected and time.time() - t0 < timeout_s:
+            time.sleep(0.05)
+        return self.connected
+
+    def publish(self, topic, payload_obj, qos=1, log=True):
+        """Publica JSON; lanza RuntimeError si no hay conexión."""
+        client = self._client
+        if client is None or not self.connected:
+            raise RuntimeError("Cliente MQTT no conectado.")
+        info = client.publish(topic, json.dumps(payload_obj), qos=qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise RuntimeError(f"publish rc={info.rc}")
+        if log:
+            self.log(f"CMD -> {payload_obj}")
+        return info
+
+    # ---------- Suscriptores ----------
+    def add_listener(self, kind, fn):
+        """fn(HubMessage) se llama en el hilo de red por cada mensaje de `kind`."""
+        with self._lock:
+            self._listeners[kind].append(fn)
+
+    def remove_listener(self, kind, fn):
+        with self._lock:
+            if fn in self._listeners[kind]:
+                self._listeners[kind].remove(fn)
+
+    def add_connection_listener(self, fn):
+        """fn(connected: bool) en cada conexión (ya suscrito) o desconexión."""
+        with self._lock:
+            self._conn_listeners.append(fn)
+
+    def remove_connection_listener(self, fn):
+        with self._lock:
+            if fn in self._conn_listeners:
+                self._conn_listeners.remove(fn)
+
+    def _notify_connection(self, connected):
+        with self._lock:
+            listeners = list(self._conn_listeners)
+        for fn in listeners:
+            try:
+                fn(connected)
+            except Exception as e:
+                self.log(f"Error en listener de conexión: {e}")
+
+    # ---------- Callbacks (hilo de red) ----------
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        rc_value = _rc_value(rc)
+        self.connected = (rc_value == 0)
+        self.log(f"on_connect rc={rc_value} ({RC_MAP.get(rc_value, '?')})")
+        if rc_value == 0:
+            self.connected_since = time.time()
+            client.subscribe([(topic, qos) for topic, qos in self.topics.values()])
+            self.log("Suscrito a tópicos.")
+            self._notify_connection(True)
+
+    def _on_connect_fail(self, client, userdata):
+        self.log("No se pudo conectar al broker; reintentando...")
+
+    def _on_disconnect(self, client, userdata, flags, rc=None, properties=None):
+        self.connected = False
+        self.connected_since = None
+        self.log(f"on_disconnect rc={_rc_value(rc)}")
+        self._notify_connection(False)
+
+    def _route(self, topic):
+        """(kind, device) de un tópico recibido, o (None, None)."""
+        kind = self._kind_by_topic.get(topic)
+        if kind is not None:
+            return (kind, None)
+        for pattern, kind in self._wildcards:
+            if mqtt.topic_matches_sub(pattern, topic):
+                levels = pattern.split("/")
+                device = topic.split("/")[levels.index("+")] if "+" in levels else None
+                return (kind, device)
+        return (None, None)
+
+    def _on_message(self, client, userdata, msg):
+        kind, device = self._route(msg.topic)
+        if kind is None:
+            return
+        try:
+            if kind in self.raw_kinds and msg.payload[:1] != b"{":
+                data = bytes(msg.payload)
+            else:
+                payload = msg.payload.decode("utf-8", errors="ignore")
+                try:
+                    data = json.loads(payload)
+                except ValueError:
+                    data = payload
+            with self._lock:
+                self._seq += 1
+                m = HubMessage(self._seq, time.time(), msg.topic, data, device)
+                listeners = list(self._listeners[kind])
+        except Exception as e:
+            self.log(f"Error en on_message: {e}")
+            return
+        for fn in listeners:
+            try:
+                fn(m)
+            except Exception as e:
+                self.log(f"Error en listener de {kind}: {e}")
@@ -2,11 +2,59 @@
 
 # Streamlit + HiveMQ Cloud — Versión robusta y bloqueante
 
-# - Sin threads
+# - Un solo cliente MQTT por proceso (MqttHub, hilo de red de paho)
 
-# - Descarga de log en modo bloqueante (timeout 16s)
+# - Descarga de log en segundo plano con progreso en vivo; corta por
 
-# - Mantiene loop() en idle para no perder conexión
+#   inactividad y el plazo total se ajusta al tamaño y la velocidad
+
+# - Fragmentos con run_every mantienen loop() y el estado en vivo;
+
+#   la página completa solo se recalcula cuando cambian sus entradas
+
+# - Con INGEST=daemon el log lo baja python -m ingest y esta página solo lo muestra
+
+# - Flota: tópicos drone/+/..., historial y descarga por dron; el mapa y las
+
+#   métricas leen solo los drones elegidos
+
+# - Recorrido en vivo de T_STATE en un ring buffer de tamaño fijo por dron;
+
+#   el mapa en vivo se refresca a 1–10 Hz con los últimos N puntos
+
+# - Eventos de T_EVENTS guardados por dron; línea de tiempo y marcadores del día
+
+# - start/stop llevan cmd_id: se mide la latencia hasta la confirmación del
+
+#   dron y el STOP se reenvía hasta que llegue o venza su plazo
+
+# - Latido T_INFO por dron: frecuencia, jitter y pérdida; en línea / degradado /
+
+#   perdido se evalúa en cada refresco
+
+# - Tabla por páginas: orden y filtros en el servidor sobre índices en caché;
+
+#   al navegador solo va la página visible
+
+# - Mapa con nivel de detalle: en días grandes van celdas agregadas en el servidor;
+
+#   la capa queda en caché por día, radio y versión de los datos
+
+# - Consultas espaciales sobre todo el historial (radio, rectángulo, polígono,
+
+#   más cercanos) con un índice de malla que crece con cada descarga
+
+# - Calidad de la misión: separación real entre drops vs. la pedida, huecos,
+
+#   racimos, velocidad/altitud y GPS; vectorizado y en caché por día o misión
+
+# - Misiones detectadas solas (huecos de ts, reinicio de drop_id) con índice
+
+#   persistente por dron; ver una misión va directo a sus filas
+
+# - Temporada: resúmenes por día y semana materializados (se ponen al día con
+
+#   las filas nuevas); un rango de meses se lee de ellos, no de las filas
 
 # =========================================================
 
@@ -14,19 +62,53 @@
 
 import streamlit as st
 
-import time, ssl, os, json, io, base64
+import time, base64
 
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+
+import numpy as np
 
 import pandas as pd
 
-import paho.mqtt.client as mqtt
 
 
+import config
+
+from config import (DATA_COLUMNS, DEV_ID, HISTORY_BACKEND, INGEST_MODE, LIVE_CAPACITY, LIVE_POINTS,
+
+                    LIVE_REFRESH_S, LOCAL_TZ, MAP_MAX_POINTS, cmd_topic, get_setting, make_downloads, make_hub,
+
+                    migrate_legacy, valid_device)
+
+from command_tracker import CommandTracker
+
+from drop_analytics import GAP_FACTOR, GAP_S, DropAnalytics
+
+from heartbeat import HeartbeatMonitor
+
+from ingest import load_status
 
-# ---------- Archivo de datos persistente ----------
+from live_track import LiveTracks
 
-DATA_FILE = "drone_data.csv"
+from map_lod import MapLayers
+
+from spatial_index import FleetSpatial
+
+
+
+# Historial de la flota (almacén + caché de DataFrames por dron): uno por proceso,
+
+# compartido por todas las sesiones
+
+@st.cache_resource
+
+def open_history(backend):
+
+    return config.open_history(backend)
+
+
+
+HISTORY = open_history(HISTORY_BACKEND)
 
 
 
@@ -58,25 +140,7 @@ SUCCESS_SOUND_B64 = "UklGRiQAAABXQVZFZm10IBAAAAABAAEARKwAAIhYAQACABAAZGF0YQAAAAA
 
 def get_pin_source():
 
-    try:
-
-        pin = st.secrets.get("APP_PIN", None)
-
-        if pin:
-
-            return str(pin).strip()
-
-    except Exception:
-
-        pass
-
-    pin_env = os.environ.get("APP_PIN", "").strip()
-
-    if pin_env:
-
-        return pin_env
-
-    return "1234"
+    return get_setting("APP_PIN", "1234")
 
 
 
@@ -126,317 +190,357 @@ def login_box():
 
 
 
-# =========================================================
+# Un hub por proceso: todas las sesiones comparten conexión y mensajes
 
-# MQTT CONFIG (HiveMQ Cloud, WebSockets TLS)
+@st.cache_resource
 
-# =========================================================
+def get_hub():
 
-BROKER_HOST    = "3f78afad5f2e407c85dd2eb93951af78.s1.eu.hivemq.cloud"
+    return make_hub()
 
-BROKER_PORT_WS = 8884
 
-BROKER_WS_PATH = "/mqtt"
 
-BROKER_USER    = "AdrianFB"
+HUB = get_hub()
 
-BROKER_PASS    = "Ab451278"
 
 
+# La descarga también es del proceso: sigue aunque la sesión que la pidió se cierre
 
-DEV_ID = "drone-001"
+@st.cache_resource
 
-T_CMD      = f"drone/{DEV_ID}/cmd"
+def get_downloads(backend):
 
-T_STATE    = f"drone/{DEV_ID}/state"
+    return make_downloads(HUB, HISTORY)
 
-T_INFO     = f"drone/{DEV_ID}/info"
 
-T_LOGPART  = f"drone/{DEV_ID}/log/part"
 
-T_EVENTS   = f"drone/{DEV_ID}/events"
+DOWNLOADS = get_downloads(HISTORY_BACKEND)
 
 
 
-# =========================================================
+# Posiciones en vivo: las llena el hilo del hub, con memoria fija por dron
 
-# Estado de sesión
+@st.cache_resource
 
-# =========================================================
+def get_live_tracks():
 
-st.set_page_config(page_title="Ubicacion y Control de Avispas", layout="wide")
+    return LiveTracks(HUB, capacity=LIVE_CAPACITY, accept_device=valid_device)
 
-st.title("🛰️ Ubicacion y Control de Avispas")
 
 
+LIVE = get_live_tracks()
 
-ss = st.session_state
 
-if "init" not in ss:
 
-    ss.init = True
+# Eventos por dron; con INGEST=daemon los guarda python -m ingest y aquí solo se leen
 
-    ss.mqtt_client = None
+@st.cache_resource
 
-    ss.mqtt_connected = False
+def get_events():
 
-    ss.diag = []
+    events = config.open_events()
 
-    ss.all_data_rows = []
+    if INGEST_MODE != "daemon":
 
+        events.attach(HUB, accept_device=valid_device)
 
+    return events
 
-    # Buffer de descarga
 
-    ss.log_chunks = []          # lista de strings data
 
-    ss.log_eof = False          # bandera EOF recibido
+EVENTS = get_events()
 
-    ss.log_collecting = False   # estamos en descarga bloqueante
 
-    ss.last_chunk_at = 0.0      # timestamp del último chunk recibido
 
+# Comandos enviados desde cualquier sesión, con su confirmación y latencia
 
+@st.cache_resource
 
-    ss.auth_ok = False
+def get_commands():
 
-    ss.insecure_tls = False
+    return CommandTracker(HUB)
 
-    ss.messages = []
 
-    ss.info_timestamps = []
 
-    ss.device_online = False
+COMMANDS = get_commands()
 
-    ss.play_sound = False
 
 
+# Latidos de T_INFO de todos los drones (ventana deslizante por dron)
 
-    # Carga de datos previos
+@st.cache_resource
 
-    try:
+def get_heartbeat():
 
-        if os.path.exists(DATA_FILE):
+    return HeartbeatMonitor(HUB, accept_device=valid_device)
 
-            df = pd.read_csv(DATA_FILE)
 
-            ss.all_data_rows = df.to_dict('records')
 
-            ss.diag.append(f"Cargados {len(ss.all_data_rows)} puntos desde {DATA_FILE}")
+HEARTBEAT = get_heartbeat()
 
-    except Exception as e:
 
-        st.error(f"No se pudo cargar el archivo ({DATA_FILE}): {e}")
 
+# Capas del mapa del historial ya armadas (puntos o celdas), compartidas por las sesiones
 
+@st.cache_resource
 
-# =========================================================
+def get_map_layers():
 
-# MQTT Callbacks
+    return MapLayers(max_points=MAP_MAX_POINTS)
 
-# =========================================================
 
-def on_connect(client, userdata, flags, rc, properties=None):
 
-    # paho v2 envía un enum con .value; soportamos ambos
+MAP_LAYERS = get_map_layers()
 
-    rc_value = rc.value if hasattr(rc, "value") else rc
 
-    ss.mqtt_connected = (rc_value == 0)
 
-    rc_map = {0: "OK", 1: "Proto incorrecto", 2: "ID inválido", 3: "Servidor no disponible",
+# Índice espacial de todo el historial de cada dron (se pone al día al consultar)
 
-              4: "Usuario/Pass incorrecto", 5: "No autorizado"}
+@st.cache_resource
 
-    ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} on_connect rc={rc_value} ({rc_map.get(rc_value,'?')})")
+def get_spatial():
 
-    if rc_value == 0:
+    return FleetSpatial(HISTORY)
 
-        client.subscribe([(T_STATE,1),(T_INFO,1),(T_LOGPART,1),(T_EVENTS,0)])
 
-        ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} Suscrito a tópicos.")
 
+SPATIAL = get_spatial()
 
 
-def on_disconnect(client, userdata, rc, properties=None):
 
-    rc_value = rc.value if hasattr(rc, "value") else rc
+# Índice de misiones por dron (persistente; con INGEST=daemon lo actualiza la ingesta)
 
-    ss.mqtt_connected = False
+@st.cache_resource
 
-    ss.device_online = False
+def get_missions():
 
-    ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} on_disconnect rc={rc_value}")
+    return config.open_missions(HISTORY, writable=INGEST_MODE != "daemon")
 
 
 
-def on_message(client, userdata, msg):
+MISSIONS = get_missions()
 
-    try:
 
-        topic = msg.topic
 
-        payload = msg.payload.decode("utf-8", errors="ignore")
+# Resúmenes por día / semana de cada dron (persistentes; con INGEST=daemon los actualiza la ingesta)
 
+@st.cache_resource
 
+def get_rollups():
 
-        if topic == T_INFO:
+    return config.open_rollups(HISTORY, writable=INGEST_MODE != "daemon")
 
-            now = time.time()
 
-            ss.info_timestamps.append(now)
 
-            ss.info_timestamps = ss.info_timestamps[-2:]
+ROLLUPS = get_rollups()
 
-            if len(ss.info_timestamps) == 2 and not ss.device_online:
 
-                if (ss.info_timestamps[1] - ss.info_timestamps[0]) < 11:
 
-                    ss.device_online = True
+def mission_label(m):
 
-                    ss.play_sound = True
+    start = pd.to_datetime(m["start_ts"], unit="s", utc=True).tz_convert(LOCAL_TZ)
 
-                    ss.messages.append({"type":"success","text":"✅ ¡Conexión con la ESP32 establecida!"})
+    end = pd.to_datetime(m["end_ts"], unit="s", utc=True).tz_convert(LOCAL_TZ)
 
-                    ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} ESP32 online detectada.")
+    end_fmt = "%H:%M" if end.date() == start.date() else "%m-%d %H:%M"
 
+    drops = (f" · drops {m['drop_first']:.0f}–{m['drop_last']:.0f}"
 
+             if m["drop_first"] is not None else "")
 
-        elif topic == T_LOGPART:
+    return f"{m['device']} · {start:%Y-%m-%d %H:%M}–{end.strftime(end_fmt)} · {m['points']} puntos{drops}"
 
-            data = json.loads(payload)
 
-            # registramos momento de recepción (para watchdogs si quieres)
 
-            ss.last_chunk_at = time.time()
+# Análisis de separación entre drops, por (día, drones, separación pedida, versión)
 
+@st.cache_resource
 
+def get_analytics():
 
-            if not data.get("eof", False):
+    return DropAnalytics()
 
-                # acumulamos solo la parte 'data'
 
-                # respetamos posibles \r\n y fragmentos
 
-                chunk_text = data.get("data", "")
+ANALYTICS = get_analytics()
 
-                if chunk_text:
 
-                    ss.log_chunks.append(chunk_text)
 
-            else:
+def data_version(devices):
+
+    """Historial y eventos de los drones: si cambia, se recalcula la página."""
+
+    return (HISTORY.version(devices), EVENTS.version(devices))
 
-                # EOF: marcamos fin
 
-                ss.log_eof = True
 
+# Un color por dron (el orden de la flota lo fija)
 
+DEVICE_PALETTE = [[255, 0, 0], [0, 114, 255], [0, 170, 80], [255, 150, 0], [160, 60, 220], [0, 190, 190]]
 
-    except Exception as e:
 
-        ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} Error en on_message: {e}")
+
+def device_colors():
+
+    return {d: DEVICE_PALETTE[i % len(DEVICE_PALETTE)] for i, d in enumerate(HISTORY.devices())}
 
 
 
 # =========================================================
 
-# Conexión y publicación
+# Estado de sesión
 
 # =========================================================
 
-def connect_mqtt():
+st.set_page_config(page_title="Ubicacion y Control de Avispas", layout="wide")
 
-    if ss.mqtt_client:
+st.title("🛰️ Ubicacion y Control de Avispas")
 
-        return
 
-    try:
 
-        ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} Creando cliente MQTT...")
+ss = st.session_state
+
+if "init" not in ss:
+
+    ss.init = True
 
-        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+    ss.diag = []
 
-                             client_id=f"st-web-{int(time.time())}",
 
-                             transport="websockets")
 
-        client.on_connect = on_connect
+    # Descargas: por dron, id de la última cuyo resultado ya mostró esta sesión
 
-        client.on_disconnect = on_disconnect
+    ss.download_reported = {dev: job.id for dev, job in DOWNLOADS.jobs().items()}
 
-        client.on_message = on_message
+    ss.cmd_pending = []         # ids de comandos de esta sesión sin resultado mostrado
 
-        client.username_pw_set(BROKER_USER, BROKER_PASS)
+    ss.cmd_device = DEV_ID      # dron al que van los comandos y la descarga
 
-        client.ws_set_options(path=BROKER_WS_PATH)
+    ss.sel_devices = [DEV_ID]   # drones en el mapa / métricas / tabla
 
 
 
-        # TLS configuración (por defecto: verificado). Si no tienes CA, puedes activar inseguro en el sidebar.
+    ss.auth_ok = False
 
-        client.tls_set(cert_reqs=ssl.CERT_REQUIRED)
+    ss.insecure_tls = False
 
-        client.tls_insecure_set(bool(ss.insecure_tls))
+    ss.messages = []
 
+    ss.device_online = {}       # dron -> ESP32 en línea (online o degraded)
 
+    ss.link_states = {}         # dron -> estado del latido en el último refresco
 
-        client.connect(BROKER_HOST, BROKER_PORT_WS, keepalive=60)
+    ss.play_sound = False
 
-        ss.mqtt_client = client
 
 
+    # Migración única al almacén vacío (con INGEST=daemon la hace python -m ingest)
 
-        # Espera activa hasta 2s por el CONNACK para establecer ss.mqtt_connected
+    if INGEST_MODE != "daemon":
 
-        t0 = time.time()
+        try:
 
-        while not ss.mqtt_connected and time.time() - t0 < 2.0:
+            ss.diag.extend(migrate_legacy(HISTORY))
 
-            ss.mqtt_client.loop(timeout=0.1)
+        except Exception as e:
 
+            st.error(f"No se pudo importar el historial heredado: {e}")
 
 
-    except Exception as e:
 
-        ss.diag.append(f"Error al conectar MQTT: {e}")
+# Versión del historial con la que se dibuja esta corrida completa de la página
 
-        ss.mqtt_client = None
+ss.data_version = data_version(ss.sel_devices)
 
 
 
-def disconnect_mqtt():
+# =========================================================
 
-    if ss.mqtt_client:
+# Estado del dispositivo (leído del hub en cada refresco)
 
-        try:
+# =========================================================
+
+def poll_device_info():
+
+    if not HUB.connected:
+
+        ss.device_online = {}
+
+        ss.link_states = {}
+
+        return
+
+    for dev in HEARTBEAT.devices():
+
+        HISTORY.add_device(dev)        # dron nuevo: aparece en los selectores
+
+    # El estado sale del reloj en cada refresco: un dron que deja de latir se marca solo
+
+    ss.link_states = HEARTBEAT.states(HISTORY.devices())
+
+    for dev, state in ss.link_states.items():
+
+        online = state in ("online", "degraded")
+
+        was_online = ss.device_online.get(dev, False)
+
+        if online and not was_online:
+
+            ss.play_sound = True
+
+            ss.messages.append({"type":"success","text":f"✅ ¡Conexión con la ESP32 de {dev} establecida!"})
+
+            ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} ESP32 online detectada ({dev}).")
+
+        elif was_online and state == "stale":
+
+            ss.messages.append({"type":"warning","text":f"Se perdió el latido de la ESP32 de {dev}."})
+
+            ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} ESP32 sin latido ({dev}).")
+
+        ss.device_online[dev] = online
+
+
+
+# =========================================================
+
+# Conexión y publicación
+
+# =========================================================
+
+def connect_mqtt():
+
+    HUB.start(insecure_tls=ss.insecure_tls)
 
-            ss.mqtt_client.disconnect()
+    # Espera hasta 2s por el CONNACK (el hilo de red sigue reintentando después)
 
-        except Exception:
+    HUB.wait_connected(2.0)
 
-            pass
 
-        ss.mqtt_client = None
 
-        ss.mqtt_connected = False
+def disconnect_mqtt():
+
+    HUB.stop()
 
-        ss.device_online = False
+    ss.device_online = {}
 
-        ss.diag.append("MQTT desconectado.")
 
 
+def mqtt_publish(device, payload_obj):
 
-def mqtt_publish(topic, payload_obj):
+    """Comando al dron con cmd_id; devuelve el id (None si no salió)."""
 
-    if ss.mqtt_client and ss.mqtt_connected:
+    if HUB.connected:
 
         try:
 
-            ss.mqtt_client.publish(topic, json.dumps(payload_obj), qos=1)
+            cmd_id = COMMANDS.send(device, cmd_topic(device), payload_obj, qos=1)
 
-            ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} CMD -> {payload_obj}")
+            ss.diag.append(f"{datetime.now().strftime('%H:%M:%S')} CMD -> {payload_obj} ({cmd_id})")
 
-            return True
+            ss.cmd_pending.append(cmd_id)
+
+            return cmd_id
 
         except Exception as e:
 
@@ -446,217 +550,307 @@ def mqtt_publish(topic, payload_obj):
 
         ss.messages.append({"type":"warning","text":"Cliente MQTT no conectado."})
 
-    return False
+    return None
 
 
 
 # =========================================================
 
-# Descarga bloqueante del log (sin rerun, timeout 16s)
+# Progreso de la descarga en segundo plano
 
 # =========================================================
 
-def fetch_log_blocking(timeout_s=16.0):
+def fmt_bytes(n):
 
-    """
+    for unit in ("B", "KB", "MB"):
 
-    - Limpia buffers
+        if n < 1024:
 
-    - Publica stream_log
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
 
-    - Bombea loop() hasta que llegue EOF o timeout
+        n /= 1024.0
 
-    - Reconstruye y guarda CSV
+    return f"{n:.1f} GB"
 
-    - Devuelve (ok, n_registros, msg_error)
 
-    """
 
-    if not ss.mqtt_client or not ss.mqtt_connected:
+def render_download_progress(p):
 
-        return (False, 0, "MQTT no conectado")
+    if p["paused"]:
 
+        st.warning(f"⏸️ MQTT desconectado: la descarga se reanudará desde el byte {p['bytes']} al reconectar")
 
+    else:
 
-    # Preparar estado
+        st.info(f"📥 Descargando el log... {p['elapsed_s']:.0f}s"
 
-    ss.log_chunks = []
+                + (f" (reanudada {p['resumes']}x)" if p["resumes"] else ""))
 
-    ss.log_eof = False
+    if p["total_bytes"]:
 
-    ss.last_chunk_at = time.time()
+        st.progress(min(1.0, p["bytes"] / p["total_bytes"]))
 
-    ss.log_collecting = True  # <- evita reruns en idle loop
+    c1, c2, c3, c4 = st.columns(4)
 
+    with c1: st.metric("Chunks", p["chunks"])
 
+    with c2: st.metric("Recibido", fmt_bytes(p["bytes"]))
 
-    # Solicitar log
+    with c3: st.metric("Velocidad", f"{fmt_bytes(p['rate_bps'])}/s")
 
-    ok_pub = mqtt_publish(T_CMD, {"action": "stream_log"})
+    with c4: st.metric("Tiempo restante", f"{p['eta_s']:.0f}s" if p["eta_s"] is not None else "—")
 
-    if not ok_pub:
+    if p["duplicates"] or p["buffered"] or p["resends"]:
 
-        ss.log_collecting = False
+        st.caption(f"Duplicados descartados: {p['duplicates']} · En espera (fuera de orden): {p['buffered']} · "
 
-        return (False, 0, "No se pudo publicar stream_log")
+                   f"Retransmisiones pedidas: {p['resends']}")
 
+    if p["idle_s"] >= 2 and not p["paused"]:
 
+        st.caption(f"⏳ Sin chunks hace {p['idle_s']:.0f}s")
 
-    t0 = time.time()
+    if p["encoding"] and p["encoding"] != "csv" and p["wire_bytes"]:
 
-    # Bucle de recepción: solo loop() y chequeos; SIN st.rerun aquí
+        st.caption(f"Codificación: {p['encoding']} · En la red: {fmt_bytes(p['wire_bytes'])} "
 
-    while True:
+                   f"({p['bytes'] / p['wire_bytes']:.1f}x)")
 
-        # Bombeo intensivo
 
-        ss.mqtt_client.loop(timeout=0.1)
 
+# =========================================================
 
+# Fragmentos en vivo (se refrescan solos, sin rerun de la página)
 
-        # Fin por EOF
+# =========================================================
 
-        if ss.log_eof:
+@st.fragment(run_every=1.0)
 
-            break
+def live_status():
 
+    # El hub recibe en su propio hilo; aquí solo leemos lo nuevo
 
+    poll_device_info()
 
-        # Timeout total
 
-        if time.time() - t0 > timeout_s:
 
-            break
+    st.subheader("Estado del Servidor")
 
+    st.success("🟢 Conectado" if HUB.connected else "🔴 Desconectado")
 
 
-    # Terminamos la fase bloqueante
 
-    ss.log_collecting = False
+    st.subheader("Estado del Dispositivo")
 
+    state = ss.link_states.get(ss.cmd_device, "unknown")
 
+    if state == "online":
 
-    # Si no llegó EOF, reportamos timeout
+        st.success(f"✅ ESP32 Conectada ({ss.cmd_device})")
 
-    if not ss.log_eof:
+    elif state == "degraded":
 
-        return (False, 0, f"Timeout: no llegó EOF en {timeout_s:.0f}s (chunks={len(ss.log_chunks)})")
+        h = HEARTBEAT.health(ss.cmd_device)
 
+        st.warning(f"🟡 Enlace degradado ({ss.cmd_device}): pérdida {h['loss']:.0%}, "
 
+                   f"jitter {h['jitter_ms']:.0f} ms, último latido hace {h['age_s']:.0f} s")
 
-    # Reconstruir CSV
+    elif state == "stale" and HUB.connected:
 
-    try:
+        st.error(f"🔴 Sin latido de la ESP32 ({ss.cmd_device}) hace "
 
-        raw_text = "".join(ss.log_chunks)
+                 f"{HEARTBEAT.health(ss.cmd_device)['age_s']:.0f} s")
 
-        raw_text = raw_text.replace("\r\n", "\n").replace("\r", "\n")
+    else:
 
-        lines = raw_text.split("\n")
+        st.warning(f"⚪ Esperando ESP32 ({ss.cmd_device})...")
 
-        # Mantener solo líneas con 7 comas (8 columnas)
+    fleet = HISTORY.devices()
 
-        clean_lines = [ln for ln in lines if ln.strip() and ln.count(",") == 7]
+    if len(fleet) > 1:
 
+        online = [d for d in fleet if ss.device_online.get(d, False)]
 
+        st.caption(f"Flota: {len(online)}/{len(fleet)} en línea" + (f" ({', '.join(online)})" if online else ""))
 
-        # Insertar encabezado si no está
 
-        if not clean_lines or not clean_lines[0].startswith("ts,"):
 
-            clean_lines.insert(0, "ts,lat,lon,alt,drop_id,speed_mps,sats,fix_ok")
+    # Salud del enlace: lo que dice la ventana de latidos de cada dron
 
+    with st.expander("📶 Salud del enlace"):
 
+        rows = []
 
-        csv_text = "\n".join(clean_lines)
+        for dev in fleet:
 
-        df_new = pd.read_csv(io.StringIO(csv_text), on_bad_lines='skip')
+            h = HEARTBEAT.health(dev)
 
+            rows.append({"dron": dev, "estado": h["state"], "latidos": h["beats"],
 
+                         "Hz": h["rate_hz"], "periodo s": h["period_s"], "jitter ms": h["jitter_ms"],
 
-        # Guardar y actualizar sesión
+                         "pérdida %": h["loss"] * 100 if h["loss"] is not None else None,
 
-        df_new.to_csv(DATA_FILE, index=False)
+                         "último hace s": h["age_s"]})
 
-        ss.all_data_rows = df_new.to_dict("records")
+        st.dataframe(pd.DataFrame(rows), hide_index=True, width="stretch",
 
-        return (True, len(df_new), "")
+                     column_config={c: st.column_config.NumberColumn(format="%.1f")
 
-    except Exception as e:
+                                    for c in ("Hz", "periodo s", "jitter ms", "pérdida %", "último hace s")})
 
-        return (False, 0, f"Error al procesar CSV: {e}")
 
 
+    # Campanita al conectar
 
-# =========================================================
+    if ss.play_sound:
 
-# Sidebar
+        sound_html = f'<audio autoplay><source src="data:audio/wav;base64,{SUCCESS_SOUND_B64}" type="audio/wav"></audio>'
 
-# =========================================================
+        st.components.v1.html(sound_html, height=0)
 
-login_box()
+        ss.play_sound = False
 
-with st.sidebar:
 
-    st.markdown("---")
 
-    st.subheader("Conexión")
+    # Si el historial cambió (p. ej. descarga desde otra sesión), se recalcula la página
 
-    if not ss.mqtt_client:
+    if data_version(ss.sel_devices) != ss.data_version:
 
-        if st.button("🔌 Conectar a MQTT", width="stretch"):
+        st.rerun()
 
-            connect_mqtt()
 
-            st.rerun()
 
-    else:
+@st.fragment(run_every=1.0)
 
-        if st.button("🔌 Desconectar", width="stretch", type="primary"):
+def live_messages():
 
-            disconnect_mqtt()
+    finished = False
 
-            st.rerun()
+    for dev, job in sorted(DOWNLOADS.jobs().items()):
 
+        p = job.progress()
 
+        if job.running:
 
-    st.subheader("Estado del Servidor")
+            st.caption(f"🛸 {dev}")
 
-    st.success("🟢 Conectado" if ss.mqtt_connected else "🔴 Desconectado")
+            render_download_progress(p)
 
+        elif ss.download_reported.get(dev) != job.id:
 
+            # Resultado de la descarga: se avisa una vez por sesión y se refresca la página
 
-    st.subheader("Estado del Dispositivo")
+            ss.download_reported[dev] = job.id
 
-    if ss.device_online:
+            finished = True
 
-        st.success("✅ ESP32 Conectada")
+            if p["status"] == "done":
 
-    else:
+                ss.messages.append({"type":"success","text":f"Log de {dev} procesado ({p['n_new']} registros nuevos)."})
 
-        st.warning("⚪ Esperando ESP32...")
+                dropped = sum(p["invalid"].values()) + p["malformed"]
 
+                if dropped:
 
+                    detail = ", ".join(f"{k}: {v}" for k, v in p["invalid"].items())
 
-    ss.insecure_tls = st.checkbox("Usar TLS inseguro (debug)", value=ss.insecure_tls,
+                    ss.messages.append({"type":"warning","text":f"{dev}: {dropped} filas descartadas "
 
-                                  help="Solo si tu sistema no tiene CA. No usar en producción.")
+                                        f"(mal formadas: {p['malformed']}{', ' + detail if detail else ''})."})
+
+                st.toast(f"✅ ¡Log de {dev} descargado y actualizado con {p['n_new']} registros nuevos!")
+
+            else:
+
+                ss.messages.append({"type":"error","text":f"No se pudo completar la descarga de {dev}: {p['error']}"})
+
+    if finished:
+
+        st.rerun()
+
+    # Confirmación (o no) de los comandos que mandó esta sesión
+
+    for cmd_id in list(ss.cmd_pending):
+
+        r = COMMANDS.result(cmd_id)
+
+        if r is None or not r["done"]:
+
+            continue
+
+        ss.cmd_pending.remove(cmd_id)
+
+        name = r["action"].upper()
+
+        if r["failed"]:
+
+            ss.messages.append({"type":"error","text":f"⚠️ {name} a {r['device']}: {r['failed']}."})
+
+        else:
+
+            ss.messages.append({"type":"success","text":f"{name} confirmado por {r['device']} en "
+
+                                f"{r['latency_s'] * 1000:.0f} ms ({r['attempts']} envío(s))."})
+
+    for msg in ss.messages:
+
+        getattr(st, msg["type"])(msg["text"])
+
+    ss.messages.clear()
 
 
 
 # =========================================================
 
-# Campanita al conectar
+# Sidebar
 
 # =========================================================
 
-if ss.play_sound:
+login_box()
+
+with st.sidebar:
+
+    st.markdown("---")
+
+    st.subheader("Conexión")
 
-    sound_html = f'<audio autoplay><source src="data:audio/wav;base64,{SUCCESS_SOUND_B64}" type="audio/wav"></audio>'
+    # La conexión es compartida por todas las sesiones del servidor
 
-    st.components.v1.html(sound_html, height=0)
+    if not HUB.running:
 
-    ss.play_sound = False
+        if st.button("🔌 Conectar a MQTT", width="stretch"):
+
+            connect_mqtt()
+
+            st.rerun()
+
+    else:
+
+        if st.button("🔌 Desconectar", width="stretch", type="primary",
+
+                     disabled=not is_editor(), help="Desconecta a todas las sesiones (requiere PIN)"):
+
+            disconnect_mqtt()
+
+            st.rerun()
+
+
+
+    st.selectbox("Dron activo", HISTORY.devices(), key="cmd_device",
+
+                 help="Recibe los comandos (inicio/paro) y la descarga del log")
+
+
+
+    live_status()
+
+
+
+    ss.insecure_tls = st.checkbox("Usar TLS inseguro (debug)", value=ss.insecure_tls,
+
+                                  help="Solo si tu sistema no tiene CA. No usar en producción.")
 
 
 
@@ -704,7 +898,7 @@ with left:
 
                            "step_hz": int(step_hz)}
 
-                mqtt_publish(T_CMD, payload)
+                mqtt_publish(ss.cmd_device, payload)
 
                 ss.messages.append({"type":"success","text":"Parámetros enviados y misión armada/iniciada."})
 
@@ -724,7 +918,7 @@ with left:
 
                    "step_hz": int(step_hz)}
 
-        mqtt_publish(T_CMD, payload)
+        mqtt_publish(ss.cmd_device, payload)
 
         ss.messages.append({"type":"info","text":"Comando Inicio enviado."})
 
@@ -738,254 +932,888 @@ with mid:
 
     if st.button("⏹️ Paro Inmediato", type="primary", width="stretch"):
 
-        mqtt_publish(T_CMD, {"action":"stop"})
+        if mqtt_publish(ss.cmd_device, {"action":"stop"}):
 
-        ss.messages.append({"type":"info","text":"Comando STOP enviado."})
+            ss.messages.append({"type":"info","text":"Comando STOP enviado; esperando confirmación del dron..."})
 
         st.rerun()
 
 
 
-with right:
+    # Latencia envío -> confirmación por tipo de comando (todas las sesiones)
 
-    st.subheader("Sincronizar Datos")
+    @st.fragment(run_every=2.0)
 
-    # Descarga bloqueante: NO provoca rerun hasta terminar o timeout
+    def command_latency():
 
-    if st.button("⬇️ Descargar Log Completo", width="stretch",
+        stats = COMMANDS.stats()
 
-                 disabled=ss.log_collecting):
+        if not stats:
 
-        ss.messages.append({"type":"info","text":"Solicitud de log enviada. Recibiendo datos..."})
+            return
 
-        ok, n, err = fetch_log_blocking(timeout_s=16.0)
+        fmt = lambda v: f"{v:.0f}" if v is not None else "—"
 
-        if ok:
+        st.dataframe(pd.DataFrame([
 
-            ss.messages.append({"type":"success","text":f"Log procesado ({n} registros)."})
+            {"comando": action, "enviados": s["sent"], "confirmados": s["acked"],
 
-            st.toast(f"✅ ¡Log descargado y actualizado con {n} registros!")
+             "reenvíos": s["retries"], "sin confirmar": s["failed"], "pendientes": s["pending"],
 
-        else:
+             "p50 ms": fmt(s["p50_ms"]), "p95 ms": fmt(s["p95_ms"]), "p99 ms": fmt(s["p99_ms"]),
 
-            ss.messages.append({"type":"error","text":f"No se pudo completar la descarga: {err}"})
+             "máx ms": fmt(s["max_ms"])}
 
-        # tras terminar (o fallar), hacemos un rerun para refrescar la UI
+            for action, s in sorted(stats.items())]), hide_index=True, width="stretch")
 
-        st.rerun()
+        # Ventana de latencias por tipo: deja ver picos que los percentiles esconden
 
+        recent = {action: pd.Series(COMMANDS.latencies(action) * 1000) for action in sorted(stats)}
 
+        recent = {action: lat for action, lat in recent.items() if len(lat)}
 
-# =========================================================
+        if recent:
 
-# Mensajes
+            st.caption("Últimas confirmaciones (ms), de la más vieja a la más reciente")
 
-# =========================================================
+            st.line_chart(pd.DataFrame(recent), height=160)
 
-with message_area.container():
 
-    if ss.log_collecting:
 
-        st.info("📥 Descargando y procesando el log, espere...")
+    with st.expander("⏱️ Latencia de comandos"):
 
-    for msg in ss.messages:
+        command_latency()
 
-        getattr(st, msg["type"])(msg["text"])
 
-    ss.messages.clear()
 
+# Con INGEST=daemon: lo que reporta python -m ingest, refrescado sin rerun de la página
 
+@st.fragment(run_every=2.0)
 
-# =========================================================
+def ingest_status():
 
-# Visualización (por defecto: día más reciente disponible)
+    status = load_status()
 
-# =========================================================
+    if status is None:
 
-st.markdown("---")
+        st.warning("La ingesta corre aparte (`python -m ingest`) y aún no reporta estado.")
 
-st.subheader("Historial de Ubicaciones")
+        return
 
+    age = time.time() - status["updated_at"]
 
+    if age > 30:
 
-df_all = pd.DataFrame(ss.all_data_rows) if ss.all_data_rows else pd.DataFrame(
+        st.warning(f"La ingesta no reporta desde hace {age:.0f}s (¿está corriendo `python -m ingest`?)")
 
-    columns=["ts","lat","lon","alt","drop_id","speed_mps","sats","fix_ok"]
+    else:
 
-)
+        st.caption(f"Ingesta: {'MQTT conectado' if status['connected'] else 'sin MQTT'}")
 
+    for dev, dev_status in sorted(status["devices"].items()):
 
+        last = dev_status["last_sync"]
 
-# Construimos 'dt' y detectamos el día por defecto de forma segura
+        text = f"🛸 {dev} · {'en línea' if dev_status['online'] else 'fuera de línea'}"
 
-if not df_all.empty:
+        if last:
 
-    # Convertir tipos por si hay strings raras
+            when = datetime.fromtimestamp(last["at"]).strftime("%H:%M:%S") if last["at"] else "?"
 
-    for col, typ in [("ts","float"), ("lat","float"), ("lon","float"),
+            if last["status"] == "done":
 
-                     ("alt","float"), ("drop_id","float"),
+                text += f" · última sincronización {when}: {last['n_new']} registros nuevos"
 
-                     ("speed_mps","float"), ("sats","float"), ("fix_ok","float")]:
+            else:
 
-        if col in df_all.columns:
+                text += f" · última sincronización {when} falló: {last['error']}"
 
-            df_all[col] = pd.to_numeric(df_all[col], errors="coerce")
+        st.caption(text)
 
+        if dev_status["running"]:
 
+            render_download_progress(dev_status["running"])
 
-    df_all["dt"] = pd.to_datetime(df_all["ts"], unit="s", errors="coerce", utc=True)
 
-    df_all["dt"] = df_all["dt"].dt.tz_convert("America/Mexico_City")
 
+with right:
 
+    st.subheader("Sincronizar Datos")
 
-    if df_all["dt"].notna().any():
+    last_ts, last_drop = HISTORY.frames(ss.cmd_device).watermark()
 
-        latest_day = df_all.loc[df_all["dt"].notna(), "dt"].dt.date.max()
+    downloads = DOWNLOADS.manager(ss.cmd_device)
 
-        default_day = latest_day if isinstance(latest_day, date) else date.today()
+    if INGEST_MODE == "daemon":
 
-    else:
+        # Solo lectura: el historial lo escribe el proceso de ingesta
 
-        default_day = date.today()
+        if last_ts is not None:
 
-else:
+            last_dt = pd.to_datetime(last_ts, unit="s", utc=True).tz_convert(LOCAL_TZ)
 
-    default_day = date.today()
+            st.caption(f"Último registro: {last_dt:%Y-%m-%d %H:%M:%S} (drop #{last_drop:.0f})")
 
+        ingest_status()
 
+    else:
 
-day = st.date_input("Selecciona día", value=default_day, key="sel_day")
+        delta_sync = st.checkbox("Solo datos nuevos (incremental)", value=last_ts is not None,
 
-st.caption("_Si no ves datos, asegúrate de elegir la fecha correcta según el log._")
+                                 disabled=last_ts is None,
 
-radius = st.slider("Radio de puntos (mapa)", 1, 50, 6, 1)
+                                 help="Pide al dron solo los registros posteriores al último guardado.")
 
+        if last_ts is not None:
 
+            last_dt = pd.to_datetime(last_ts, unit="s", utc=True).tz_convert(LOCAL_TZ)
 
-# Filtrado del día
+            drop_txt = f"{last_drop:.0f}" if isinstance(last_drop, (int, float)) else last_drop
 
-if not df_all.empty and "dt" in df_all.columns:
+            st.caption(f"Último registro: {last_dt:%Y-%m-%d %H:%M:%S} (drop #{drop_txt})")
 
-    day_start = pd.Timestamp.combine(day, datetime.min.time()).tz_localize("America/Mexico_City")
+        # La descarga corre en segundo plano: el resto de la página (y el paro) sigue respondiendo
 
-    day_end   = pd.Timestamp.combine(day, datetime.max.time()).tz_localize("America/Mexico_City")
+        if st.button(f"⬇️ Descargar Log Completo ({ss.cmd_device})", width="stretch",
 
-    df_day = df_all[(df_all["dt"] >= day_start) & (df_all["dt"] <= day_end)].copy()
+                     disabled=downloads.busy):
 
-else:
+            since_ts = last_ts if (delta_sync and last_ts is not None) else None
 
-    df_day = pd.DataFrame(columns=df_all.columns)
+            job, err = downloads.start(since_ts=since_ts, timeout_s=16.0)
 
+            if err:
 
+                ss.messages.append({"type":"error","text":f"No se pudo iniciar la descarga: {err}"})
 
-# Métricas
+            else:
 
-m1, m2, m3, m4 = st.columns(4)
+                ss.messages.append({"type":"info","text":"Solicitud de log enviada. Recibiendo datos..."})
 
-with m1: st.metric("Puntos (día)", len(df_day))
+        # Toda la flota en línea a la vez: una descarga incremental por dron, en paralelo
 
-with m2: st.metric("Total puntos", len(ss.all_data_rows))
+        online = [d for d in HISTORY.devices() if ss.device_online.get(d, False)]
 
-with m3: st.metric("GPS OK", int(df_day["fix_ok"].fillna(0).sum()) if not df_day.empty else 0)
+        if len(online) > 1 and st.button(f"⬇️ Descargar de los {len(online)} drones en línea", width="stretch"):
 
-with m4: st.metric("Velocidad Prom. (m/s)",
+            for dev in online:
 
-                   f"{df_day['speed_mps'].mean():.2f}" if not df_day.empty else "—")
+                since_ts = HISTORY.frames(dev).watermark()[0] if delta_sync else None
 
+                job, err = DOWNLOADS.manager(dev).start(since_ts=since_ts, timeout_s=16.0)
 
+                if err:
 
-# Mapa
+                    ss.messages.append({"type":"error","text":f"{dev}: no se pudo iniciar la descarga: {err}"})
 
-if not df_day.empty and PYDECK_AVAILABLE:
+        # Descarga interrumpida (timeout o reinicio del servidor): seguir desde el checkpoint
 
-    st.subheader("Mapa (día seleccionado)")
+        ckpt = downloads.resumable
 
-    df_map = df_day.dropna(subset=["lat","lon"])
+        if ckpt:
 
-    if not df_map.empty:
+            if st.button(f"⏯️ Reanudar descarga ({fmt_bytes(ckpt['offset'])} ya recibidos)", width="stretch"):
 
-        st.pydeck_chart(pdk.Deck(
+                job, err = downloads.start(timeout_s=16.0, resume=True)
 
-            initial_view_state=pdk.ViewState(
+                if err:
 
-                latitude=float(df_map["lat"].mean()),
+                    ss.messages.append({"type":"error","text":f"No se pudo reanudar la descarga: {err}"})
 
-                longitude=float(df_map["lon"].mean()),
+                else:
 
-                zoom=15
+                    ss.messages.append({"type":"info","text":f"Reanudando log desde el byte {ckpt['offset']}..."})
 
-            ),
 
-            layers=[
 
-                pdk.Layer(
+# =========================================================
 
-                    "ScatterplotLayer",
+# Mensajes
 
-                    data=df_map,
+# =========================================================
 
-                    get_position='[lon, lat]',
+with message_area.container():
+
+    live_messages()
+
+
+
+# =========================================================
+
+# Visualización (por defecto: día más reciente disponible)
+
+# =========================================================
+
+st.markdown("---")
+
+st.subheader("Historial de Ubicaciones")
+
+
+
+# Esta sección solo corre en reruns completos (cambio de día/radio/drones o de datos)
+
+# Solo se abren y leen los historiales de los drones elegidos
+
+st.multiselect("Drones", HISTORY.devices(), key="sel_devices",
+
+               help="Uno, varios o toda la flota")
+
+shown = ss.sel_devices
+
+
+
+# ---------- Recorrido en vivo ----------
+
+# Solo se copia del ring buffer lo que se dibuja; si nada cambió no se redibuja
+
+@st.fragment(run_every=LIVE_REFRESH_S)
+
+def live_track():
+
+    devices = ss.sel_devices
+
+    version = LIVE.version(devices)
+
+    if ss.get("live_drawn") == version and "live_deck" in ss:
+
+        deck = ss.live_deck
+
+    else:
+
+        track = LIVE.track(devices, LIVE_POINTS)
+
+        deck = None
+
+        if not track.empty and PYDECK_AVAILABLE:
+
+            colors = device_colors()
+
+            paths = [{"device": d, "color": colors.get(d, DEVICE_PALETTE[0]),
+
+                      "path": g[["lon", "lat"]].to_numpy().tolist()}
+
+                     for d, g in track.groupby("device", sort=False)]
+
+            now = track.groupby("device", sort=False).tail(1)
+
+            now = now.assign(color=now["device"].map(lambda d: colors.get(d, DEVICE_PALETTE[0])))
+
+            deck = pdk.Deck(
+
+                initial_view_state=pdk.ViewState(latitude=float(now["lat"].mean()),
+
+                                                 longitude=float(now["lon"].mean()), zoom=16),
+
+                layers=[
+
+                    pdk.Layer("PathLayer", data=paths, get_path="path", get_color="color",
+
+                              width_min_pixels=3, pickable=True),
+
+                    pdk.Layer("ScatterplotLayer", data=now, get_position='[lon, lat]',
+
+                              get_fill_color="color", get_radius=4, radius_min_pixels=6,
+
+                              pickable=True),
+
+                ],
+
+                tooltip={"text": "{device}"},
+
+            )
+
+        ss.live_drawn, ss.live_deck = version, deck
+
+
+
+    ages = []
+
+    for d in devices:
+
+        age = LIVE.age_s(d)
+
+        if age is not None:
+
+            ages.append(f"{d}: hace {age:.0f} s")
+
+    if not ages:
+
+        st.caption("Sin posiciones en vivo (T_STATE) de los drones elegidos.")
+
+        return
+
+    if deck is not None:
+
+        st.pydeck_chart(deck)
+
+    elif not PYDECK_AVAILABLE:
+
+        st.info("Pydeck no instalado → el mapa no se mostrará.")
+
+    st.caption("Última posición · " + " · ".join(ages) + f" · últimos {LIVE_POINTS} puntos")
+
+
+
+with st.expander("📍 Posición en vivo", expanded=True):
+
+    live_track()
+
+
+
+# Día por defecto: la partición más reciente (sin leer ningún dato)
+
+stored_days = HISTORY.days(shown)
+
+default_day = stored_days[-1] if stored_days else date.today()
+
+
+
+# Temporada: todo sale de los resúmenes por día / semana, sin leer filas
+
+with st.expander("📈 Temporada (resúmenes por día / semana)"):
+
+    season_from = max(stored_days[0], default_day - timedelta(days=89)) if stored_days else default_day
+
+    season = st.date_input("Rango de fechas", value=(season_from, default_day), key="season_range")
+
+    if isinstance(season, (tuple, list)) and len(season) == 2:
+
+        s_start, s_end = season
+
+        grain = st.radio("Agrupar por", ["Día", "Semana"], horizontal=True, key="season_grain")
+
+        season_total = ROLLUPS.total(shown, s_start, s_end)
+
+        if season_total is None:
+
+            st.caption("Sin datos en el rango elegido.")
+
+        else:
+
+            df_daily = ROLLUPS.daily(shown, s_start, s_end)
+
+            df_roll = df_daily if grain == "Día" else ROLLUPS.weekly(shown, s_start, s_end)
+
+            r1, r2, r3, r4, r5 = st.columns(5)
+
+            with r1: st.metric("Puntos", season_total["points"])
+
+            with r2: st.metric("GPS OK", f"{100 * season_total['gps_ok'] / season_total['points']:.0f} %")
+
+            with r3: st.metric("Velocidad media", f"{season_total['speed_mean']:.2f} m/s"
+
+                               if season_total["speed_mean"] is not None else "—")
+
+            with r4: st.metric("Velocidad p95", f"{season_total['speed_p95']:.2f} m/s"
+
+                               if season_total["speed_p95"] is not None else "—")
+
+            with r5: st.metric("Días con datos", len(df_daily))
+
+            trend = df_roll.set_index("period")
+
+            st.bar_chart(trend[["points", "gps_ok"]], height=220, stack=False)
+
+            st.line_chart(trend[["speed_mean", "speed_p50", "speed_p95"]], height=220)
+
+            df_show = df_roll.copy()
+
+            for c in ("first_ts", "last_ts"):
+
+                df_show[c] = pd.to_datetime(df_show[c], unit="s", utc=True).dt.tz_convert(LOCAL_TZ)
+
+            st.dataframe(df_show.drop(columns=["speed_n"]), hide_index=True, width="stretch", height=250)
+
+    else:
+
+        st.caption("Elige el inicio y el fin del rango.")
+
+
+
+# Día o misión: una misión sale del índice persistente y va directo a sus filas
+
+view_mode = st.radio("Ver", ["Día", "Misión"], horizontal=True, key="sel_view",
+
+                     help="Misiones detectadas por huecos de tiempo y reinicios del drop_id; pueden cruzar la medianoche.")
+
+mission = None
+
+if view_mode == "Misión":
+
+    mission_list = MISSIONS.missions(shown)
+
+    if mission_list:
+
+        by_id = {m["id"]: m for m in mission_list}
+
+        mission_id = st.selectbox("Misión", list(by_id), format_func=lambda i: mission_label(by_id[i]),
+
+                                  key="sel_mission")
+
+        mission = by_id[mission_id]
+
+    else:
+
+        st.info("No hay misiones en el historial de los drones elegidos.")
+
+day = None
+
+if mission is None:
+
+    day = st.date_input("Selecciona día", value=default_day, key="sel_day")
+
+    st.caption("_Si no ves datos, asegúrate de elegir la fecha correcta según el log._")
+
+radius = st.slider("Radio de puntos (mapa)", 1, 50, 6, 1)
+
+
+
+if mission is not None:
+
+    # Tramos contiguos de los días en caché (sin filtrar por ts) y métricas del índice
+
+    view_key, view_devices, view_title = ("mission", mission["id"]), [mission["device"]], "misión seleccionada"
+
+    view_version = MISSIONS.version(mission)
+
+    view_start, view_end = mission["start_ts"], mission["end_ts"] + 1
+
+    df_day = MISSIONS.frame(mission)
+
+    day_stats = MISSIONS.metrics(mission)
+
+else:
+
+    view_key, view_devices, view_title = day, shown, "día seleccionado"
+
+    view_version = HISTORY.day_version(day, shown)
+
+    day_start = pd.Timestamp(day).tz_localize(LOCAL_TZ)
+
+    view_start, view_end = day_start.timestamp(), (day_start + pd.Timedelta(days=1)).timestamp()
+
+    # Día elegido desde la caché compartida (tipado, con dt local y ordenado del más reciente);
+
+    # solo se relee del almacén si la partición creció
+
+    df_day = HISTORY.day_frame(day, shown, newest_first=True)
+
+    # Métricas (precalculadas junto con el DataFrame del día de cada dron)
+
+    day_stats = HISTORY.day_metrics(day, shown)
+
+
+
+m1, m2, m3, m4 = st.columns(4)
+
+with m1: st.metric("Puntos (misión)" if mission is not None else "Puntos (día)", day_stats["points"])
+
+with m2: st.metric("Total puntos", HISTORY.count(shown))
+
+with m3: st.metric("GPS OK", day_stats["gps_ok"])
+
+with m4: st.metric("Velocidad Prom. (m/s)",
+
+                   f"{day_stats['speed_mean']:.2f}" if day_stats["speed_mean"] is not None else "—")
+
+
+
+# Calidad de la misión: ¿cayeron las pelotas a la distancia pedida?
+
+def fmt_num(value, digits=1, suffix=""):
+
+    return f"{value:.{digits}f}{suffix}" if value is not None else "—"
+
+
+
+with st.expander(f"📏 Calidad de la misión ({view_title})"):
+
+    target_m = st.number_input("Separación pedida (m)", 0.1, 1000.0, float(distance), 0.1, key="qa_target",
+
+                               help="Por defecto, la distancia entre pelotas del formulario de inicio.")
+
+    qa = ANALYTICS.get((view_key, tuple(view_devices)), target_m, view_version, df_day)
+
+    if qa is None:
+
+        st.caption(f"Sin drops en {'esta misión' if mission is not None else 'este día'}.")
+
+    else:
 
-                    get_radius=radius,
+        quality, spacing = qa["quality"], qa["spacing"]
 
-                    pickable=True,
+        a1, a2, a3, a4, a5 = st.columns(5)
 
-                    get_fill_color='[255, 0, 0]',
+        with a1: st.metric("Separación media", fmt_num(spacing["mean"], 1, " m"),
 
-                )
+                           help=f"p10 {fmt_num(spacing['p10'])} · p50 {fmt_num(spacing['p50'])} · p90 {fmt_num(spacing['p90'])} m")
 
-            ],
+        with a2: st.metric("Desvío medio", fmt_num(quality["abs_deviation_mean"], 1, " m"),
 
-            tooltip={"text": "Drop #{drop_id}\n{dt}\nlat={lat}\nlon={lon}\nalt={alt} m\nspeed={speed_mps} m/s\nsats={sats}\nfix_ok={fix_ok}"}
+                           help=f"RMSE {fmt_num(quality['rmse'])} m")
+
+        with a3: st.metric("Dentro de ±10 %", fmt_num(quality["within_10pct"] and quality["within_10pct"] * 100, 0, " %"),
+
+                           help=f"±20 %: {fmt_num(quality['within_20pct'] and quality['within_20pct'] * 100, 0, ' %')}")
+
+        with a4: st.metric("Huecos", len(quality["gaps"]))
+
+        with a5: st.metric("Racimos", quality["clusters"], help=f"{quality['cluster_drops']} drops en racimos")
+
+        speed, alt = qa["speed"], qa["alt"]
+
+        st.caption(f"{qa['drops']} drops en {qa['missions']} misiones · velocidad p50 {fmt_num(speed['p50'], 2)} / "
+
+                   f"p95 {fmt_num(speed['p95'], 2)} / máx {fmt_num(speed['max'], 2)} m/s · altitud p5 "
+
+                   f"{fmt_num(alt['p5'])} / p50 {fmt_num(alt['p50'])} / p95 {fmt_num(alt['p95'])} m · GPS OK "
+
+                   f"{fmt_num(qa['gps_ok_rate'] and qa['gps_ok_rate'] * 100, 0, ' %')}")
+
+        pairs = qa["pairs"]
+
+        if not pairs.empty:
+
+            counts, edges = np.histogram(pairs["spacing_m"].dropna(), bins=30)
+
+            st.bar_chart(pd.DataFrame({"pares": counts}, index=np.round((edges[:-1] + edges[1:]) / 2, 1)),
+
+                         x_label="separación (m)", height=200)
+
+        g1, g2 = st.columns([1.4, 1])
+
+        with g1: st.dataframe(qa["by_sats"], hide_index=True, width="stretch")
+
+        with g2: st.dataframe(qa["by_fix"], width="stretch")
+
+        if not quality["gaps"].empty:
+
+            st.caption(f"Huecos (más de {GAP_S:.0f} s, drops saltados o separación > {GAP_FACTOR}× la pedida)")
+
+            st.dataframe(quality["gaps"], hide_index=True, width="stretch", height=200)
+
+        df_missions = qa["missions_table"]
+
+        if len(df_missions) > 1:
+
+            # Varias misiones en la vista: cuál cumplió la separación y cuál no
+
+            df_missions = df_missions.assign(**{
+
+                c: pd.to_datetime(df_missions[c], unit="s", utc=True).dt.tz_convert(LOCAL_TZ)
+
+                for c in ("start_ts", "end_ts")})
+
+            st.caption("Por misión")
+
+            st.dataframe(df_missions.drop(columns=["segment"]), hide_index=True, width="stretch", height=200)
+
+
+
+# Eventos del día o la misión: consulta por rango de ts sobre el índice (sin recorrer el historial)
+
+df_events = EVENTS.between(view_devices, view_start, view_end)
+
+if not df_events.empty:
+
+    df_events["dt"] = pd.to_datetime(df_events["ts"], unit="s", utc=True).dt.tz_convert(LOCAL_TZ)
+
+    # Sin posición propia: la del punto de telemetría más cercano del mismo dron
+
+    missing = df_events["lat"].isna() | df_events["lon"].isna()
+
+    if missing.any() and not df_day.empty:
+
+        nearest = pd.merge_asof(
+
+            df_events.loc[missing, ["ts", "device"]].reset_index(),
+
+            df_day.dropna(subset=["lat", "lon"]).sort_values("ts")[["ts", "device", "lat", "lon"]],
+
+            on="ts", by="device", direction="nearest").set_index("index")
+
+        df_events.loc[missing, ["lat", "lon"]] = nearest[["lat", "lon"]]
+
+
+
+# Mapa
+
+if not df_day.empty and PYDECK_AVAILABLE:
+
+    st.subheader(f"Mapa ({view_title})")
+
+    # Puntos o celdas agregadas según el tamaño del día; armada una vez por versión
+
+    lod = MAP_LAYERS.get(view_key, view_devices, radius, view_version, df_day,
+
+                         colors=device_colors() if len(view_devices) > 1 else None)
+
+    if lod is not None:
+
+        layers = [pdk.Layer(**lod["layer"])]
+
+        ev_map = df_events.dropna(subset=["lat", "lon"])[["lon", "lat", "type"]] if not df_events.empty else None
+
+        if ev_map is not None and not ev_map.empty:
+
+            # Eventos: anillos negros encima de la traza
+
+            layers.append(pdk.Layer(
+
+                "ScatterplotLayer",
+
+                data=ev_map,
+
+                get_position='[lon, lat]',
+
+                get_radius=radius * 2,
+
+                radius_min_pixels=7,
+
+                stroked=True,
+
+                filled=False,
+
+                get_line_color=[20, 20, 20],
+
+                line_width_min_pixels=2,
+
+            ))
+
+        st.pydeck_chart(pdk.Deck(
+
+            initial_view_state=pdk.ViewState(
+
+                latitude=lod["center"][0],
+
+                longitude=lod["center"][1],
+
+                zoom=15
+
+            ),
+
+            layers=layers,
+
+            tooltip={"text": lod["tooltip"]}
 
         ))
 
+        if lod["mode"] == "cells":
+
+            st.caption(f"{lod['points']} puntos agrupados en {lod['shown']} celdas de {lod['cell_m']} m "
+
+                       f"(más de {MAP_LAYERS.max_points} puntos); el color marca la densidad.")
+
 elif not PYDECK_AVAILABLE:
 
     st.info("Pydeck no instalado → el mapa no se mostrará.")
 
 
 
+# Consultas espaciales: todo el historial de los drones elegidos, no solo el día
+
+with st.expander("🔎 Consultas espaciales (todo el historial)"):
+
+    q_kind = st.radio("Consulta", ["Radio", "Más cercanos", "Rectángulo", "Polígono"],
+
+                      horizontal=True, key="sp_kind")
+
+    located = df_day.dropna(subset=["lat", "lon"]) if not df_day.empty else df_day
+
+    c_lat = float(located["lat"].median()) if not located.empty else 0.0
+
+    c_lon = float(located["lon"].median()) if not located.empty else 0.0
+
+    query, err = None, None
+
+    if q_kind in ("Radio", "Más cercanos"):
+
+        q1, q2, q3 = st.columns(3)
+
+        with q1: q_lat = st.number_input("Latitud", value=c_lat, format="%.6f", key="sp_lat")
+
+        with q2: q_lon = st.number_input("Longitud", value=c_lon, format="%.6f", key="sp_lon")
+
+        if q_kind == "Radio":
+
+            with q3: q_r = st.number_input("Radio (m)", min_value=1.0, value=20.0, step=5.0, key="sp_r")
+
+            query = lambda: SPATIAL.radius(shown, q_lat, q_lon, q_r)
+
+        else:
+
+            with q3: q_k = st.number_input("Cantidad", min_value=1, value=5, step=1, key="sp_k")
+
+            query = lambda: SPATIAL.nearest(shown, q_lat, q_lon, int(q_k))
+
+    elif q_kind == "Rectángulo":
+
+        q1, q2, q3, q4 = st.columns(4)
+
+        with q1: la0 = st.number_input("Lat. mín", value=c_lat - 0.001, format="%.6f", key="sp_la0")
+
+        with q2: la1 = st.number_input("Lat. máx", value=c_lat + 0.001, format="%.6f", key="sp_la1")
+
+        with q3: lo0 = st.number_input("Lon. mín", value=c_lon - 0.001, format="%.6f", key="sp_lo0")
+
+        with q4: lo1 = st.number_input("Lon. máx", value=c_lon + 0.001, format="%.6f", key="sp_lo1")
+
+        query = lambda: SPATIAL.bbox(shown, min(la0, la1), max(la0, la1), min(lo0, lo1), max(lo0, lo1))
+
+    else:
+
+        text = st.text_area("Vértices del polígono (una línea por vértice: lat, lon)", key="sp_poly",
+
+                            placeholder=f"{c_lat:.6f}, {c_lon:.6f}\n...")
+
+        try:
+
+            vertices = [tuple(float(v) for v in line.replace(";", ",").split(",")[:2])
+
+                        for line in text.splitlines() if line.strip()]
+
+        except ValueError:
+
+            vertices, err = [], "Cada línea debe ser 'lat, lon'."
+
+        if not err and len(vertices) >= 3:
+
+            query = lambda: SPATIAL.polygon(shown, vertices)
+
+        elif not err and text.strip():
+
+            err = "El polígono necesita al menos 3 vértices."
+
+    if err:
+
+        st.warning(err)
+
+    elif query is not None and shown:
+
+        t0 = time.perf_counter()
+
+        df_hits = query()
+
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+
+        st.caption(f"{len(df_hits)} drops · {elapsed_ms:.1f} ms · {SPATIAL.count(shown)} puntos indexados")
+
+        if not df_hits.empty:
+
+            df_hits["dt"] = pd.to_datetime(df_hits["ts"], unit="s", utc=True).dt.tz_convert(LOCAL_TZ)
+
+            st.dataframe(df_hits.head(500), width="stretch", height=250, hide_index=True,
+
+                         column_order=(["device"] if len(shown) > 1 else []) + ["dt", "drop_id", "lat", "lon"]
+
+                         + (["dist_m"] if "dist_m" in df_hits.columns else []))
+
+
+
+# Eventos (línea de tiempo + tabla)
+
+st.subheader(f"Eventos ({view_title})")
+
+if not df_events.empty:
+
+    st.scatter_chart(df_events, x="dt", y="type", color="device" if len(view_devices) > 1 else None, height=220)
+
+    near = st.number_input("Eventos cerca del drop # (0 = todos)", min_value=0, value=0, step=1)
+
+    df_ev_table = df_events
+
+    if near:
+
+        # ±30 s alrededor del evento del drop o, si no llegó, de su fila de telemetría
+
+        hits = df_day[df_day["drop_id"] == near] if not df_day.empty else df_day
+
+        drop_ts = hits.groupby("device")["ts"].min() if not hits.empty else {}
+
+        frames = [EVENTS.near_drop(d, near, ts=drop_ts.get(d)) for d in view_devices]
+
+        df_ev_table = pd.concat(frames, ignore_index=True).sort_values("ts", ignore_index=True)
+
+        df_ev_table["dt"] = pd.to_datetime(df_ev_table["ts"], unit="s", utc=True).dt.tz_convert(LOCAL_TZ)
+
+    st.dataframe(df_ev_table, width="stretch", height=220, hide_index=True,
+
+                 column_order=(["device"] if len(view_devices) > 1 else []) + ["dt", "type", "drop_id", "lat", "lon", "data"])
+
+else:
+
+    st.caption(f"Sin eventos (T_EVENTS) en {'esta misión' if mission is not None else 'este día'}.")
+
+
+
 # Tabla
 
 st.subheader("Tabla de Datos")
 
 if not df_day.empty:
 
-    st.dataframe(df_day.sort_values("ts", ascending=False), width="stretch", height=350)
+    # Índices ordenados/filtrados compartidos por todas las sesiones; solo se envía la página
 
-else:
+    table = MISSIONS.table(mission) if mission is not None else HISTORY.table(day, shown)
 
-    if not df_all.empty and day != default_day:
+    t1, t2, t3, t4 = st.columns([1.2, 1, 1, 1])
 
-        st.info("No hay datos para la fecha seleccionada. Prueba con el día más reciente.")
+    sort_options = (["device"] if len(view_devices) > 1 else []) + DATA_COLUMNS
 
-    else:
+    with t1: sort_by = st.selectbox("Ordenar por", sort_options, index=sort_options.index("ts"), key="tbl_sort")
 
-        st.info("No hay datos para mostrar.")
+    with t2: descending = st.toggle("Descendente", value=True, key="tbl_desc")
 
+    with t3: fix_only = st.toggle("Solo GPS OK", value=False, key="tbl_fix")
 
+    with t4: page_size = st.selectbox("Filas por página", [50, 100, 250, 500], index=1, key="tbl_size")
 
-# =========================================================
+    d_lo, d_hi = float(df_day["drop_id"].min()), float(df_day["drop_id"].max())
 
-# Idle loop (mantener conexión viva) — solo cuando NO hay descarga
+    drop_range = None
 
-# =========================================================
+    if pd.notna(d_lo) and d_hi > d_lo:
+
+        drop_range = st.slider("Rango de drop #", int(d_lo), int(d_hi), (int(d_lo), int(d_hi)), key="tbl_drops")
+
+    filters = {}
+
+    if fix_only:
+
+        filters["fix_ok"] = (1, None)
+
+    if drop_range is not None and drop_range != (int(d_lo), int(d_hi)):
+
+        filters["drop_id"] = drop_range
+
+    total = len(table.view(sort_by, descending, filters))
 
-if not ss.log_collecting:
+    n_pages = max(1, -(-total // page_size))
 
-    if ss.mqtt_client:
+    if ss.get("tbl_page", 1) > n_pages:
 
-        t0 = time.time()
+        ss.tbl_page = 1
 
-        # pequeño “latido” de ~0.8s que llama a loop repetidamente
+    page = st.number_input(f"Página (de {n_pages})", 1, n_pages, 1, key="tbl_page") - 1
 
-        while time.time() - t0 < 0.8:
+    df_page, total = table.page(page, page_size, sort_by, descending, filters)
 
-            ss.mqtt_client.loop(timeout=0.1)
+    st.dataframe(df_page, width="stretch", height=350, hide_index=True,
 
-    time.sleep(0.2)
+                 column_order=(["device"] if len(view_devices) > 1 else []) + DATA_COLUMNS + ["dt"])
 
-    st.rerun()
+    first = page * page_size
+
+    st.caption(f"Filas {first + 1 if total else 0}–{min(first + page_size, total)} de {total}"
+
+               + (f" (filtradas de {len(table.df)})" if filters else ""))
+
+else:
+
+    if stored_days and day is not None and day != default_day:
+
+        st.info("No hay datos para la fecha seleccionada. Prueba con el día más reciente.")
+
+    else:
+
+        st.info("No hay datos para mostrar.")
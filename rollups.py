@@ -0,0 +1,250 @@
+# =========================================================
+# Resúmenes materializados por día y por semana (rollups)
+# - Por dron y día local: puntos, GPS OK, suma de velocidades, histograma de
+#   velocidad (para percentiles), bbox y primer / último ts
+# - Todo se puede sumar: al crecer un día solo se lee su cola nueva
+#   (load_day_since) y se combina con lo guardado; la semana se rehace
+#   con sus días
+# - Persistente por dron (<dron>.rollups.json); un rango de fechas se
+#   responde con los resúmenes, sin tocar las filas
+# =========================================================
+
+import json
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+SPEED_BIN = 0.25            # m/s por barra del histograma
+SPEED_BINS = 200            # 0–50 m/s; lo que pasa de ahí cae en la última barra
+_FORMAT = 1
+_SUMS = ("points", "gps_ok", "speed_n", "speed_sum")
+_MINS = ("lat_min", "lon_min", "first_ts")
+_MAXS = ("lat_max", "lon_max", "last_ts")
+
+
+def _nan_or(fn, values):
+    return float(fn(values)) if len(values) and not np.isnan(values).all() else None
+
+
+def partial(df):
+    """Resumen sumable de unas filas (un día entero o solo su cola nueva)."""
+    ts = df["ts"].to_numpy(np.float64)
+    lat, lon = df["lat"].to_numpy(np.float64), df["lon"].to_numpy(np.float64)
+    speed = df["speed_mps"].to_numpy(np.float64)
+    speed = speed[~np.isnan(speed)]
+    bins = np.clip((np.maximum(speed, 0) / SPEED_BIN).astype(np.int64), 0, SPEED_BINS - 1)
+    return {"points": int(len(ts)), "gps_ok": int(np.nansum(df["fix_ok"].to_numpy(np.float64))),
+            "speed_n": int(len(speed)), "speed_sum": float(speed.sum()),
+            "speed_hist": np.bincount(bins, minlength=SPEED_BINS),
+            "lat_min": _nan_or(np.nanmin, lat), "lat_max": _nan_or(np.nanmax, lat),
+            "lon_min": _nan_or(np.nanmin, lon), "lon_max": _nan_or(np.nanmax, lon),
+            "first_ts": _nan_or(np.nanmin, ts), "last_ts": _nan_or(np.nanmax, ts)}
+
+
+def merge(parts):
+    """Combina resúmenes parciales (días, drones o colas de un mismo día)."""
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    out = {k: sum(p[k] for p in parts) for k in _SUMS}
+    out["speed_hist"] = np.sum([p["speed_hist"] for p in parts], axis=0)
+    for keys, fn in ((_MINS, min), (_MAXS, max)):
+        for k in keys:
+            values = [p[k] for p in parts if p[k] is not None]
+            out[k] = fn(values) if values else None
+    return out
+
+
+def hist_percentile(hist, q):
+    """Percentil q (0–100) del histograma de velocidad, interpolado dentro de la barra."""
+    total = hist.sum()
+    if not total:
+        return None
+    cum = np.cumsum(hist)
+    target = q / 100 * total
+    i = int(np.searchsorted(cum, target, side="left"))
+    before = cum[i - 1] if i else 0
+    frac = (target - before) / hist[i] if hist[i] else 0.0
+    return (i + frac) * SPEED_BIN
+
+
+def summary(p):
+    """Métricas para mostrar de un resumen (o None)."""
+    if p is None:
+        return None
+    out = {k: p[k] for k in _SUMS + _MINS + _MAXS if k != "speed_sum"}
+    out["speed_mean"] = p["speed_sum"] / p["speed_n"] if p["speed_n"] else None
+    out["speed_p50"] = hist_percentile(p["speed_hist"], 50)
+    out["speed_p95"] = hist_percentile(p["speed_hist"], 95)
+    return out
+
+
+def week_of(day):
+    """Lunes de la semana ISO del día."""
+    return day - timedelta(days=day.weekday())
+
+
+def _dump(p):
+    hist = p["speed_hist"]
+    nz = np.flatnonzero(hist)
+    return dict(p, speed_hist=hist[:nz[-1] + 1].tolist() if len(nz) else [])
+
+
+def _load(p):
+    hist = np.zeros(SPEED_BINS, dtype=np.int64)
+    hist[:len(p["speed_hist"])] = p["speed_hist"]
+    return dict(p, speed_hist=hist)
+
+
+class Rollups:
+    """
+    Resúmenes por día y semana de un almacén, guardados en `path`.
+    Un día cuyo day_version creció se pone al día con su cola; uno que
+    cambió de otra forma (p. ej. se reescribió) se recalcula entero.
+    Con writable=False (dashboard con INGEST=daemon) los escribe otro
+    proceso: aquí solo se vuelve a leer el archivo cuando cambia.
+    """
+
+    def __init__(self, store, path, writable=True):
+        self.store = store
+        self.path = path
+        self.writable = writable
+        self._lock = threading.Lock()
+        self._store_version = None
+        self._mtime = None          # mtime del archivo leído (modo solo lectura)
+        self._days = {}             # date -> {"version", resumen}
+        self._weeks = {}            # lunes -> resumen
+        self._read()
+
+    def _read(self):
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("format") != _FORMAT:
+            return
+        self._days = {date.fromisoformat(d): dict(_load(p), version=p["version"])
+                      for d, p in data.get("days", {}).items()}
+        self._weeks = {date.fromisoformat(w): _load(p) for w, p in data.get("weeks", {}).items()}
+
+    def _save(self):
+        # Temporal propio: el dashboard y la ingesta pueden guardar a la vez
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".",
+                                   prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"format": _FORMAT,
+                           "days": {d.isoformat(): _dump(p) for d, p in self._days.items()},
+                           "weeks": {w.isoformat(): _dump(p) for w, p in self._weeks.items()}}, f)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def _reload(self):
+        """Solo lectura: relee el archivo si otro proceso lo reescribió."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return []
+        with self._lock:
+            if mtime == self._mtime:
+                return []
+            old = {d: p["version"] for d, p in self._days.items()}
+            self._read()
+            new = {d: p["version"] for d, p in self._days.items()}
+            return sorted(d for d in set(old) | set(new) if old.get(d) != new.get(d))
+
+    def refresh(self):
+        """Incorpora lo que el almacén agregó; devuelve los días que cambiaron."""
+        if not self.writable:
+            return self._reload()
+        version = self.store.version()
+        with self._lock:
+            if version == self._store_version:
+                return []
+            current = {d: self.store.day_version(d) for d in self.store.days()}
+            changed = []
+            for day, day_version in current.items():
+                old = self._days.get(day)
+                if old is not None and old["version"] == day_version:
+                    continue
+                if old is not None and old["version"] < day_version:
+                    # Hasta day_version: lo que llegue mientras tanto va en el próximo refresh
+                    p = merge([old, partial(self.store.load_day_since(day, old["version"], day_version))])
+                else:
+                    p = partial(self.store.load_day_since(day, 0, day_version))
+                self._days[day] = dict(p, version=day_version)
+                changed.append(day)
+            for day in set(self._days) - set(current):
+                del self._days[day]
+                changed.append(day)
+            for week in {week_of(d) for d in changed}:
+                days = [self._days.get(week + timedelta(days=i)) for i in range(7)]
+                self._weeks[week] = merge(days)
+                if self._weeks[week] is None:
+                    del self._weeks[week]
+            if changed:
+                self._save()
+            self._store_version = version
+            return sorted(changed)
+
+    def days(self, start, end):
+        """{día: resumen} de los días con datos en [start, end]."""
+        self.refresh()
+        with self._lock:
+            return {d: p for d, p in self._days.items() if start <= d <= end}
+
+    def weeks(self, start, end):
+        """{lunes: resumen} de las semanas que tocan [start, end] (semanas completas)."""
+        self.refresh()
+        with self._lock:
+            return {w: p for w, p in self._weeks.items() if week_of(start) <= w <= end}
+
+
+class FleetRollups:
+    """Un Rollups por dron sobre FleetHistory; las consultas combinan los drones elegidos."""
+
+    def __init__(self, history, path_for, writable=True):
+        self.history = history
+        self.path_for = path_for            # device -> ruta del archivo de resúmenes
+        self.writable = writable            # False: los escribe python -m ingest
+        self._lock = threading.Lock()
+        self._rollups = {}
+
+    def rollups(self, device):
+        with self._lock:
+            r = self._rollups.get(device)
+            if r is None:
+                r = self._rollups[device] = Rollups(self.history.store(device), self.path_for(device),
+                                                      self.writable)
+            return r
+
+    def refresh(self, devices):
+        return {d: self.rollups(d).refresh() for d in devices}
+
+    def _table(self, per_device):
+        keys = sorted(set().union(*per_device)) if per_device else []
+        rows = [dict(summary(merge(p.get(k) for p in per_device)), period=k) for k in keys]
+        cols = ["period", "points", "gps_ok", "speed_mean", "speed_p50", "speed_p95",
+                "lat_min", "lat_max", "lon_min", "lon_max", "first_ts", "last_ts", "speed_n"]
+        return pd.DataFrame(rows, columns=cols)
+
+    def daily(self, devices, start, end):
+        """Una fila por día con datos en [start, end], sumando los drones elegidos."""
+        return self._table([self.rollups(d).days(start, end) for d in devices])
+
+    def weekly(self, devices, start, end):
+        """Una fila por semana (lunes) que toca [start, end]."""
+        return self._table([self.rollups(d).weeks(start, end) for d in devices])
+
+    def total(self, devices, start, end):
+        """Resumen de todo el rango (o None si no hay datos)."""
+        return summary(merge(p for d in devices for p in self.rollups(d).days(start, end).values()))
@@ -0,0 +1,231 @@
+# =========================================================
+# Índice espacial de los drops (todo el historial de cada dron)
+# - Malla fija en metros: cada punto cae en una celda y las filas quedan
+#   ordenadas por id de celda (fila de la malla, luego columna)
+# - Se mantiene incremental: solo se leen las filas nuevas de cada día
+# - Consultas por radio, rectángulo, polígono y k más cercanos: búsqueda
+#   binaria de las celdas candidatas y filtro exacto vectorizado
+# =========================================================
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from map_lod import M_PER_DEG_LAT, M_PER_DEG_LON
+
+EARTH_RADIUS_M = 6_371_008.8
+CELL_M = 25.0               # lado de la celda de la malla
+MAX_CELL_ROWS = 4096        # más filas de malla que esto: se revisan todos los puntos
+_OFFSET = 1 << 20           # |ix|, |iy| < 2**20 en toda la Tierra con celdas de 25 m
+INDEX_COLUMNS = ("ts", "lat", "lon", "drop_id")
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distancia en metros entre puntos (arrays o escalares en grados)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def points_in_polygon(x, y, px, py):
+    """Ray casting: recorre los vértices (pocos) y compara todos los puntos a la vez."""
+    inside = np.zeros(len(x), dtype=bool)
+    j = len(px) - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i in range(len(px)):
+            crosses = (py[i] > y) != (py[j] > y)
+            x_cross = (px[j] - px[i]) * (y - py[i]) / (py[j] - py[i]) + px[i]
+            inside ^= crosses & (x < x_cross)
+            j = i
+    return inside
+
+
+class SpatialIndex:
+    """
+    Índice de un almacén (DayPartitionStore o SqliteStore). La latitud de
+    referencia de la proyección se fija con el primer lote, así que las
+    celdas de lo ya indexado no cambian al crecer el historial.
+    """
+
+    def __init__(self, store, cell_m=CELL_M):
+        self.store = store
+        self.cell_m = cell_m
+        self._lock = threading.Lock()
+        self._store_version = None
+        self._day_versions = {}     # día -> day_version ya indexada
+        self._kx = None             # metros por grado de lon en la latitud de referencia
+        self._keys = np.empty(0, dtype=np.int64)
+        self._cols = {c: np.empty(0) for c in INDEX_COLUMNS + ("x", "y")}
+
+    # ---------- Mantenimiento ----------
+    def _project(self, lat, lon):
+        return np.asarray(lon, dtype=np.float64) * self._kx, np.asarray(lat, dtype=np.float64) * M_PER_DEG_LAT
+
+    def _cell_key(self, ix, iy):
+        return (np.asarray(iy, dtype=np.int64) + _OFFSET) * (2 * _OFFSET) + (np.asarray(ix, dtype=np.int64) + _OFFSET)
+
+    def _insert(self, df):
+        df = df.dropna(subset=["lat", "lon"])
+        if df.empty:
+            return
+        lat, lon = df["lat"].to_numpy(np.float64), df["lon"].to_numpy(np.float64)
+        if self._kx is None:
+            self._kx = M_PER_DEG_LON * np.cos(np.radians(float(np.mean(lat))))
+        x, y = self._project(lat, lon)
+        keys = self._cell_key(np.floor(x / self.cell_m), np.floor(y / self.cell_m))
+        order = np.argsort(keys, kind="stable")
+        new = {c: df[c].to_numpy(np.float64)[order] for c in INDEX_COLUMNS}
+        new["x"], new["y"] = x[order], y[order]
+        keys = keys[order]
+        # Inserción ordenada: el índice se reemplaza, nunca se modifica en su lugar
+        pos = np.searchsorted(self._keys, keys, side="right")
+        self._keys = np.insert(self._keys, pos, keys)
+        self._cols = {c: np.insert(self._cols[c], pos, new[c]) for c in self._cols}
+
+    def refresh(self):
+        """Indexa lo que el almacén agregó desde la última vez (solo la cola de cada día)."""
+        version = self.store.version()
+        with self._lock:
+            if version == self._store_version:
+                return
+            tails = []
+            for day in self.store.days():
+                day_version = self.store.day_version(day)
+                done = self._day_versions.get(day, 0)
+                if day_version > done:
+                    # Con tope: lo agregado después de leer day_version entra en el próximo refresh
+                    tails.append(self.store.load_day_since(day, done, day_version))
+                    self._day_versions[day] = day_version
+            if tails:
+                self._insert(pd.concat(tails, ignore_index=True))
+            self._store_version = version
+
+    def __len__(self):
+        return len(self._keys)
+
+    # ---------- Consultas ----------
+    def _snapshot(self):
+        self.refresh()
+        with self._lock:
+            return self._keys, self._cols
+
+    def _candidates(self, keys, x0, x1, y0, y1):
+        """Posiciones de las celdas que tocan el rectángulo proyectado [x0, x1] × [y0, y1]."""
+        ix0, ix1 = int(np.floor(x0 / self.cell_m)), int(np.floor(x1 / self.cell_m))
+        iy = np.arange(int(np.floor(y0 / self.cell_m)), int(np.floor(y1 / self.cell_m)) + 1)
+        if len(iy) > MAX_CELL_ROWS:
+            return np.arange(len(keys))
+        # Cada fila de la malla es un tramo contiguo de keys
+        lo = np.searchsorted(keys, self._cell_key(ix0, iy), side="left")
+        hi = np.searchsorted(keys, self._cell_key(ix1, iy), side="right")
+        spans = [np.arange(a, b) for a, b in zip(lo, hi) if b > a]
+        return np.concatenate(spans) if spans else np.empty(0, dtype=np.int64)
+
+    def _frame(self, cols, pos, dist=None):
+        df = pd.DataFrame({c: cols[c][pos] for c in INDEX_COLUMNS})
+        if dist is not None:
+            df["dist_m"] = dist
+        return df
+
+    def bbox(self, lat_min, lat_max, lon_min, lon_max):
+        """Drops dentro del rectángulo (grados)."""
+        keys, cols = self._snapshot()
+        if not len(keys):
+            return self._frame(cols, np.empty(0, dtype=np.int64))
+        x0, y0 = self._project(lat_min, lon_min)
+        x1, y1 = self._project(lat_max, lon_max)
+        pos = self._candidates(keys, x0, x1, y0, y1)
+        lat, lon = cols["lat"][pos], cols["lon"][pos]
+        pos = pos[(lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)]
+        return self._frame(cols, pos)
+
+    def radius(self, lat, lon, radius_m):
+        """Drops a `radius_m` metros o menos de (lat, lon), del más cercano al más lejano."""
+        keys, cols = self._snapshot()
+        if not len(keys):
+            return self._frame(cols, np.empty(0, dtype=np.int64), np.empty(0))
+        x, y = self._project(lat, lon)
+        # Margen: la escala de la proyección es la de la latitud de referencia
+        r = radius_m * 1.1 + self.cell_m
+        pos = self._candidates(keys, x - r, x + r, y - r, y + r)
+        dist = haversine_m(lat, lon, cols["lat"][pos], cols["lon"][pos])
+        hit = dist <= radius_m
+        pos, dist = pos[hit], dist[hit]
+        order = np.argsort(dist, kind="stable")
+        return self._frame(cols, pos[order], dist[order])
+
+    def nearest(self, lat, lon, k=1):
+        """Los `k` drops más cercanos: el radio crece hasta juntar k dentro del círculo."""
+        r = self.cell_m
+        while True:
+            found = self.radius(lat, lon, r)
+            if len(found) >= k or r >= np.pi * EARTH_RADIUS_M:
+                return found.head(k)
+            r *= 4
+
+    def polygon(self, vertices):
+        """Drops dentro del polígono [(lat, lon), ...] (se cierra solo)."""
+        keys, cols = self._snapshot()
+        vertices = np.asarray(vertices, dtype=np.float64)
+        if not len(keys) or len(vertices) < 3:
+            return self._frame(cols, np.empty(0, dtype=np.int64))
+        px, py = self._project(vertices[:, 0], vertices[:, 1])
+        pos = self._candidates(keys, px.min(), px.max(), py.min(), py.max())
+        pos = pos[points_in_polygon(cols["x"][pos], cols["y"][pos], px, py)]
+        return self._frame(cols, pos)
+
+
+class FleetSpatial:
+    """
+    Un SpatialIndex por dron sobre los almacenes de FleetHistory, compartido
+    por todas las sesiones. Las consultas reciben los drones a considerar.
+    """
+
+    def __init__(self, history, cell_m=CELL_M):
+        self.history = history
+        self.cell_m = cell_m
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def index(self, device):
+        with self._lock:
+            index = self._indexes.get(device)
+            if index is None:
+                index = self._indexes[device] = SpatialIndex(self.history.store(device), self.cell_m)
+            return index
+
+    def count(self, devices):
+        total = 0
+        for d in devices:
+            index = self.index(d)
+            index.refresh()
+            total += len(index)
+        return total
+
+    def _fleet(self, devices, query, sort_by=None):
+        frames = []
+        for d in devices:
+            df = query(self.index(d))
+            if not df.empty:
+                frames.append(df.assign(device=d))
+        if not frames:
+            return pd.DataFrame(columns=list(INDEX_COLUMNS) + ["device"])
+        df = pd.concat(frames, ignore_index=True)
+        if sort_by is not None:
+            df = df.sort_values(sort_by, kind="stable", ignore_index=True)
+        return df
+
+    def bbox(self, devices, lat_min, lat_max, lon_min, lon_max):
+        return self._fleet(devices, lambda ix: ix.bbox(lat_min, lat_max, lon_min, lon_max), "ts")
+
+    def radius(self, devices, lat, lon, radius_m):
+        return self._fleet(devices, lambda ix: ix.radius(lat, lon, radius_m), "dist_m")
+
+    def nearest(self, devices, lat, lon, k=1):
+        # Los k más cercanos de cada dron contienen a los k más cercanos de la flota
+        return self._fleet(devices, lambda ix: ix.nearest(lat, lon, k), "dist_m").head(k)
+
+    def polygon(self, devices, vertices):
+        return self._fleet(devices, lambda ix: ix.polygon(vertices), "ts")
@@ -0,0 +1,55 @@
+import os
+import sys
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import DayPartitionStore, SqliteStore  # noqa: E402
+
+COLUMNS = ["ts", "lat", "lon", "alt", "drop_id", "speed_mps", "sats", "fix_ok"]
+TZ = "America/Mexico_City"
+T0 = 1_760_036_400.0            # 2025-10-09 12:00 hora local
+DAY = date(2025, 10, 9)
+
+
+def rows(start, n):
+    """n filas de telemetría del mismo día, una por segundo, drop_id = posición."""
+    i = np.arange(start, start + n, dtype=np.float64)
+    return pd.DataFrame({"ts": T0 + i, "lat": 19.4 + i * 1e-5, "lon": -99.1, "alt": 10.0,
+                         "drop_id": i, "speed_mps": 1.0 + i % 3, "sats": 9.0, "fix_ok": 1.0})
+
+
+def append_after_version(store, df, after=1):
+    """
+    La llamada número `after` a day_version del almacén agrega `df` justo
+    después de leerse, como una descarga o la ingesta escribiendo entre
+    day_version y load_day_since.
+    """
+    real = store.day_version
+    calls = []
+
+    def day_version(day):
+        version = real(day)
+        calls.append(day)
+        if len(calls) == after:
+            store.day_version = real
+            store.append(df)
+        return version
+
+    store.day_version = day_version
+
+
+def assert_no_duplicates(df):
+    keys = df[["ts", "drop_id"]]
+    assert not keys.duplicated().any(), f"{int(keys.duplicated().sum())} filas repetidas"
+
+
+@pytest.fixture(params=["files", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "files":
+        return DayPartitionStore(str(tmp_path / "history"), COLUMNS, TZ)
+    return SqliteStore(str(tmp_path / "history.db"), COLUMNS, TZ)
@@ -0,0 +1,35 @@
+from conftest import DAY, append_after_version, assert_no_duplicates, rows
+from history_store import DayFrameCache
+
+
+def test_load_day_since_stops_at_until(store):
+    store.append(rows(0, 200))
+    version = store.day_version(DAY)
+    store.append(rows(200, 50))
+    assert len(store.load_day_since(DAY, 0, version)) == 200
+    assert len(store.load_day_since(DAY, version, store.day_version(DAY))) == 50
+
+
+def test_day_frame_no_duplicates_when_rows_arrive_mid_refresh(store):
+    store.append(rows(0, 200))
+    cache = DayFrameCache(store)
+    assert len(cache.day_frame(DAY)) == 200
+
+    store.append(rows(200, 10))
+    append_after_version(store, rows(210, 50))
+    assert len(cache.day_frame(DAY)) == 210
+
+    df = cache.day_frame(DAY)
+    assert len(df) == 260 == store.count()
+    assert_no_duplicates(df)
+    assert cache.day_metrics(DAY)["points"] == 260
+
+
+def test_first_load_no_duplicates_when_rows_arrive(store):
+    store.append(rows(0, 100))
+    cache = DayFrameCache(store)
+    append_after_version(store, rows(100, 50))
+    assert len(cache.day_frame(DAY)) == 100
+    df = cache.day_frame(DAY, newest_first=True)
+    assert len(df) == 150
+    assert_no_duplicates(df)
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from conftest import append_after_version, rows
+from history_store import DayFrameCache
+from missions import MissionIndex
+
+
+def _check(index, store):
+    missions = index.missions()
+    assert sum(m["points"] for m in missions) == store.count()
+    for m in missions:
+        df = index.frame(m)
+        assert len(df) == m["points"]
+        assert df["ts"].max() == m["end_ts"] and df["ts"].min() == m["start_ts"]
+    frames = pd.concat([index.frame(m) for m in missions], ignore_index=True)
+    assert not frames[["ts", "drop_id"]].duplicated().any()
+    return missions
+
+
+def test_missions_follow_rows_appended_mid_refresh(store, tmp_path):
+    path = str(tmp_path / "dev.missions.json")
+    store.append(rows(0, 100))
+    index = MissionIndex("dev", store, DayFrameCache(store), path)
+    assert len(_check(index, store)) == 1
+
+    # La descarga escribe mientras refresh segmenta el día (2.ª lectura de day_version)
+    store.append(rows(100, 10))
+    append_after_version(store, rows(2000, 50), after=2)
+    index.refresh()
+
+    missions = _check(index, store)
+    assert [m["points"] for m in missions] == [110, 50]
+    # El archivo guardado sirve tal cual a quien solo lo lee
+    reader = MissionIndex("dev", store, DayFrameCache(store), path, writable=False)
+    assert reader.missions() == missions
+    _check(reader, store)
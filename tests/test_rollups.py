@@ -0,0 +1,20 @@
+from conftest import DAY, append_after_version, rows
+from rollups import Rollups
+
+
+def test_rollups_count_rows_arriving_mid_refresh_once(store, tmp_path):
+    path = str(tmp_path / "dev.rollups.json")
+    store.append(rows(0, 200))
+    rollups = Rollups(store, path)
+    assert rollups.days(DAY, DAY)[DAY]["points"] == 200
+
+    store.append(rows(200, 10))
+    append_after_version(store, rows(210, 50))
+    assert rollups.days(DAY, DAY)[DAY]["points"] == 210
+
+    day = rollups.days(DAY, DAY)[DAY]
+    assert day["points"] == day["gps_ok"] == day["speed_n"] == 260
+    assert int(day["speed_hist"].sum()) == 260
+    # Lo guardado es lo mismo que en memoria
+    saved = Rollups(store, path, writable=False).days(DAY, DAY)[DAY]
+    assert saved["points"] == 260
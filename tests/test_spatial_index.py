@@ -0,0 +1,21 @@
+from conftest import T0, append_after_version, rows
+from spatial_index import SpatialIndex
+
+
+def test_index_rows_arriving_mid_refresh_once(store):
+    store.append(rows(0, 200))
+    index = SpatialIndex(store)
+    index.refresh()
+    assert len(index) == 200
+
+    store.append(rows(200, 10))
+    append_after_version(store, rows(210, 50))
+    index.refresh()
+    assert len(index) == 210
+
+    index.refresh()
+    assert len(index) == 260
+    found = index.radius(19.4, -99.1, 5_000)
+    assert len(found) == 260
+    assert not found[["ts", "drop_id"]].duplicated().any()
+    assert found["ts"].min() == T0
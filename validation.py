@@ -0,0 +1,76 @@
+# =========================================================
+# Validación de filas de telemetría antes de guardarlas
+# - Todo en bloque con numpy (sin recorrer filas en Python)
+# - Política configurable: rangos de lat/lon/ts y si se exige fix GPS
+# =========================================================
+
+import time
+
+import numpy as np
+
+# ts mínimo aceptado: 2020-01-01 UTC (un RTC sin hora da 1970 o 2000)
+TS_MIN = 1577836800
+
+DEFAULT_POLICY = {
+    "lat": (-90.0, 90.0),
+    "lon": (-180.0, 180.0),
+    "ts_min": TS_MIN,
+    "ts_future_s": 86400.0,   # margen hacia el futuro sobre la hora del servidor
+    "require_fix": False,     # True: descartar filas con fix_ok = 0
+    "null_island": True,      # descartar lat = lon = 0 (GPS sin posición)
+}
+
+
+def make_policy(**overrides):
+    """DEFAULT_POLICY con los cambios dados (los None se ignoran)."""
+    policy = dict(DEFAULT_POLICY)
+    policy.update({k: v for k, v in overrides.items() if v is not None})
+    return policy
+
+
+def _outside(values, lo, hi):
+    # NaN cuenta como fuera de rango
+    with np.errstate(invalid="ignore"):
+        return ~((values >= lo) & (values <= hi))
+
+
+def validate_rows(df, policy=None):
+    """
+    Separa las filas válidas según `policy`.
+    Devuelve (df_validas, {motivo: filas descartadas}); cada fila cuenta
+    solo en el primer motivo que la descarta.
+    """
+    policy = DEFAULT_POLICY if policy is None else policy
+    rejected = {}
+    if df is None or df.empty:
+        return df, rejected
+    ts = df["ts"].to_numpy(dtype=np.float64)
+    lat = df["lat"].to_numpy(dtype=np.float64)
+    lon = df["lon"].to_numpy(dtype=np.float64)
+    checks = [
+        ("ts", _outside(ts, policy["ts_min"], time.time() + policy["ts_future_s"])),
+        ("lat", _outside(lat, *policy["lat"])),
+        ("lon", _outside(lon, *policy["lon"])),
+    ]
+    if policy["null_island"]:
+        checks.append(("null_island", (lat == 0) & (lon == 0)))
+    if policy["require_fix"]:
+        fix = df["fix_ok"].to_numpy(dtype=np.float64)
+        checks.append(("fix_ok", ~(fix > 0)))
+
+    bad = np.zeros(len(df), dtype=bool)
+    for reason, mask in checks:
+        new = mask & ~bad
+        if new.any():
+            rejected[reason] = int(new.sum())
+        bad |= mask
+    if not bad.any():
+        return df, rejected
+    return df[~bad].reset_index(drop=True), rejected
+
+
+def merge_rejected(total, rejected):
+    """Acumula los contadores de validate_rows en `total`."""
+    for reason, n in rejected.items():
+        total[reason] = total.get(reason, 0) + n
+    return total